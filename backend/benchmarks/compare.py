@@ -0,0 +1,76 @@
+import argparse
+import json
+
+# Metrics compared between two runs, with True if higher values are better
+METRICS = (
+    ("latency_p50_ms", False),
+    ("latency_p95_ms", False),
+    ("latency_p99_ms", False),
+    ("throughput_rps", True),
+    ("response_bytes_mean", False),
+    ("peak_rss_bytes", False),
+)
+
+
+def compare(baseline, candidate, threshold=0.1):
+    """
+    Compares the results of two benchmark runs.
+
+    Args:
+        baseline (dict): The report of the reference run.
+        candidate (dict): The report of the compared run.
+        threshold (float): The relative change above which a metric is a regression.
+
+    Returns:
+        list: One (scenario, concurrency, metric, baseline, candidate, change,
+            regression) tuple per metric of the scenarios of both runs.
+    """
+    baseline_results = {
+        (result["scenario"], result["concurrency"]): result
+        for result in baseline["results"]
+    }
+    rows = []
+
+    for result in candidate["results"]:
+        key = (result["scenario"], result["concurrency"])
+        reference = baseline_results.get(key)
+        if reference is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            before, after = reference.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regression = -change > threshold if higher_is_better else change > threshold
+            rows.append((*key, metric, before, after, change, regression))
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares two benchmark results.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+
+    print(f"baseline  {baseline['commit']}\ncandidate {candidate['commit']}\n")
+    rows = compare(baseline, candidate, args.threshold)
+    for scenario, concurrency, metric, before, after, change, regression in rows:
+        flag = "REGRESSION" if regression else ""
+        print(
+            f"{scenario:40} c={concurrency:<3} {metric:20} "
+            f"{before:14.1f} {after:14.1f} {change:+8.1%} {flag}"
+        )
+
+    # A non-zero exit status lets CI jobs fail on regressions
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+import argparse
+import logging
+import math
+
+from pyramid.paster import get_appsettings
+from sqlalchemy import create_engine, text
+
+from geoapp.models.models import Base
+
+log = logging.getLogger(__name__)
+
+# Extent of the generated data in EPSG:26918, roughly the extent of New York City
+EXTENT = (563000.0, 4483000.0, 610000.0, 4530000.0)
+
+# Number of rows of each table at scale 1, the sizes of the NYC workshop dataset
+BASE_ROWS = {
+    "nyc_neighborhoods": 129,
+    "nyc_census_blocks": 38794,
+    "nyc_streets": 19091,
+    "nyc_homicides": 3982,
+    "nyc_subway_stations": 491,
+}
+
+BOROUGHS = "ARRAY['Manhattan', 'Brooklyn', 'Queens', 'The Bronx', 'Staten Island']"
+
+
+def _pick(values):
+    """
+    SQL expression picking a random element of an SQL array literal.
+    """
+    return f"({values})[1 + floor(random() * cardinality({values}))::int]"
+
+
+def _random_x():
+    return f"{EXTENT[0]} + random() * {EXTENT[2] - EXTENT[0]}"
+
+
+def _random_y():
+    return f"{EXTENT[1]} + random() * {EXTENT[3] - EXTENT[1]}"
+
+
+def _grid(rows):
+    """
+    Returns the number of columns and the cell width and height of a square grid of
+    at least ``rows`` cells covering ``EXTENT``.
+    """
+    columns = max(math.ceil(math.sqrt(rows)), 1)
+    return (
+        columns,
+        (EXTENT[2] - EXTENT[0]) / columns,
+        (EXTENT[3] - EXTENT[1]) / columns,
+    )
+
+
+def _statements(scale):
+    """
+    Returns the INSERT statements generating the data of every table.
+    """
+    rows = {name: max(int(count * scale), 1) for name, count in BASE_ROWS.items()}
+    neighborhood_columns, neighborhood_width, neighborhood_height = _grid(
+        rows["nyc_neighborhoods"]
+    )
+    block_columns, block_width, block_height = _grid(rows["nyc_census_blocks"])
+
+    return [
+        # Neighborhoods tile the extent
+        f"""
+        INSERT INTO nyc_neighborhoods (gid, boroname, name, geom)
+        SELECT
+            1 + i * {neighborhood_columns} + j,
+            ({BOROUGHS})[1 + (i * 5 / {neighborhood_columns})],
+            'Neighborhood ' || (1 + i * {neighborhood_columns} + j),
+            ST_Multi(ST_Segmentize(ST_MakeEnvelope(
+                {EXTENT[0]} + i * {neighborhood_width},
+                {EXTENT[1]} + j * {neighborhood_height},
+                {EXTENT[0]} + (i + 1) * {neighborhood_width},
+                {EXTENT[1]} + (j + 1) * {neighborhood_height},
+                26918
+            ), {neighborhood_width / 20}))
+        FROM generate_series(0, {neighborhood_columns - 1}) i,
+            generate_series(0, {neighborhood_columns - 1}) j
+        """,
+        # Census blocks tile the extent with a few vertices per side
+        f"""
+        INSERT INTO nyc_census_blocks (
+            gid, blkid, popn_total, popn_white, popn_black, popn_nativ, popn_asian,
+            popn_other, boroname, geom
+        )
+        SELECT
+            1 + i * {block_columns} + j,
+            lpad((1 + i * {block_columns} + j)::text, 15, '0'),
+            floor(random() * 2000),
+            floor(random() * 800),
+            floor(random() * 600),
+            floor(random() * 20),
+            floor(random() * 400),
+            floor(random() * 180),
+            ({BOROUGHS})[1 + (i * 5 / {block_columns})],
+            ST_Multi(ST_Segmentize(ST_MakeEnvelope(
+                {EXTENT[0]} + i * {block_width},
+                {EXTENT[1]} + j * {block_height},
+                {EXTENT[0]} + (i + 1) * {block_width},
+                {EXTENT[1]} + (j + 1) * {block_height},
+                26918
+            ), {block_width / 4}))
+        FROM generate_series(0, {block_columns - 1}) i,
+            generate_series(0, {block_columns - 1}) j
+        """,
+        # Streets are random walks of 2 to 9 vertices
+        f"""
+        INSERT INTO nyc_streets (gid, id, name, oneway, type, geom)
+        SELECT
+            s.gid,
+            s.gid,
+            'Street ' || s.gid,
+            s.oneway,
+            s.type,
+            ST_Multi(ST_SetSRID(ST_MakeLine(ARRAY(
+                SELECT ST_MakePoint(
+                    s.x + v * s.dx + (random() - 0.5) * 20,
+                    s.y + v * s.dy + (random() - 0.5) * 20
+                )
+                FROM generate_series(0, s.vertices - 1) v
+                ORDER BY v
+            )), 26918))
+        FROM (
+            SELECT
+                g AS gid,
+                {_random_x()} AS x,
+                {_random_y()} AS y,
+                (random() - 0.5) * 200 AS dx,
+                (random() - 0.5) * 200 AS dy,
+                2 + floor(random() * 8)::int AS vertices,
+                {_pick("ARRAY['B', 'FT', 'TF']")} AS oneway,
+                {_pick("ARRAY['residential', 'primary', 'secondary', 'motorway']")}
+                    AS type
+            FROM generate_series(1, {rows["nyc_streets"]}) g
+        ) s
+        """,
+        f"""
+        INSERT INTO nyc_homicides (
+            gid, incident_d, boroname, num_victim, primary_mo, id, weapon, light_dark,
+            year, geom
+        )
+        SELECT
+            h.gid,
+            h.incident_d,
+            {_pick(BOROUGHS)},
+            (1 + floor(random() * 3))::text,
+            {_pick("ARRAY['ROBBERY', 'DISPUTE', 'DOMESTIC', 'UNKNOWN']")},
+            h.gid,
+            {_pick("ARRAY['gun', 'knife', 'other']")},
+            {_pick("ARRAY['D', 'L']")},
+            extract(year FROM h.incident_d),
+            ST_SetSRID(ST_MakePoint({_random_x()}, {_random_y()}), 26918)
+        FROM (
+            SELECT g AS gid, date '2003-01-01' + floor(random() * 3287)::int AS incident_d
+            FROM generate_series(1, {rows["nyc_homicides"]}) g
+        ) h
+        """,
+        f"""
+        INSERT INTO nyc_subway_stations (
+            gid, objectid, id, name, alt_name, cross_st, long_name, label, borough,
+            nghbhd, routes, transfers, color, express, closed, geom
+        )
+        SELECT
+            g,
+            g,
+            g,
+            'Station ' || g,
+            NULL,
+            'Street ' || (1 + floor(random() * {rows["nyc_streets"]})::int),
+            'Station ' || g || ' (' || {_pick("ARRAY['A', 'C', 'E', '1', '2', '3']")} || ')',
+            'Station ' || g,
+            {_pick(BOROUGHS)},
+            NULL,
+            {_pick("ARRAY['A-C-E', '1-2-3', 'N-Q-R', 'L', '7']")},
+            NULL,
+            {_pick("ARRAY['BLUE', 'RED', 'YELLOW', 'GREY', 'PURPLE']")},
+            CASE WHEN random() < 0.2 THEN 'express' END,
+            NULL,
+            ST_SetSRID(ST_MakePoint({_random_x()}, {_random_y()}), 26918)
+        FROM generate_series(1, {rows["nyc_subway_stations"]}) g
+        """,
+        # Every street has a current version, a third of them also a previous one
+        """
+        INSERT INTO nyc_streets_history (
+            gid, id, name, oneway, type, geom, valid_range, created_by, deleted_by
+        )
+        WITH changes AS MATERIALIZED (
+            SELECT
+                s.*,
+                timestamptz '2020-01-01' + random() * interval '1500 days' AS changed,
+                random() < 0.33 AS has_previous
+            FROM nyc_streets s
+        )
+        SELECT gid, id, name, oneway, type, geom, tstzrange(changed, NULL), 'generator', NULL
+        FROM changes
+        UNION ALL
+        SELECT
+            gid, id, name, oneway, type, ST_Translate(geom, 5, 5),
+            tstzrange(timestamptz '2015-01-01', changed), 'generator', 'generator'
+        FROM changes
+        WHERE has_previous
+        """,
+        # Each station is located on its nearest street
+        """
+        INSERT INTO nyc_subway_station_events (subways_gid, streets_gid, measure, distance)
+        SELECT
+            station.gid,
+            street.gid,
+            ST_LineLocatePoint(ST_GeometryN(street.geom, 1), station.geom),
+            ST_Distance(street.geom, station.geom)
+        FROM nyc_subway_stations station
+        CROSS JOIN LATERAL (
+            SELECT gid, geom
+            FROM nyc_streets
+            ORDER BY nyc_streets.geom <-> station.geom
+            LIMIT 1
+        ) street
+        """,
+    ]
+
+
+def create_dataset(engine, scale=1.0, seed=0.42):
+    """
+    Creates the tables of ``geoapp.models`` and fills them with synthetic data shaped
+    like the NYC dataset. The number of rows of each table is ``BASE_ROWS`` multiplied
+    by ``scale``, and the same seed always generates the same data.
+
+    Args:
+        engine (Engine): An engine connected to a PostGIS database. Existing tables of
+            the models are dropped.
+        scale (float): The size of the dataset relative to the NYC dataset.
+        seed (float): The seed of the random generator, between -1 and 1.
+    """
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+        Base.metadata.drop_all(connection)
+        Base.metadata.create_all(connection)
+
+        # Parallel plans would consume the random sequence in a nondeterministic order
+        connection.execute(text("SET LOCAL max_parallel_workers_per_gather = 0"))
+        connection.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+
+        for statement in _statements(scale):
+            connection.execute(text(statement))
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=create_dataset.__doc__.split("\n\n")[0])
+    parser.add_argument("--config", default="benchmarks/benchmark.ini")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=float, default=0.42)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_appsettings(args.config)
+    engine = create_engine(settings["sqlalchemy.url"])
+
+    log.info("Generating the dataset at scale %s", args.scale)
+    create_dataset(engine, args.scale, args.seed)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from pyproj import Transformer
+
+from benchmarks.dataset import EXTENT
+
+log = logging.getLogger(__name__)
+
+# Percentiles of the request latencies reported for each scenario
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _nyc_points(rng, count, srid=3857):
+    """
+    Returns random (x, y) coordinates inside the extent of the generated dataset.
+    """
+    transformer = Transformer.from_crs(26918, srid, always_xy=True)
+    return [
+        transformer.transform(
+            rng.uniform(EXTENT[0], EXTENT[2]), rng.uniform(EXTENT[1], EXTENT[3])
+        )
+        for _ in range(count)
+    ]
+
+
+def _nyc_tiles(rng, count, zoom):
+    """
+    Returns random (z, x, y) tiles of the given zoom level inside the dataset extent.
+    """
+    tiles = []
+    for lon, lat in _nyc_points(rng, count, srid=4326):
+        n = 2**zoom
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        tiles.append((zoom, x, y))
+    return tiles
+
+
+def build_scenarios(seed=0):
+    """
+    Returns the benchmark scenarios: a name and a function returning the (method,
+    path, body) of the i-th request. Requests with random coordinates are generated
+    from ``seed``, so every run sends the same requests.
+    """
+    rng = random.Random(seed)
+    points = _nyc_points(rng, 1000)
+    tiles = _nyc_tiles(rng, 1000, 14)
+    batch = json.dumps({"points": _nyc_points(rng, 1000)}).encode("utf-8")
+    bbox = "-73.99,40.74,-73.96,40.77"
+
+    def fixed(path, method="GET", body=None):
+        return lambda i: (method, path, body)
+
+    scenarios = {
+        "spatial_data": lambda i: (
+            "GET",
+            "/api/spatial_data?x=%r&y=%r" % points[i % len(points)],
+            None,
+        ),
+        "spatial_data_batch_1000": fixed("/api/spatial_data/batch", "POST", batch),
+        "tiles_z14": lambda i: (
+            "GET",
+            "/api/nyc_streets/tiles/%d/%d/%d.pbf" % tiles[i % len(tiles)],
+            None,
+        ),
+    }
+
+    for model in ("nyc_subway_stations", "nyc_homicides", "nyc_streets", "nyc_census_blocks"):
+        scenarios[f"{model}.geojson"] = fixed(f"/api/{model}/geojson")
+        scenarios[f"{model}.geojson_stream"] = fixed(f"/api/{model}/geojson?stream=1")
+        scenarios[f"{model}.geojson_bbox"] = fixed(
+            f"/api/{model}/geojson?bbox={bbox}&zoom=15"
+        )
+
+    for model in ("nyc_streets", "nyc_census_blocks"):
+        for export_format in ("fgb", "arrow", "parquet"):
+            scenarios[f"{model}.{export_format}"] = fixed(
+                f"/api/{model}/export?format={export_format}"
+            )
+
+    scenarios["nyc_streets_history.as_of"] = fixed(
+        "/api/nyc_streets_history/geojson?as_of=2021-06-01T00:00:00%2B00:00"
+    )
+
+    return scenarios
+
+
+def serve(config, port, server, threads):
+    """
+    Runs the application with waitress (WSGI) or uvicorn (ASGI, ``geoapp.asgi``).
+    """
+    if server == "uvicorn":
+        import uvicorn
+
+        from geoapp.asgi import create_app
+
+        uvicorn.run(create_app(config), host="127.0.0.1", port=port, log_level="warning")
+    else:
+        from pyramid.paster import get_app
+        from waitress import serve as waitress_serve
+
+        waitress_serve(get_app(config), host="127.0.0.1", port=port, threads=threads)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"The server did not start listening on port {port}.")
+
+
+def _reset_peak_rss(pid):
+    """
+    Resets the peak RSS (VmHWM) of the process, supported by Linux only.
+    """
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss(pid):
+    """
+    Returns the peak RSS of the process in bytes, or None if it is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = (len(sorted_values) - 1) * percentile / 100
+    lower = math.floor(index)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        index - lower
+    )
+
+
+def run_scenario(port, make_request, requests, concurrency):
+    """
+    Sends ``requests`` requests from ``concurrency`` threads, each thread reusing one
+    HTTP connection, and measures the latency of each complete response.
+
+    Returns:
+        dict: The latencies (in seconds), bytes and errors of the requests, and the
+            wall time of the scenario.
+    """
+    latencies = []
+    sizes = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                method, path, body = make_request(i)
+                headers = {"Content-Type": "application/json"} if body else {}
+                start = time.perf_counter()
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    size = len(response.read())
+                except (OSError, http.client.HTTPException) as error:
+                    connection.close()
+                    with lock:
+                        errors.append(repr(error))
+                    continue
+                latency = time.perf_counter() - start
+                with lock:
+                    if response.status >= 400:
+                        errors.append(f"HTTP {response.status} {path}")
+                    else:
+                        latencies.append(latency)
+                        sizes.append(size)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    return {"latencies": latencies, "sizes": sizes, "errors": errors, "wall_time": wall_time}
+
+
+def summarize(measurement):
+    latencies = sorted(measurement["latencies"])
+    sizes = measurement["sizes"]
+    summary = {
+        "requests": len(latencies) + len(measurement["errors"]),
+        "errors": len(measurement["errors"]),
+        "throughput_rps": len(latencies) / measurement["wall_time"],
+        "latency_mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else None,
+        "latency_max_ms": 1000 * latencies[-1] if latencies else None,
+        "response_bytes_mean": sum(sizes) / len(sizes) if sizes else None,
+        "response_bytes_total": sum(sizes),
+    }
+    for percentile in PERCENTILES:
+        value = _percentile(latencies, percentile)
+        summary[f"latency_p{percentile}_ms"] = 1000 * value if value is not None else None
+    if measurement["errors"]:
+        summary["first_error"] = measurement["errors"][0]
+
+    return summary
+
+
+def _git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain"], text=True))
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def _dataset_rows(config):
+    """
+    Returns the number of rows of each table of the benchmark database.
+    """
+    from pyramid.paster import get_appsettings
+    from sqlalchemy import create_engine, func, select
+
+    from geoapp.models.registry import MODEL_REGISTRY
+
+    engine = create_engine(get_appsettings(config)["sqlalchemy.url"])
+    try:
+        with engine.connect() as connection:
+            return {
+                name: connection.execute(select(func.count()).select_from(model)).scalar()
+                for name, model in MODEL_REGISTRY.items()
+            }
+    finally:
+        engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the geoapp endpoints.")
+    parser.add_argument("--config", default="benchmarks/benchmark.ini")
+    parser.add_argument("--server", choices=("waitress", "uvicorn"), default="waitress")
+    parser.add_argument("--threads", type=int, default=8, help="waitress threads")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--scenario", action="append", help="only run these scenarios")
+    parser.add_argument("--bulk-requests", type=int, default=10,
+                        help="requests of the layer and export scenarios")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    scenarios = build_scenarios(args.seed)
+    names = args.scenario or [
+        name
+        for name in scenarios
+        # The ASGI entry point has no export route
+        if args.server == "waitress" or not name.endswith((".fgb", ".arrow", ".parquet"))
+    ]
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    port = _free_port()
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(args.config, port, args.server, args.threads), daemon=True
+    )
+    process.start()
+    results = []
+
+    try:
+        _wait_for_port(port)
+
+        for name in names:
+            make_request = scenarios[name]
+            interactive = name.startswith(("spatial_data", "tiles"))
+            requests = args.requests if interactive else args.bulk_requests
+
+            run_scenario(port, make_request, args.warmup, 1)
+
+            for concurrency in levels:
+                rss_reset = _reset_peak_rss(process.pid)
+                measurement = run_scenario(port, make_request, requests, concurrency)
+                summary = {
+                    "scenario": name,
+                    "concurrency": concurrency,
+                    **summarize(measurement),
+                    "peak_rss_bytes": _peak_rss(process.pid),
+                    "peak_rss_reset": rss_reset,
+                }
+                results.append(summary)
+                log.info(
+                    "%-40s c=%-3d p50=%8.1f ms p99=%8.1f ms %8.1f req/s errors=%d",
+                    name,
+                    concurrency,
+                    summary["latency_p50_ms"] or 0,
+                    summary["latency_p99_ms"] or 0,
+                    summary["throughput_rps"],
+                    summary["errors"],
+                )
+    finally:
+        process.terminate()
+        process.join()
+
+    commit, dirty = _git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "server": args.server,
+        "threads": args.threads,
+        "config": args.config,
+        "seed": args.seed,
+        "dataset_rows": _dataset_rows(args.config),
+        "results": results,
+    }
+
+    output = args.output or f"benchmarks/results/{(commit or 'unknown')[:12]}-{args.server}.json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    log.info("Results written to %s", output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,43 @@
 from pyramid.config import Configurator
-from sqlalchemy import engine_from_config
-from geoapp.config.route import add_routes
 from pyramid.renderers import JSON
 import datetime
 import decimal
-from geoapp.models.models import DBSession, Base
 
 def main(global_config, **settings):
-    engine = engine_from_config(settings, "sqlalchemy.")
+    # The application modules are imported here rather than by the package, so that
+    # importing a submodule, e.g. the ASGI entry point or a model in a script, does not
+    # load the WSGI stack (profiling, compression, warm-up, spatial index, ...)
+    from geoapp.config.compression import setup_compression
+    from geoapp.config.database import create_engine_from_settings
+    from geoapp.config.profiling import setup_profiling
+    from geoapp.config.route import add_routes
+    from geoapp.config.warmup import warm_up
+    from geoapp.models.models import DBSession, Base
+    from geoapp.services.cache_service import create_response_cache
+    from geoapp.services.enrichment_service import refresh_enrichments_on_startup
+    from geoapp.services.spatial_index import create_spatial_index
+
+    engine = create_engine_from_settings(settings)
     DBSession.configure(bind=engine)
     Base.metadata.bind = engine
+    refresh_enrichments_on_startup(settings, engine)
     config = Configurator(settings=settings)
+    config.registry.response_cache = create_response_cache(settings)
+    config.registry.spatial_index = create_spatial_index(
+        settings, engine, config.registry.response_cache.version_probe
+    )
     json_renderer = JSON()
     json_renderer.add_adapter(decimal.Decimal, decimal_adapter)
     json_renderer.add_adapter(datetime.datetime, datetime_adapter)
     json_renderer.add_adapter(datetime.date, date_adapter)
     config.add_renderer("json", json_renderer)
-    config.include("pyramid_chameleon")
+    setup_profiling(config, engine)
+    setup_compression(config)
     add_routes(config)
     config.scan("geoapp.controllers")
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+    warm_up(settings, engine)
+    return app
 
 def decimal_adapter(obj, request):
     if isinstance(obj, decimal.Decimal):
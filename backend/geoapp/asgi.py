@@ -0,0 +1,257 @@
+import contextlib
+import copy
+import json
+import os
+import re
+
+from pyramid.httpexceptions import HTTPBadRequest, HTTPException, HTTPNotFound
+from pyramid.paster import get_appsettings
+from webob import Request
+
+from geoapp.config.database import create_async_engine_from_settings
+from geoapp.controllers.db_controller import CORS_HEADERS, MAX_TILE_ZOOM
+from geoapp.controllers.request_params import (
+    GEOJSON_PARAMS,
+    SPATIAL_DATA_SRID,
+    RequestParams,
+)
+from geoapp.models.registry import MODEL_REGISTRY
+from geoapp.services.async_db_service import AsyncDbServices, ExecutionPool
+
+# Routes of the ASGI entry point, a subset of the routes of geoapp.config.route
+ROUTES = (
+    ("GET", re.compile(r"/api/spatial_data"), "spatial_data_view"),
+    ("POST", re.compile(r"/api/spatial_data/batch"), "spatial_data_batch_view"),
+    ("GET", re.compile(r"/api/(?P<model>[^/]+)/geojson"), "db_view"),
+    (
+        "GET",
+        re.compile(r"/api/(?P<model>[^/]+)/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.pbf"),
+        "tile_view",
+    ),
+)
+
+
+class AsgiController(RequestParams):
+    """
+    Handles a request of the ASGI entry point. The parameters are parsed and validated
+    as in ``DbController``; the responses are sent through the ASGI ``send`` callable.
+    """
+
+    def __init__(self, app, request, matchdict, send, known_srids):
+        # The SRIDs are loaded before the parameters are parsed, which cannot wait
+        super().__init__(request, lambda: known_srids)
+        self.settings = app.settings
+        self.db_service = app.db_service
+        self.matchdict = matchdict
+        self.send = send
+
+    async def db_view(self):
+        """
+        Streams the GeoJSON FeatureCollection of the requested model, with the filter,
+        bbox, zoom/resolution, history, fields, srid and precision parameters of
+        ``DbController.db_view``. The layer is always streamed, so it cannot be paginated.
+        """
+        model = self.get_model()
+        filters = self.get_filters(model, GEOJSON_PARAMS)
+        options = {
+            "bbox": self.get_bbox(),
+            "tolerance": self.get_simplify_tolerance(),
+            "fields": self.get_fields(model),
+            **self.get_history_filters(model),
+        }
+
+        if self.get_page(model):
+            raise HTTPBadRequest("The limit and cursor parameters cannot be streamed.")
+
+        batch_size = int(self.settings.get("geoapp.stream_batch_size", 1000))
+
+        # The service is shared by the concurrent requests, the copy shares its pools
+        db_service = copy.copy(self.db_service)
+        db_service.target_srid, db_service.precision = self.get_output_options(
+            db_service.target_srid, db_service.precision
+        )
+
+        chunks = db_service.iter_features(
+            model, filters, batch_size=batch_size, **options
+        )
+        async with contextlib.aclosing(chunks):
+            await self.start_response(200, "application/geo+json")
+            async for chunk in chunks:
+                await self.send_body(chunk, more_body=True)
+            await self.send_body(b"")
+
+    async def tile_view(self):
+        """
+        Returns a Mapbox Vector Tile of the requested model, see ``DbController.tile_view``.
+        """
+        model = self.get_model()
+        z, x, y = (int(self.matchdict[key]) for key in ("z", "x", "y"))
+
+        if not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2**z and 0 <= y < 2**z):
+            raise HTTPNotFound("Invalid tile coordinates.")
+
+        tile = await self.db_service.get_tile(model, z, x, y)
+        await self.respond(200, "application/vnd.mapbox-vector-tile", tile)
+
+    async def spatial_data_view(self):
+        """
+        Returns spatial data for given x, y (EPSG:3857) coordinates.
+        """
+        try:
+            x = float(self.request.params.get("x"))
+            y = float(self.request.params.get("y"))
+        except (TypeError, ValueError):
+            raise HTTPBadRequest("Invalid or missing x,y")
+
+        data = await self.db_service.get_spatial_data(x, y)
+        await self.respond_json(data)
+
+    async def spatial_data_batch_view(self):
+        """
+        Returns spatial data for many coordinates sent in the JSON request body, see
+        ``DbController.spatial_data_batch_view``.
+        """
+        srid, points = self.get_points(SPATIAL_DATA_SRID)
+        max_points = int(self.settings.get("geoapp.batch.max_points", 500000))
+
+        if len(points) > max_points:
+            raise HTTPBadRequest(f"Too many points, the maximum is {max_points}.")
+
+        data = await self.db_service.get_spatial_data_batch(
+            points,
+            source_srid=srid,
+            chunk_size=int(self.settings.get("geoapp.batch.chunk_size", 10000)),
+        )
+        await self.respond_json(data)
+
+    def get_model(self):
+        """
+        Returns the model named in the URL.
+
+        Raises:
+            HTTPNotFound: If the model does not exist or has no geometry.
+        """
+        model_name = self.matchdict["model"]
+        model = MODEL_REGISTRY.get(model_name)
+
+        if not model or not hasattr(model, "geom"):
+            raise HTTPNotFound(f"Model '{model_name}' not found.")
+
+        return model
+
+    async def respond_json(self, data):
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        await self.respond(200, "application/json", body)
+
+    async def respond(self, status, content_type, body):
+        await self.start_response(status, content_type, len(body))
+        await self.send_body(body)
+
+    async def start_response(self, status, content_type, content_length=None):
+        headers = [(b"content-type", content_type.encode("latin-1"))]
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        headers.extend(
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in CORS_HEADERS.items()
+        )
+        await self.send({"type": "http.response.start", "status": status, "headers": headers})
+
+    async def send_body(self, body, more_body=False):
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+class GeoappASGI:
+    """
+    ASGI application serving the GeoJSON, tile and spatial data endpoints with
+    SQLAlchemy asyncio and asyncpg.
+
+    Requests are handled on a single event loop, so the number of concurrent requests
+    is not limited by a number of threads. Queries run in two execution pools with
+    separate connection pools (see ``geoapp.async.*`` settings): ``interactive`` for
+    spatial data and tiles, ``bulk`` for GeoJSON layers and batches.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.interactive = ExecutionPool(
+            *create_async_engine_from_settings(settings, "interactive")
+        )
+        self.bulk = ExecutionPool(*create_async_engine_from_settings(settings, "bulk"))
+        self.db_service = AsyncDbServices(self.interactive, self.bulk)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.interactive.dispose()
+                await self.bulk.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle(self, scope, receive, send):
+        request = await self.make_request(scope, receive)
+
+        for method, pattern, view_name in ROUTES:
+            match = pattern.fullmatch(scope["path"])
+            if match and request.method == method:
+                break
+        else:
+            match = None
+
+        # Read once per process (see DbServices.get_known_srids)
+        known_srids = await self.db_service.get_known_srids() if match else None
+        controller = AsgiController(
+            self, request, match.groupdict() if match else {}, send, known_srids
+        )
+        try:
+            if match is None:
+                raise HTTPNotFound()
+            await getattr(controller, view_name)()
+        except HTTPException as error:
+            body = (error.detail or error.title).encode("utf-8")
+            await controller.respond(error.status_code, "text/plain; charset=utf-8", body)
+
+    async def make_request(self, scope, receive):
+        """
+        Builds a WebOb request from the ASGI scope and the complete request body.
+        """
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        query_string = scope["query_string"].decode("latin-1")
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in scope["headers"]
+        ]
+
+        return Request.blank(
+            scope["path"] + ("?" + query_string if query_string else ""),
+            method=scope["method"],
+            headers=headers,
+            body=body,
+        )
+
+
+def create_app(config_uri=None):
+    """
+    Creates the ASGI application from the ``[app:main]`` settings of the .ini file named
+    by ``config_uri`` or the ``GEOAPP_INI`` environment variable, e.g.::
+
+        GEOAPP_INI=production.ini uvicorn --factory geoapp.asgi:create_app
+    """
+    config_uri = config_uri or os.environ.get("GEOAPP_INI", "development.ini")
+
+    return GeoappASGI(get_appsettings(config_uri))
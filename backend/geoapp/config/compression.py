@@ -0,0 +1,244 @@
+import zlib
+
+from pyramid.settings import asbool, aslist
+
+try:
+    import brotli
+except ImportError:
+    # Brotli requires the optional "compression" extra
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    # Zstandard requires the optional "compression" extra
+    zstandard = None
+
+# Content types of the responses worth compressing; Parquet files and PNG images
+# are already compressed
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/geo+json",
+    "application/vnd.mapbox-vector-tile",
+    "application/flatgeobuf",
+    "application/vnd.apache.arrow.stream",
+    "text/plain",
+    "text/html",
+}
+
+# Routes of small responses whose latency matters more than their size; the other
+# routes (layers, exports, batches) are compressed with the bulk levels
+INTERACTIVE_ROUTES = {
+    "db_controller.tile_view",
+    "db_controller.spatial_data_view",
+    "db_controller.nearest_view",
+}
+
+# Compression levels of each route class, by encoding
+DEFAULT_LEVELS = {
+    "interactive": {"zstd": 3, "br": 4, "gzip": 4},
+    "bulk": {"zstd": 9, "br": 7, "gzip": 6},
+}
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        # wbits 31 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+COMPRESSORS = {
+    "zstd": _ZstdCompressor if zstandard is not None else None,
+    "br": _BrotliCompressor if brotli is not None else None,
+    "gzip": _GzipCompressor,
+}
+
+
+def available_encodings(preferred):
+    """
+    Returns the encodings of ``preferred`` whose compression library is installed.
+
+    Raises:
+        ValueError: If an encoding is unknown.
+    """
+    unknown = [encoding for encoding in preferred if encoding not in COMPRESSORS]
+    if unknown:
+        raise ValueError(f"Unknown content encodings: {', '.join(unknown)}.")
+
+    return [encoding for encoding in preferred if COMPRESSORS[encoding] is not None]
+
+
+def compress(body, encoding, level):
+    """
+    Compresses a whole body with the given encoding.
+    """
+    compressor = COMPRESSORS[encoding](level)
+    return compressor.compress(body) + compressor.finish()
+
+
+def iter_compressed(app_iter, encoding, level):
+    """
+    Compresses a streamed body chunk by chunk. Each chunk is flushed so the client
+    receives the data as it is produced instead of when the compressor buffer fills.
+    """
+    compressor = COMPRESSORS[encoding](level)
+    try:
+        for chunk in app_iter:
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush()
+        yield compressor.finish()
+    finally:
+        close = getattr(app_iter, "close", None)
+        if close is not None:
+            close()
+
+
+def etag_variants(etag):
+    """
+    Returns the ETag of a response and the ETags of its compressed variants, which
+    are suffixed with the content encoding.
+    """
+    return [etag, *(f"{etag}-{encoding}" for encoding in COMPRESSORS)]
+
+
+def _vary_on_accept_encoding(response):
+    vary = response.vary or ()
+    if "Accept-Encoding" not in vary:
+        response.vary = (*vary, "Accept-Encoding")
+
+
+def _levels(settings):
+    levels = {}
+    for route_class, defaults in DEFAULT_LEVELS.items():
+        levels[route_class] = {
+            encoding: int(
+                settings.get(
+                    f"geoapp.compression.{route_class}.{encoding}_level", default
+                )
+            )
+            for encoding, default in defaults.items()
+        }
+    return levels
+
+
+def compression_tween_factory(handler, registry):
+    """
+    Tween compressing the responses with the best encoding accepted by the client
+    among ``geoapp.compression.encodings``. Streamed bodies are compressed
+    incrementally; buffered bodies with an ETag come from the response cache, so their
+    compressed variants are stored in it too and repeated requests are not compressed
+    again. The level depends on the encoding and on whether the route is interactive
+    (see ``INTERACTIVE_ROUTES``) or bulk.
+    """
+    settings = registry.settings
+    encodings = available_encodings(
+        aslist(settings.get("geoapp.compression.encodings", "zstd br gzip"))
+    )
+    min_size = int(settings.get("geoapp.compression.min_size", 1024))
+    levels = _levels(settings)
+    cache = registry.response_cache
+
+    def compression_tween(request):
+        response = handler(request)
+
+        if response.status_code == 304:
+            # The representation that is not modified depends on Accept-Encoding
+            _vary_on_accept_encoding(response)
+            return response
+
+        if (
+            response.status_code != 200
+            or response.content_type not in COMPRESSIBLE_TYPES
+            or response.content_encoding is not None
+        ):
+            return response
+
+        _vary_on_accept_encoding(response)
+
+        if "Accept-Encoding" not in request.headers:
+            return response
+        offers = request.accept_encoding.acceptable_offers(encodings)
+        if not offers:
+            return response
+        encoding = offers[0][0]
+
+        route = request.matched_route.name if request.matched_route else ""
+        route_class = "interactive" if route in INTERACTIVE_ROUTES else "bulk"
+        level = levels[route_class][encoding]
+
+        if response.content_length is None:
+            response.app_iter = iter_compressed(response.app_iter, encoding, level)
+            # Each encoding is a different representation with its own ETag
+            if response.etag is not None:
+                response.etag = f"{response.etag}-{encoding}"
+        elif response.content_length >= min_size:
+            etag = response.etag
+            if etag is None:
+                response.body = compress(response.body, encoding, level)
+            else:
+                etag = f"{etag}-{encoding}"
+                body = cache.get(etag)
+                if body is None:
+                    body = compress(response.body, encoding, level)
+                    cache.set(etag, body)
+                response.body = body
+                response.etag = etag
+        else:
+            return response
+
+        response.content_encoding = encoding
+
+        return response
+
+    return compression_tween
+
+
+def setup_compression(config):
+    """
+    Registers the compression tween if ``geoapp.compression.enabled`` is set (the
+    default), inside the timing tween so that the compressed bytes are counted.
+    """
+    if not asbool(config.registry.settings.get("geoapp.compression.enabled", True)):
+        return
+
+    config.add_tween(
+        "geoapp.config.compression.compression_tween_factory",
+        under="geoapp.config.profiling.timing_tween_factory",
+    )
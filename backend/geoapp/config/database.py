@@ -0,0 +1,188 @@
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import engine_from_config, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from geoapp.services.metrics_service import METRICS
+
+# Pool settings used when they are not set in the .ini file
+POOL_DEFAULTS = {
+    "sqlalchemy.pool_size": "5",
+    "sqlalchemy.max_overflow": "10",
+    "sqlalchemy.pool_timeout": "30",
+    "sqlalchemy.pool_recycle": "1800",
+    "sqlalchemy.pool_pre_ping": "true",
+}
+
+# Settings of the execution pools of the ASGI entry point used when they are not set
+# in the .ini file, by pool name (see ``create_async_engine_from_settings``)
+ASYNC_POOL_DEFAULTS = {
+    "interactive": {
+        "pool_size": "10",
+        "max_overflow": "10",
+        "pool_timeout": "30",
+        "max_concurrency": "20",
+    },
+    "bulk": {
+        "pool_size": "2",
+        "max_overflow": "0",
+        "pool_timeout": "30",
+        "max_concurrency": "2",
+    },
+}
+
+checkout_wait = METRICS.histogram(
+    "geoapp_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool.",
+)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool recording how long each checkout waits for a connection, including the
+    time needed to open a new connection when the pool is not yet full.
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            checkout_wait.observe(time.perf_counter() - start)
+
+
+def create_engine_from_settings(settings):
+    """
+    Creates the SQLAlchemy engine from the ``sqlalchemy.*`` and ``geoapp.db.*`` settings.
+
+    The pool is configured by ``sqlalchemy.pool_size``, ``max_overflow``, ``pool_timeout``,
+    ``pool_recycle`` and ``pool_pre_ping`` (see ``POOL_DEFAULTS``). ``geoapp.db.statement_timeout``
+    limits the duration of each statement in milliseconds (0 disables the limit).
+
+    With ``geoapp.db.pgbouncer`` the application connects through a transaction pooler:
+    server-side prepared statements are disabled and the statement timeout is set for
+    each transaction instead of each connection, because session state is not kept
+    between transactions.
+    """
+    settings = {**POOL_DEFAULTS, **settings}
+    settings["sqlalchemy.pool_pre_ping"] = asbool(settings["sqlalchemy.pool_pre_ping"])
+    pgbouncer = asbool(settings.get("geoapp.db.pgbouncer", False))
+    statement_timeout = int(settings.get("geoapp.db.statement_timeout", 0))
+
+    engine = engine_from_config(settings, "sqlalchemy.", poolclass=TimedQueuePool)
+    register_pool_metrics(engine)
+
+    if statement_timeout:
+        if pgbouncer:
+
+            @event.listens_for(engine, "begin")
+            def set_local_statement_timeout(connection):
+                connection.exec_driver_sql(
+                    f"SET LOCAL statement_timeout = {statement_timeout}"
+                )
+
+        else:
+
+            @event.listens_for(engine, "connect")
+            def set_statement_timeout(dbapi_connection, connection_record):
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f"SET statement_timeout = {statement_timeout}")
+                # Keep the setting out of the transaction that psycopg2 opened
+                dbapi_connection.commit()
+
+    if pgbouncer:
+        engine = engine.execution_options(geoapp_prepared_statements=False)
+
+    return engine
+
+
+def create_async_engine_from_settings(settings, pool_name):
+    """
+    Creates the SQLAlchemy asyncio engine (asyncpg driver) of an execution pool of the
+    ASGI entry point, from the ``geoapp.async.<pool_name>.*`` settings.
+
+    The database URL is ``geoapp.async.url``, or ``sqlalchemy.url`` with the asyncpg
+    driver. Each pool has its own ``pool_size``, ``max_overflow``, ``pool_timeout`` and
+    ``statement_timeout`` (defaulting to ``geoapp.db.statement_timeout``), see
+    ``ASYNC_POOL_DEFAULTS``. With ``geoapp.db.pgbouncer`` the prepared statement cache
+    of asyncpg is disabled and the timeout is set for each transaction.
+
+    Returns:
+        tuple: The AsyncEngine and the maximum number of concurrent operations of the pool.
+    """
+    # Imported here because only the ASGI entry point needs the asyncio extension,
+    # which would otherwise add to the import time of every WSGI worker
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    prefix = f"geoapp.async.{pool_name}."
+    pool_settings = {
+        **ASYNC_POOL_DEFAULTS[pool_name],
+        **{
+            key[len(prefix) :]: value
+            for key, value in settings.items()
+            if key.startswith(prefix)
+        },
+    }
+    pgbouncer = asbool(settings.get("geoapp.db.pgbouncer", False))
+    statement_timeout = int(
+        pool_settings.get(
+            "statement_timeout", settings.get("geoapp.db.statement_timeout", 0)
+        )
+    )
+
+    url = settings.get("geoapp.async.url")
+    if url is None:
+        url = make_url(settings["sqlalchemy.url"]).set(drivername="postgresql+asyncpg")
+
+    connect_args = {}
+    if pgbouncer:
+        # Named prepared statements do not survive the switch of server connection
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_cache_size"] = 0
+    elif statement_timeout:
+        connect_args["server_settings"] = {"statement_timeout": str(statement_timeout)}
+
+    engine = create_async_engine(
+        url,
+        pool_size=int(pool_settings["pool_size"]),
+        max_overflow=int(pool_settings["max_overflow"]),
+        pool_timeout=float(pool_settings["pool_timeout"]),
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+
+    if pgbouncer and statement_timeout:
+
+        @event.listens_for(engine.sync_engine, "begin")
+        def set_local_statement_timeout(connection):
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {statement_timeout}")
+
+    return engine, int(pool_settings["max_concurrency"])
+
+
+def register_pool_metrics(engine):
+    """
+    Exports the utilization of the engine's connection pool as gauges.
+    """
+    pool = engine.pool
+
+    METRICS.gauge(
+        "geoapp_db_pool_size", "Number of connections kept in the pool.", pool.size
+    )
+    METRICS.gauge(
+        "geoapp_db_pool_checked_out",
+        "Number of connections currently checked out of the pool.",
+        pool.checkedout,
+    )
+    METRICS.gauge(
+        "geoapp_db_pool_checked_in",
+        "Number of idle connections in the pool.",
+        pool.checkedin,
+    )
+    METRICS.gauge(
+        "geoapp_db_pool_overflow",
+        "Number of overflow connections opened beyond the pool size.",
+        pool.overflow,
+    )
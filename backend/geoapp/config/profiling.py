@@ -0,0 +1,271 @@
+import cProfile
+import io
+import logging
+import pstats
+import random
+import time
+
+from pyramid.events import BeforeRender, ContextFound
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+from sqlalchemy import event
+
+from geoapp.services.metrics_service import METRICS, current_timings
+from geoapp.services.prepared_statements import prepare_compiled
+
+log = logging.getLogger(__name__)
+
+request_duration = METRICS.histogram(
+    "geoapp_request_duration_seconds",
+    "Duration of requests until the response is returned to the server.",
+    ("route", "method", "status"),
+)
+phase_duration = METRICS.histogram(
+    "geoapp_request_phase_seconds",
+    "Time spent in each phase of request handling.",
+    ("route", "phase"),
+)
+statement_duration = METRICS.histogram(
+    "geoapp_db_statement_duration_seconds",
+    "Execution time of database statements.",
+    ("route",),
+)
+statements_total = METRICS.counter(
+    "geoapp_db_statements_total", "Number of executed database statements.", ("route",)
+)
+rows_total = METRICS.counter(
+    "geoapp_db_rows_total", "Number of rows returned by database statements.", ("route",)
+)
+response_bytes_total = METRICS.counter(
+    "geoapp_response_bytes_total", "Number of bytes of response bodies.", ("route",)
+)
+
+
+class RequestTimings:
+    """
+    Durations (in seconds) of the phases of a single request and the statements it
+    executed.
+    """
+
+    def __init__(self, route, keep_statements=False):
+        self.route = route
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.statement_count = 0
+        self.rows = 0
+        self.render_start = None
+        self.keep_statements = keep_statements
+        self.statements = []
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def add_statement(self, statement, parameters, duration, rows):
+        self.add("db", duration)
+        self.statement_count += 1
+        if rows > 0:
+            self.rows += rows
+        if self.keep_statements:
+            self.statements.append((statement, parameters))
+
+    def server_timing(self, total):
+        """
+        Formats the timings as the value of a Server-Timing header (durations in ms).
+        """
+        phases = dict(self.phases)
+        view = phases.pop("view", 0.0)
+        # Time spent in the view itself, excluding the database and rendering
+        phases["app"] = max(view - phases.get("db", 0.0) - phases.get("fetch", 0.0), 0.0)
+        phases["total"] = total
+
+        entries = []
+        for name, duration in phases.items():
+            entry = f"{name};dur={duration * 1000:.2f}"
+            if name == "db":
+                entry += f';desc="{self.statement_count} statements, {self.rows} rows"'
+            entries.append(entry)
+
+        return ", ".join(entries)
+
+
+def timing_tween_factory(handler, registry):
+    """
+    Tween measuring each request, adding a Server-Timing header to the response and
+    exporting the timings as metrics. Requests are optionally sampled for profiling
+    (see ``geoapp.profiling.*`` settings).
+    """
+    settings = registry.settings
+    sample_rate = float(settings.get("geoapp.profiling.sample_rate", 0))
+    threshold = float(settings.get("geoapp.profiling.threshold_ms", 1000)) / 1000
+    explain = asbool(settings.get("geoapp.profiling.explain", False))
+    server_timing = asbool(settings.get("geoapp.profiling.server_timing", True))
+
+    def timing_tween(request):
+        sampled = sample_rate > 0 and random.random() < sample_rate
+        timings = RequestTimings("", keep_statements=sampled and explain)
+        token = current_timings.set(timings)
+        profile = cProfile.Profile() if sampled else None
+
+        try:
+            if profile is not None:
+                profile.enable()
+            try:
+                response = handler(request)
+            finally:
+                if profile is not None:
+                    profile.disable()
+        finally:
+            current_timings.reset(token)
+
+        total = time.perf_counter() - timings.start
+        route = timings.route
+
+        if server_timing:
+            response.headers["Server-Timing"] = timings.server_timing(total)
+
+        request_duration.observe(
+            total, route=route, method=request.method, status=response.status_code
+        )
+        for phase, duration in timings.phases.items():
+            phase_duration.observe(duration, route=route, phase=phase)
+        statements_total.inc(timings.statement_count, route=route)
+        rows_total.inc(timings.rows, route=route)
+
+        if response.content_length is not None:
+            response_bytes_total.inc(response.content_length, route=route)
+        elif response.app_iter is not None:
+            response.app_iter = _count_bytes(response.app_iter, route)
+
+        if sampled and total >= threshold:
+            _log_profile(request, total, profile, timings, explain)
+
+        return response
+
+    return timing_tween
+
+
+def _count_bytes(app_iter, route):
+    """
+    Wraps a streamed body to count its bytes once it has been sent.
+    """
+    size = 0
+    try:
+        for chunk in app_iter:
+            size += len(chunk)
+            yield chunk
+    finally:
+        close = getattr(app_iter, "close", None)
+        if close is not None:
+            close()
+        response_bytes_total.inc(size, route=route)
+
+
+def _log_profile(request, total, profile, timings, explain):
+    """
+    Logs the cProfile statistics of a slow request and, with ``explain``, the
+    EXPLAIN (ANALYZE, BUFFERS) output of its SELECT statements, including those run
+    as prepared statements.
+    """
+    output = io.StringIO()
+    pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(30)
+    log.warning(
+        "Slow request %s %s (%.0f ms)\n%s",
+        request.method,
+        request.path_qs,
+        total * 1000,
+        output.getvalue(),
+    )
+
+    if not explain:
+        return
+
+    engine = request.registry.engine
+    for statement, parameters in timings.statements:
+        words = statement.split(None, 2)
+        keyword = words[0].upper() if words else ""
+        if keyword not in ("SELECT", "WITH", "EXECUTE"):
+            continue
+        try:
+            with engine.connect() as connection:
+                if keyword == "EXECUTE":
+                    # Statements of execute_prepared, which may not be prepared on
+                    # this connection yet
+                    name = words[1].split("(", 1)[0]
+                    prepare_compiled(connection, name)
+                plan = connection.exec_driver_sql(
+                    "EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters
+                ).scalars()
+                log.warning("Plan of %s\n%s", statement, "\n".join(plan))
+        except Exception:
+            log.exception("Could not explain %s", statement)
+
+
+def _on_context_found(event):
+    timings = current_timings.get()
+    if timings is None:
+        return
+    if event.request.matched_route is not None:
+        timings.route = event.request.matched_route.name
+    timings.add("routing", time.perf_counter() - timings.start)
+
+
+def _on_before_render(event):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.render_start = time.perf_counter()
+
+
+def timing_view(view, info):
+    """
+    View deriver measuring the view callable and its renderer separately.
+    """
+
+    def wrapper(context, request):
+        timings = current_timings.get()
+        if timings is None:
+            return view(context, request)
+
+        start = time.perf_counter()
+        try:
+            return view(context, request)
+        finally:
+            end = time.perf_counter()
+            render = end - timings.render_start if timings.render_start else 0.0
+            timings.add("view", end - start - render)
+            timings.add("render", render)
+
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is discarded even if the statement fails
+    if context is not None:
+        context._geoapp_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_geoapp_query_start", None)
+    if start is None:
+        return
+
+    duration = time.perf_counter() - start
+    timings = current_timings.get()
+    route = timings.route if timings is not None else ""
+
+    statement_duration.observe(duration, route=route)
+    if timings is not None:
+        timings.add_statement(statement, parameters, duration, cursor.rowcount)
+
+
+def setup_profiling(config, engine):
+    """
+    Registers the timing tween, view deriver, event subscribers and engine events.
+    """
+    config.registry.engine = engine
+    config.add_tween("geoapp.config.profiling.timing_tween_factory", under=INGRESS)
+    config.add_view_deriver(timing_view)
+    config.add_subscriber(_on_context_found, ContextFound)
+    config.add_subscriber(_on_before_render, BeforeRender)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
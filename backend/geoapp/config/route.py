@@ -1,3 +1,13 @@
 def add_routes(config):
     config.add_route("db_controller.db_view", "/api/{model}/geojson")
-    config.add_route("db_controller.spatial_data_view", "/api/spatial_data")
\ No newline at end of file
+    config.add_route("db_controller.export_view", "/api/{model}/export")
+    config.add_route("db_controller.aggregate_view", "/api/{model}/aggregate")
+    config.add_route("db_controller.topojson_view", "/api/{model}/topojson")
+    config.add_route("db_controller.nearest_view", "/api/{model}/nearest")
+    config.add_route("db_controller.nearest_batch_view", "/api/{model}/nearest/batch")
+    config.add_route("db_controller.spatial_data_view", "/api/spatial_data")
+    config.add_route(
+        "db_controller.spatial_data_batch_view", "/api/spatial_data/batch"
+    )
+    config.add_route("db_controller.tile_view", "/api/{model}/tiles/{z}/{x}/{y}.pbf")
+    config.add_route("metrics_controller.metrics_view", "/metrics")
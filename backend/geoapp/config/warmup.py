@@ -0,0 +1,151 @@
+import logging
+import time
+
+from pyramid.settings import asbool, aslist
+from sqlalchemy import Text, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import configure_mappers
+
+from geoapp.models.registry import MODEL_REGISTRY
+from geoapp.services.db_service import DbServices
+from geoapp.services.prepared_statements import prepare
+
+log = logging.getLogger(__name__)
+
+# Names of the existing tables among a list of names
+EXISTING_TABLES = text(
+    "SELECT table_name FROM unnest(:table_names) AS table_name "
+    "WHERE to_regclass(table_name) IS NOT NULL"
+).bindparams(bindparam("table_names", type_=ARRAY(Text)))
+
+# Whether the pg_prewarm extension is installed
+PREWARM_INSTALLED = text("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+
+# Loads the pages of every index of a table into the shared buffers
+PREWARM_INDEXES = text(
+    "SELECT pg_prewarm(indexrelid::regclass) FROM pg_index "
+    "WHERE indrelid = CAST(:table_name AS regclass)"
+).bindparams(bindparam("table_name"))
+
+
+def warm_up(settings, engine):
+    """
+    Pays the costs of the first requests of a worker before it accepts traffic, if
+    ``geoapp.warmup.enabled`` is set:
+
+    - configures the SQLAlchemy mappers;
+    - opens ``geoapp.warmup.connections`` connections of the pool (the pool size by
+      default) and prepares the statements of the most frequent requests on each of
+      them (see ``DbServices.get_hot_statements``), unless prepared statements are
+      disabled;
+    - with ``geoapp.warmup.prewarm``, loads the indexes of the
+      ``geoapp.warmup.prewarm_tables`` tables (all layers by default) into the shared
+      buffers with the pg_prewarm extension.
+
+    Tables that do not exist, such as the enrichment tables before their first
+    refresh, are skipped. A statement or table that fails is logged and skipped too,
+    and any other failure stops the warm-up but not the worker, since the warm-up
+    only saves time.
+    """
+    if not asbool(settings.get("geoapp.warmup.enabled", False)):
+        return
+
+    start = time.perf_counter()
+
+    try:
+        configure_mappers()
+        _warm_up_connections(settings, engine)
+    except Exception:
+        log.warning("Warm-up failed", exc_info=True)
+        return
+
+    log.info("Warm-up done in %.0f ms", (time.perf_counter() - start) * 1000)
+
+
+def _warm_up_connections(settings, engine):
+    count = int(
+        settings.get(
+            "geoapp.warmup.connections", settings.get("sqlalchemy.pool_size", 5)
+        )
+    )
+    models = [model for model in MODEL_REGISTRY.values() if hasattr(model, "geom")]
+    connections = []
+
+    try:
+        # The connections are held together so that the pool opens all of them
+        for _ in range(count):
+            connections.append(engine.connect())
+
+        if not connections:
+            return
+
+        # The enrichment tables only exist once they have been refreshed
+        existing_tables = _existing_tables(
+            connections[0], [model.__tablename__ for model in models]
+        )
+        models = [model for model in models if model.__tablename__ in existing_tables]
+        statements = DbServices(None).get_hot_statements(models)
+
+        for connection in connections:
+            if connection.get_execution_options().get("geoapp_prepared_statements", True):
+                for name, stmt in statements:
+                    _prepare(connection, name, stmt)
+            # Prepared statements outlive the transaction
+            connection.commit()
+
+        if asbool(settings.get("geoapp.warmup.prewarm", False)):
+            tables = aslist(
+                settings.get(
+                    "geoapp.warmup.prewarm_tables",
+                    " ".join(model.__tablename__ for model in models),
+                )
+            )
+            _prewarm(connections[0], tables)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def _existing_tables(connection, table_names):
+    """
+    Returns the names of the tables that exist among ``table_names``.
+    """
+    existing_tables = set(
+        connection.execute(EXISTING_TABLES, {"table_names": table_names}).scalars()
+    )
+    missing_tables = [name for name in table_names if name not in existing_tables]
+
+    if missing_tables:
+        log.info("Warm-up skips the missing tables: %s", ", ".join(missing_tables))
+
+    return existing_tables
+
+
+def _prepare(connection, name, stmt):
+    try:
+        prepare(connection, name, stmt)
+    except DBAPIError:
+        # The failed statement aborted the transaction, not the prepared statements
+        connection.rollback()
+        log.warning("Warm-up could not prepare %s", name, exc_info=True)
+
+
+def _prewarm(connection, tables):
+    """
+    Loads the indexes of the tables into the shared buffers, so the first spatial
+    queries do not read the pages of their GiST indexes from disk.
+    """
+    if connection.execute(PREWARM_INSTALLED).scalar() is None:
+        log.warning("Cannot prewarm the indexes, the pg_prewarm extension is missing.")
+        return
+
+    for table_name in _existing_tables(connection, tables):
+        try:
+            connection.execute(PREWARM_INDEXES, {"table_name": table_name})
+            connection.commit()
+        except DBAPIError:
+            connection.rollback()
+            log.warning(
+                "Could not prewarm the indexes of %s", table_name, exc_info=True
+            )
@@ -1,11 +1,54 @@
+import math
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest
-from geoapp.services.db_service import DbServices
+from pyramid.response import Response
+from pyramid.settings import asbool
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPNotFound,
+    HTTPNotImplemented,
+    HTTPNotModified,
+)
+from pyramid.renderers import render
+from geoapp.config.compression import etag_variants
+from geoapp.controllers.request_params import (
+    AGGREGATE_PARAMS,
+    DEFAULT_SRID,
+    EXPORT_PARAMS,
+    GEOJSON_PARAMS,
+    NEAREST_BATCH_PARAMS,
+    NEAREST_PARAMS,
+    SPATIAL_DATA_SRID,
+    TOPOJSON_PARAMS,
+    RequestParams,
+)
+from geoapp.services.db_service import AGGREGATION_METHODS, DbServices
+from geoapp.services.export_service import EXPORT_FORMATS, ExportService
+from geoapp.services.topojson import DEFAULT_QUANTIZATION
 from geoapp.models.registry import MODEL_REGISTRY
 from geoapp.models.models import DBSession
 
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
 
-class DbController:
+# Highest zoom level served by the vector tile endpoint
+MAX_TILE_ZOOM = 24
+
+# Size in pixels of the aggregation cells when it is derived from the zoom level
+AGGREGATE_CELL_PIXELS = 64
+
+# Highest number of k-means clusters of the aggregation endpoint
+MAX_AGGREGATE_CLUSTERS = 1000
+
+# Number of features returned per point by the nearest endpoint without a radius,
+# and the highest number of features per point
+DEFAULT_NEAREST_K = 10
+MAX_NEAREST_K = 1000
+
+
+class DbController(RequestParams):
     """
     Controller for handling database operations and managing filters for
     model queries. It provides methods for extracting filter parameters from
@@ -14,8 +57,10 @@ class DbController:
     """
 
     def __init__(self, request):
-        self.request = request
-        self.db_service = DbServices(DBSession)
+        self.db_service = DbServices(
+            DBSession, spatial_index=request.registry.spatial_index
+        )
+        super().__init__(request, self.db_service.get_known_srids)
 
     @view_config(
         route_name="db_controller.db_view",
@@ -28,11 +73,28 @@ class DbController:
         retrieves the corresponding filters, fetches the relevant data from the database, and returns
         the data in JSON format. The response is configured to allow cross-origin requests.
 
+        When the ``stream`` parameter is set, the FeatureCollection is streamed in batches
+        instead of being built in a single query (see ``stream_features``). The ``bbox``,
+        ``zoom`` and ``resolution`` parameters limit the response to the visible part of
+        the layer, simplified to the requested map scale. History models can be queried
+        at an instant or between two instants (see ``get_history_filters``). The
+        ``srid`` and ``precision`` parameters set the coordinate system and the number
+        of decimal digits of the returned coordinates (see ``get_output_options``).
+
+        Large layers can be read in pages: ``limit`` returns at most that many
+        features ordered by primary key with a ``next_cursor`` member, passed as the
+        ``cursor`` parameter to read the next page (see ``get_page``). ``fields``
+        selects the returned properties (see ``get_fields``).
+
+        Responses carry an ETag derived from the request and the table version, and
+        non-streamed responses are served from the response cache when possible.
+
         Raises:
             HTTPNotFound: If the model specified in the request URL is not found in the model registry.
+            HTTPNotModified: If the ETag sent in If-None-Match is still current.
 
         Returns:
-            dict: The data fetched from the database based on the model and filter parameters specified in the request.
+            Response: The data fetched from the database based on the model and filter parameters specified in the request.
         """
         model_name = self.request.matchdict.get("model")
         model = MODEL_REGISTRY.get(model_name)
@@ -40,19 +102,392 @@ class DbController:
         if not model:
             raise HTTPNotFound(f"Model '{model_name}' not found.")
 
-        filters = self.get_filters(model)
-        data = self.db_service.get_features(model, filters)
+        filters = self.get_filters(model, GEOJSON_PARAMS)
+        options = {
+            "bbox": self.get_bbox(),
+            "tolerance": self.get_simplify_tolerance(),
+            "fields": self.get_fields(model),
+            **self.get_history_filters(model),
+        }
+        page = self.get_page(model)
+        self.set_output_options()
+        stream = asbool(self.request.params.get("stream"))
+
+        if stream and page:
+            raise HTTPBadRequest("The limit and cursor parameters cannot be streamed.")
+
+        key_parts = (
+            "geojson",
+            sorted(filters.items()),
+            sorted(options.items()),
+            sorted(page.items()),
+            self.db_service.target_srid,
+            self.db_service.precision,
+        )
+
+        if stream:
+            etag, last_modified = self.check_not_modified(model, key_parts)
+            response = self.stream_features(model, filters, options)
+            response.etag = etag
+            response.last_modified = last_modified
+            return response
+
+        return self.cached_response(
+            model,
+            key_parts,
+            "application/json",
+            lambda: render(
+                "json",
+                self.db_service.get_features(model, filters, **options, **page),
+                self.request,
+            ).encode("utf-8"),
+        )
+
+    @view_config(
+        route_name="db_controller.export_view",
+        request_method="GET",
+    )
+    def export_view(self):
+        """
+        Streams all features of the requested model (matching the filter and bbox
+        parameters) as a FlatGeobuf file, an Arrow IPC stream or a GeoParquet file,
+        selected by the ``format`` parameter (``fgb``, ``arrow`` or ``parquet``), in
+        the coordinate system of the ``srid`` parameter. FlatGeobuf files are built in
+        one piece by PostGIS, so they are limited to
+        ``geoapp.export_fgb_max_features`` features.
+
+        Raises:
+            HTTPNotFound: If the model does not exist or has no geometry.
+            HTTPBadRequest: If the format is missing or unknown, or a FlatGeobuf file
+                would have too many features.
+            HTTPNotImplemented: If the format requires an optional dependency that is not installed.
+
+        Returns:
+            Response: The streamed file.
+        """
+        model_name = self.request.matchdict.get("model")
+        model = MODEL_REGISTRY.get(model_name)
+
+        if not model or not hasattr(model, "geom"):
+            raise HTTPNotFound(f"Model '{model_name}' not found.")
+
+        export_format = self.request.params.get("format")
+
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPBadRequest(
+                f"Invalid format, expected one of: {', '.join(EXPORT_FORMATS)}."
+            )
+
+        filters = self.get_filters(model, EXPORT_PARAMS)
+        bbox = self.get_bbox()
+        self.set_output_options()
+        settings = self.request.registry.settings
+        batch_size = int(settings.get("geoapp.export_batch_size", 10000))
+        max_fgb_features = int(settings.get("geoapp.export_fgb_max_features", 500000))
+
+        try:
+            app_iter = ExportService(self.db_service).iter_export(
+                model, filters, export_format, bbox, batch_size, max_fgb_features
+            )
+        except RuntimeError as error:
+            raise HTTPNotImplemented(str(error))
+        except ValueError as error:
+            raise HTTPBadRequest(str(error))
+
+        content_type, extension = EXPORT_FORMATS[export_format]
+        response = Response(app_iter=app_iter, content_type=content_type)
+        response.content_disposition = f'attachment; filename="{model_name}.{extension}"'
+        response.headers.update(CORS_HEADERS)
+
+        return response
+
+    @view_config(
+        route_name="db_controller.aggregate_view",
+        request_method="GET",
+    )
+    def aggregate_view(self):
+        """
+        Returns the points of a point model aggregated into buckets with their counts, as
+        a GeoJSON FeatureCollection (see ``DbServices.get_aggregates``). Parameters:
+
+        - ``method``: ``grid``, ``hex``, ``snap`` (cells of ``cell_size`` meters) or
+          ``kmeans`` (``k`` clusters, 100 by default);
+        - ``cell_size``: the cell size in meters, by default ``AGGREGATE_CELL_PIXELS``
+          pixels at the requested ``zoom`` or ``resolution``;
+        - ``group_by``: a column aggregated separately for each of its values;
+        - ``date_from``, ``date_to``: inclusive dates filtering the date column;
+        - ``bbox``, ``srid``, ``precision`` and the filter parameters of ``db_view``.
+
+        Raises:
+            HTTPNotFound: If the model does not exist or is not a point model.
+            HTTPBadRequest: If a parameter is missing or invalid.
+
+        Returns:
+            Response: The GeoJSON FeatureCollection of the buckets.
+        """
+        model_name = self.request.matchdict.get("model")
+        model = MODEL_REGISTRY.get(model_name)
+
+        if not model or not hasattr(model, "geom"):
+            raise HTTPNotFound(f"Model '{model_name}' not found.")
+
+        if model.geom.type.geometry_type not in ("POINT", "MULTIPOINT"):
+            raise HTTPNotFound(f"Model '{model_name}' is not a point model.")
+
+        params = self.request.params
+        method = params.get("method", "grid")
+
+        if method not in AGGREGATION_METHODS:
+            raise HTTPBadRequest(
+                f"Invalid method, expected one of: {', '.join(AGGREGATION_METHODS)}."
+            )
+
+        cell_size = None
+        clusters = None
+
+        try:
+            if method == "kmeans":
+                clusters = int(params.get("k", 100))
+                if not 1 <= clusters <= MAX_AGGREGATE_CLUSTERS:
+                    raise ValueError
+            elif "cell_size" in params:
+                cell_size = float(params["cell_size"])
+                if not cell_size > 0 or math.isinf(cell_size):
+                    raise ValueError
+        except ValueError:
+            raise HTTPBadRequest("Invalid cell_size or k.")
+
+        if method != "kmeans" and cell_size is None:
+            resolution = self.get_simplify_tolerance()
+            if not resolution:
+                raise HTTPBadRequest(
+                    "The cell_size, zoom or resolution parameter is required."
+                )
+            cell_size = resolution * AGGREGATE_CELL_PIXELS
+
+        group_by = params.get("group_by")
+        property_names = [
+            column.name for column in self.db_service.get_property_columns(model)
+        ]
+
+        if group_by is not None and group_by not in property_names:
+            raise HTTPBadRequest(f"Invalid group_by column: {group_by}.")
+
+        date_range = self.get_date_range()
+
+        if date_range is not None and self.db_service.get_date_column(model) is None:
+            raise HTTPBadRequest("The model has no date column.")
+
+        filters = self.get_filters(model, AGGREGATE_PARAMS)
+        self.set_output_options()
+        options = {
+            "cell_size": cell_size,
+            "clusters": clusters,
+            "bbox": self.get_bbox(),
+            "group_by": group_by,
+            "date_range": date_range,
+        }
+        key_parts = (
+            "aggregate",
+            method,
+            sorted(filters.items()),
+            sorted(options.items()),
+            self.db_service.target_srid,
+            self.db_service.precision,
+        )
+
+        return self.cached_response(
+            model,
+            key_parts,
+            "application/json",
+            lambda: render(
+                "json",
+                self.db_service.get_aggregates(model, filters, method, **options),
+                self.request,
+            ).encode("utf-8"),
+        )
+
+    @view_config(
+        route_name="db_controller.topojson_view",
+        request_method="GET",
+    )
+    def topojson_view(self):
+        """
+        Returns the features of the requested model as a TopoJSON topology, whose
+        shared polygon boundaries are encoded once as quantized, delta-encoded arcs
+        (see ``DbServices.get_topology``). Parameters:
+
+        - ``quantization``: the number of distinct values per axis of the coordinates,
+          ``DEFAULT_QUANTIZATION`` by default. It replaces the ``precision``
+          parameter of the other endpoints, which is rejected;
+        - ``bbox``, ``srid`` and the filter parameters of ``db_view``.
+
+        Raises:
+            HTTPNotFound: If the model does not exist or has no geometry.
+            HTTPBadRequest: If a parameter is invalid.
+
+        Returns:
+            Response: The TopoJSON document.
+        """
+        model_name = self.request.matchdict.get("model")
+        model = MODEL_REGISTRY.get(model_name)
+
+        if not model or not hasattr(model, "geom"):
+            raise HTTPNotFound(f"Model '{model_name}' not found.")
+
+        if "precision" in self.request.params:
+            raise HTTPBadRequest(
+                "The precision parameter is not supported, use quantization."
+            )
+
+        filters = self.get_filters(model, TOPOJSON_PARAMS)
+        bbox = self.get_bbox()
+        quantization = self.get_quantization(DEFAULT_QUANTIZATION)
+        self.set_output_options()
+        key_parts = (
+            "topojson",
+            sorted(filters.items()),
+            bbox,
+            quantization,
+            self.db_service.target_srid,
+        )
+        batch_size = int(
+            self.request.registry.settings.get("geoapp.export_batch_size", 10000)
+        )
+
+        return self.cached_response(
+            model,
+            key_parts,
+            "application/json",
+            lambda: render(
+                "json",
+                self.db_service.get_topology(
+                    model, filters, bbox, quantization, batch_size
+                ),
+                self.request,
+            ).encode("utf-8"),
+        )
+
+    @view_config(
+        route_name="db_controller.nearest_view",
+        request_method="GET",
+    )
+    def nearest_view(self):
+        """
+        Returns the features of the requested model nearest to a point, in distance
+        order, as a GeoJSON FeatureCollection whose features have a ``distance``
+        property (see ``DbServices.get_nearest``). Parameters:
+
+        - ``point=x,y[,srid]``: the point, in EPSG:4326 unless an SRID is given;
+        - ``k`` and ``radius``: see ``get_nearest_options``;
+        - ``fields``, ``srid``, ``precision`` and the filter parameters of ``db_view``.
+
+        Raises:
+            HTTPNotFound: If the model does not exist or has no geometry.
+            HTTPBadRequest: If a parameter is missing or invalid.
+
+        Returns:
+            Response: The GeoJSON FeatureCollection of the nearest features.
+        """
+        model = self.get_geometry_model()
+        source_srid, point = self.get_point()
+        options = self.get_nearest_options(model, NEAREST_PARAMS)
+        self.set_output_options()
+        key_parts = (
+            "nearest",
+            source_srid,
+            point,
+            sorted(options["filters"].items()),
+            options["k"],
+            options["radius"],
+            options["fields"],
+            self.db_service.target_srid,
+            self.db_service.precision,
+        )
+
+        return self.cached_response(
+            model,
+            key_parts,
+            "application/geo+json",
+            lambda: render(
+                "json",
+                self.db_service.get_nearest(model, [point], source_srid, **options)[0],
+                self.request,
+            ).encode("utf-8"),
+        )
+
+    @view_config(
+        route_name="db_controller.nearest_batch_view",
+        request_method="POST",
+        renderer="json",
+    )
+    def nearest_batch_view(self):
+        """
+        Returns the features of the requested model nearest to each of the points sent
+        in the JSON request body (see ``get_points``), as a list of FeatureCollections
+        in the order of the input points. As for ``nearest_view``, the coordinates are
+        in EPSG:4326 unless the body has an ``srid`` member. The query parameters are
+        those of ``nearest_view`` without ``point``.
+        """
+        model = self.get_geometry_model()
+        settings = self.request.registry.settings
+        source_srid, points = self.get_points(DEFAULT_SRID)
+        max_points = int(settings.get("geoapp.batch.max_points", 500000))
 
-        self.request.response.headers.update(
-            {
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type",
-            }
+        if len(points) > max_points:
+            raise HTTPBadRequest(f"Too many points, the maximum is {max_points}.")
+
+        options = self.get_nearest_options(model, NEAREST_BATCH_PARAMS)
+        self.set_output_options()
+
+        data = self.db_service.get_nearest(
+            model,
+            points,
+            source_srid,
+            chunk_size=int(settings.get("geoapp.batch.chunk_size", 10000)),
+            **options,
         )
 
+        self.request.response.headers.update(CORS_HEADERS)
+
         return data
 
+    @view_config(
+        route_name="db_controller.tile_view",
+        request_method="GET",
+    )
+    def tile_view(self):
+        """
+        Returns a Mapbox Vector Tile (EPSG:3857) with the features of the requested model.
+
+        Raises:
+            HTTPNotFound: If the model does not exist or has no geometry, or the tile
+                coordinates are outside of the tiling scheme.
+
+        Returns:
+            Response: The binary protobuf tile.
+        """
+        model_name = self.request.matchdict.get("model")
+        model = MODEL_REGISTRY.get(model_name)
+
+        if not model or not hasattr(model, "geom"):
+            raise HTTPNotFound(f"Model '{model_name}' not found.")
+
+        try:
+            z, x, y = (int(self.request.matchdict[key]) for key in ("z", "x", "y"))
+        except ValueError:
+            raise HTTPNotFound("Invalid tile coordinates.")
+
+        if not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2**z and 0 <= y < 2**z):
+            raise HTTPNotFound("Invalid tile coordinates.")
+
+        return self.cached_response(
+            model,
+            ("mvt", z, x, y),
+            "application/vnd.mapbox-vector-tile",
+            lambda: self.db_service.get_tile(model, z, x, y),
+        )
+
     @view_config(
         route_name="db_controller.spatial_data_view",
         request_method="GET",
@@ -70,46 +505,166 @@ class DbController:
 
         data = self.db_service.get_spatial_data(x, y)
 
-        self.request.response.headers.update(
-            {
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type",
-            }
+        self.request.response.headers.update(CORS_HEADERS)
+
+        return data
+
+    @view_config(
+        route_name="db_controller.spatial_data_batch_view",
+        request_method="POST",
+        renderer="json",
+    )
+    def spatial_data_batch_view(self):
+        """
+        Returns spatial data for many coordinates sent in the JSON request body, in the
+        same order as the input coordinates (see ``get_points``).
+        """
+        settings = self.request.registry.settings
+        srid, points = self.get_points(SPATIAL_DATA_SRID)
+        max_points = int(settings.get("geoapp.batch.max_points", 500000))
+
+        if len(points) > max_points:
+            raise HTTPBadRequest(f"Too many points, the maximum is {max_points}.")
+
+        data = self.db_service.get_spatial_data_batch(
+            points,
+            source_srid=srid,
+            chunk_size=int(settings.get("geoapp.batch.chunk_size", 10000)),
         )
 
+        self.request.response.headers.update(CORS_HEADERS)
+
         return data
 
-    def get_filters(self, model):
+    def get_geometry_model(self):
         """
-        Extracts valid filter parameters from the request and checks them against
-        the given model. Returns a dictionary of valid filters. If any invalid
-        filters are provided, an HTTPBadRequest is raised.
+        Returns the model of the ``model`` path segment.
 
-        Args:
-            model (SQLAlchemy model): The model class against which filter keys will be validated.
-                        Each key in the filter dictionary must be an attribute of the model.
+        Raises:
+            HTTPNotFound: If the model does not exist or has no geometry.
+        """
+        model_name = self.request.matchdict.get("model")
+        model = MODEL_REGISTRY.get(model_name)
+
+        if not model or not hasattr(model, "geom"):
+            raise HTTPNotFound(f"Model '{model_name}' not found.")
+
+        return model
+
+    def get_nearest_options(self, model, reserved_params):
+        """
+        Parses the parameters of the nearest endpoints:
+
+        - ``k``: the number of features returned per point, ``DEFAULT_NEAREST_K`` by
+          default, or ``MAX_NEAREST_K`` with a radius;
+        - ``radius``: only returns features within this distance of the point, in
+          units of the stored geometry (meters for EPSG:26918);
+        - ``fields`` and the filter parameters of ``db_view``.
+
+        ``reserved_params`` are the parameters of the endpoint that are not filters.
 
         Raises:
-            HTTPBadRequest: If any filter parameter does not correspond to an attribute
-                            of the given model.
+            HTTPBadRequest: If a parameter is invalid.
 
         Returns:
-            dict: A dictionary of valid filter parameters where keys are model attribute
-                names and values are the corresponding filter values.
+            dict: The ``k``, ``radius``, ``filters`` and ``fields`` keyword arguments
+                of ``DbServices.get_nearest``.
         """
-        filters = {}
-        invalid_filters = []
+        params = self.request.params
+        radius = None
 
-        for key, value in self.request.params.items():
-            if hasattr(model, key):
-                filters[key] = value
-            else:
-                invalid_filters.append(key)
-
-        if invalid_filters:
+        try:
+            if "radius" in params:
+                radius = float(params["radius"])
+                if not radius >= 0 or math.isinf(radius):
+                    raise ValueError
+            default_k = DEFAULT_NEAREST_K if radius is None else MAX_NEAREST_K
+            k = int(params.get("k", default_k))
+            if not 1 <= k <= MAX_NEAREST_K:
+                raise ValueError
+        except ValueError:
             raise HTTPBadRequest(
-                f"Invalid filter parameters: {', '.join(invalid_filters)}."
+                f"Invalid k or radius, k must be between 1 and {MAX_NEAREST_K}."
             )
 
-        return filters
+        return {
+            "k": k,
+            "radius": radius,
+            "filters": self.get_filters(model, reserved_params),
+            "fields": self.get_fields(model),
+        }
+
+    def set_output_options(self):
+        """
+        Applies the ``srid`` and ``precision`` parameters to the geometries returned by
+        the database service.
+        """
+        self.db_service.target_srid, self.db_service.precision = self.get_output_options(
+            self.db_service.target_srid, self.db_service.precision
+        )
+
+    def stream_features(self, model, filters, options):
+        """
+        Returns a response whose body is the GeoJSON FeatureCollection written chunk by
+        chunk while the features are read from a server-side cursor, so memory usage
+        does not grow with the size of the layer. ``options`` are the keyword arguments
+        of ``DbServices.iter_features`` (bbox, tolerance, history filters).
+        """
+        batch_size = int(
+            self.request.registry.settings.get("geoapp.stream_batch_size", 1000)
+        )
+        response = Response(
+            app_iter=self.db_service.iter_features(
+                model, filters, batch_size=batch_size, **options
+            ),
+            content_type="application/geo+json",
+        )
+        response.headers.update(CORS_HEADERS)
+
+        return response
+
+    def check_not_modified(self, model, key_parts):
+        """
+        Computes the validators of the response identified by ``key_parts`` and ends the
+        request with 304 Not Modified if the client already has the current version.
+
+        Raises:
+            HTTPNotModified: If the ETag sent in If-None-Match is still current.
+
+        Returns:
+            tuple: The (etag, last_modified) validators of the response.
+        """
+        cache = self.request.registry.response_cache
+        etag, last_modified = cache.get_validators(
+            DBSession, model.__tablename__, key_parts
+        )
+
+        # Compressed variants have their own ETags (see geoapp.config.compression)
+        for variant in etag_variants(etag):
+            if variant in self.request.if_none_match:
+                not_modified = HTTPNotModified(headers=CORS_HEADERS)
+                not_modified.etag = variant
+                not_modified.last_modified = last_modified
+                raise not_modified
+
+        return etag, last_modified
+
+    def cached_response(self, model, key_parts, content_type, produce_body):
+        """
+        Returns the response identified by ``key_parts`` from the response cache, calling
+        ``produce_body`` to build and store the body on a cache miss.
+        """
+        cache = self.request.registry.response_cache
+        etag, last_modified = self.check_not_modified(model, key_parts)
+        body = cache.get(etag)
+
+        if body is None:
+            body = produce_body()
+            cache.set(etag, body)
+
+        response = Response(body=body, content_type=content_type)
+        response.headers.update(CORS_HEADERS)
+        response.etag = etag
+        response.last_modified = last_modified
+
+        return response
@@ -0,0 +1,27 @@
+from pyramid.view import view_config
+from pyramid.response import Response
+from geoapp.services.metrics_service import METRICS
+
+
+class MetricsController:
+    """
+    Controller exposing the metrics of the application process (connection pool,
+    request timings) in the Prometheus text exposition format.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @view_config(
+        route_name="metrics_controller.metrics_view",
+        request_method="GET",
+    )
+    def metrics_view(self):
+        """
+        Returns the current values of all registered metrics.
+        """
+        response = Response(body=METRICS.render().encode("utf-8"))
+        response.content_type = "text/plain"
+        response.content_type_params = {"version": "0.0.4", "charset": "utf-8"}
+
+        return response
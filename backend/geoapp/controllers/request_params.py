@@ -0,0 +1,493 @@
+import datetime
+import math
+from pyramid.settings import asbool
+from pyramid.httpexceptions import HTTPBadRequest
+from geoapp.services.db_service import HIDDEN_COLUMNS, decode_cursor
+from geoapp.services.filter_service import FilterError, parse_filters
+
+# Query parameters of each endpoint that control the response instead of filtering
+# the model. Any other parameter is parsed as a filter, so a parameter of another
+# endpoint is rejected instead of being silently ignored.
+GEOJSON_PARAMS = frozenset(
+    {
+        "stream",
+        "bbox",
+        "zoom",
+        "resolution",
+        "as_of",
+        "changed_between",
+        "diff",
+        "srid",
+        "precision",
+        "limit",
+        "cursor",
+        "fields",
+    }
+)
+EXPORT_PARAMS = frozenset({"format", "bbox", "srid", "precision"})
+AGGREGATE_PARAMS = frozenset(
+    {
+        "method",
+        "cell_size",
+        "k",
+        "zoom",
+        "resolution",
+        "group_by",
+        "date_from",
+        "date_to",
+        "bbox",
+        "srid",
+        "precision",
+    }
+)
+# The quantization of TopoJSON coordinates replaces their precision
+TOPOJSON_PARAMS = frozenset({"quantization", "bbox", "srid"})
+NEAREST_BATCH_PARAMS = frozenset({"k", "radius", "fields", "srid", "precision"})
+NEAREST_PARAMS = NEAREST_BATCH_PARAMS | {"point"}
+
+# Default SRID of the bbox and point parameters and of the coordinates of the nearest
+# batch body when they are given without one
+DEFAULT_SRID = 4326
+
+# Default SRID of the coordinates of the spatial data endpoints (Web Mercator map
+# coordinates)
+SPATIAL_DATA_SRID = 3857
+
+# Highest number of decimal digits of the precision parameter
+MAX_PRECISION = 15
+
+# Bounds of the quantization parameter of TopoJSON responses
+MIN_QUANTIZATION = 2
+MAX_QUANTIZATION = 2**31
+
+# Page size of paginated features when only a cursor is given, and its maximum
+DEFAULT_PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 10000
+
+# Resolution (meters per pixel) of zoom level 0 in the Web Mercator tiling scheme
+ZOOM_0_RESOLUTION = 156543.03392804097
+
+# Latitude of the data (New York City), where the Web Mercator resolution of a zoom
+# level is converted to ground meters
+DATA_LATITUDE = 40.7
+
+
+class RequestParams:
+    """
+    Parses and validates the query parameters and JSON body shared by the views of
+    the database endpoints. It only relies on ``request.params`` and
+    ``request.json_body``, so it can wrap a Pyramid request as well as a plain WebOb
+    request built by the ASGI entry point.
+    """
+
+    def __init__(self, request, known_srids):
+        """
+        Args:
+            request (Request): The request whose parameters are parsed.
+            known_srids (callable): Returns the SRIDs accepted by the ``srid``
+                parameters, those of ``spatial_ref_sys`` (see
+                ``DbServices.get_known_srids``). It is only called when a parameter
+                has an SRID.
+        """
+        self.request = request
+        self.known_srids = known_srids
+
+    def check_srid(self, srid):
+        """
+        Raises:
+            HTTPBadRequest: If the SRID is not in ``spatial_ref_sys``.
+        """
+        if srid not in self.known_srids():
+            raise HTTPBadRequest(f"Unknown srid {srid}.")
+
+    def get_filters(self, model, reserved_params):
+        """
+        Extracts the filter parameters from the request and validates them against the
+        columns of the given model (see ``parse_filters`` for the filter grammar, e.g.
+        ``incident_d__between=2010-01-01,2010-12-31``).
+
+        Args:
+            model (SQLAlchemy model): The model class against which filter keys will be validated.
+            reserved_params (set): The other parameters of the endpoint, e.g.
+                ``GEOJSON_PARAMS``.
+
+        Raises:
+            HTTPBadRequest: If a filter parameter does not correspond to a column of the
+                model, has an unknown operator or an invalid value.
+
+        Returns:
+            dict: The filter parameters and their values converted to the types of their
+                columns.
+        """
+        params = {
+            key: value
+            for key, value in self.request.params.items()
+            if key not in reserved_params
+        }
+
+        try:
+            return parse_filters(model, params, self.known_srids)
+        except FilterError as error:
+            raise HTTPBadRequest(str(error))
+
+    def get_bbox(self):
+        """
+        Parses the ``bbox=minx,miny,maxx,maxy[,srid]`` parameter. The SRID defaults to
+        EPSG:4326 when only four values are given.
+
+        Raises:
+            HTTPBadRequest: If the parameter is malformed, the box is empty or its
+                SRID is not in ``spatial_ref_sys``.
+
+        Returns:
+            tuple: A (minx, miny, maxx, maxy, srid) tuple, or None if no bbox was requested.
+        """
+        value = self.request.params.get("bbox")
+
+        if value is None:
+            return None
+
+        parts = value.split(",")
+        try:
+            if len(parts) not in (4, 5):
+                raise ValueError
+            minx, miny, maxx, maxy = (float(part) for part in parts[:4])
+            srid = int(parts[4]) if len(parts) == 5 else DEFAULT_SRID
+            if not all(math.isfinite(value) for value in (minx, miny, maxx, maxy)):
+                raise ValueError
+        except ValueError:
+            raise HTTPBadRequest("Invalid bbox, expected minx,miny,maxx,maxy[,srid]")
+
+        if minx >= maxx or miny >= maxy:
+            raise HTTPBadRequest("Invalid bbox, min values must be lower than max values")
+
+        self.check_srid(srid)
+
+        return minx, miny, maxx, maxy, srid
+
+    def get_point(self):
+        """
+        Parses the ``point=x,y[,srid]`` parameter. The SRID defaults to EPSG:4326 when
+        only two values are given.
+
+        Raises:
+            HTTPBadRequest: If the parameter is missing or malformed, or its SRID is not
+                in ``spatial_ref_sys``.
+
+        Returns:
+            tuple: The SRID and the (x, y) coordinates.
+        """
+        value = self.request.params.get("point")
+
+        try:
+            parts = value.split(",")
+            if len(parts) not in (2, 3):
+                raise ValueError
+            x, y = (float(part) for part in parts[:2])
+            srid = int(parts[2]) if len(parts) == 3 else DEFAULT_SRID
+            if not (math.isfinite(x) and math.isfinite(y)):
+                raise ValueError
+        except (AttributeError, ValueError):
+            raise HTTPBadRequest("Invalid or missing point, expected x,y[,srid]")
+
+        self.check_srid(srid)
+
+        return srid, (x, y)
+
+    def get_history_filters(self, model):
+        """
+        Parses the parameters filtering the versions of a history model (a model with a
+        ``valid_range`` column):
+
+        - ``as_of=<timestamp>`` returns the versions valid at that instant;
+        - ``changed_between=<t1>,<t2>`` returns the versions that started or ended
+          between the two instants;
+        - ``diff=true`` with ``changed_between`` returns only the features added or
+          removed between the two instants, with a ``change`` property.
+
+        Timestamps are in ISO 8601 format.
+
+        Raises:
+            HTTPBadRequest: If the parameters are malformed, conflicting, or the model has
+                no history.
+
+        Returns:
+            dict: The ``as_of``, ``changed_between`` and ``diff`` keyword arguments of
+                ``DbServices.get_features``.
+        """
+        as_of = self.request.params.get("as_of")
+        changed_between = self.request.params.get("changed_between")
+        diff = asbool(self.request.params.get("diff"))
+
+        if as_of is None and changed_between is None:
+            if diff:
+                raise HTTPBadRequest("The diff parameter requires changed_between.")
+            return {}
+
+        if not hasattr(model, "valid_range"):
+            raise HTTPBadRequest("The model has no history.")
+
+        if as_of is not None and diff:
+            raise HTTPBadRequest("The diff parameter cannot be combined with as_of.")
+
+        try:
+            if as_of is not None:
+                as_of = datetime.datetime.fromisoformat(as_of)
+            if changed_between is not None:
+                start, end = changed_between.split(",")
+                changed_between = (
+                    datetime.datetime.fromisoformat(start),
+                    datetime.datetime.fromisoformat(end),
+                )
+                # Also rejects a mix of timestamps with and without a time zone
+                if changed_between[0] > changed_between[1]:
+                    raise ValueError
+        except (TypeError, ValueError):
+            raise HTTPBadRequest("Invalid as_of or changed_between timestamps.")
+
+        return {"as_of": as_of, "changed_between": changed_between, "diff": diff}
+
+    def get_date_range(self):
+        """
+        Parses the ``date_from`` and ``date_to`` parameters (ISO 8601 dates, both
+        inclusive and optional).
+
+        Raises:
+            HTTPBadRequest: If a date is malformed or date_from is after date_to.
+
+        Returns:
+            tuple: A (date_from, date_to) tuple, or None if neither date was requested.
+        """
+        date_from = self.request.params.get("date_from")
+        date_to = self.request.params.get("date_to")
+
+        if date_from is None and date_to is None:
+            return None
+
+        try:
+            if date_from is not None:
+                date_from = datetime.date.fromisoformat(date_from)
+            if date_to is not None:
+                date_to = datetime.date.fromisoformat(date_to)
+        except ValueError:
+            raise HTTPBadRequest("Invalid date_from or date_to, expected YYYY-MM-DD.")
+
+        if date_from is not None and date_to is not None and date_from > date_to:
+            raise HTTPBadRequest("date_from must not be after date_to.")
+
+        return date_from, date_to
+
+    def get_output_options(self, target_srid, precision):
+        """
+        Parses the ``srid`` parameter (an EPSG code) and the ``precision`` parameter (the
+        number of decimal digits of the coordinates) of the returned geometries.
+
+        Args:
+            target_srid (int): The SRID used when the parameter is not given.
+            precision (int): The precision used when the parameter is not given.
+
+        Raises:
+            HTTPBadRequest: If the SRID is not an EPSG code in ``spatial_ref_sys`` or
+                the precision is not an integer between 0 and ``MAX_PRECISION``.
+
+        Returns:
+            tuple: The (target_srid, precision) of the response.
+        """
+        params = self.request.params
+
+        if "srid" in params:
+            # pyproj is only imported by the first request with an srid parameter
+            from pyproj import CRS
+            from pyproj.exceptions import CRSError
+
+            try:
+                target_srid = int(params["srid"])
+                CRS.from_epsg(target_srid)
+            except (ValueError, CRSError):
+                raise HTTPBadRequest("Invalid srid, expected an EPSG code.")
+
+            self.check_srid(target_srid)
+
+        try:
+            if "precision" in params:
+                precision = int(params["precision"])
+                if not 0 <= precision <= MAX_PRECISION:
+                    raise ValueError
+        except ValueError:
+            raise HTTPBadRequest(
+                f"Invalid precision, expected an integer between 0 and {MAX_PRECISION}."
+            )
+
+        return target_srid, precision
+
+    def get_quantization(self, default):
+        """
+        Parses the ``quantization`` parameter of TopoJSON responses, the number of
+        distinct values per axis of the quantized coordinates.
+
+        Raises:
+            HTTPBadRequest: If the parameter is not an integer between
+                ``MIN_QUANTIZATION`` and ``MAX_QUANTIZATION``.
+
+        Returns:
+            int: The quantization, ``default`` if the parameter is not given.
+        """
+        try:
+            quantization = int(self.request.params.get("quantization", default))
+            if not MIN_QUANTIZATION <= quantization <= MAX_QUANTIZATION:
+                raise ValueError
+        except ValueError:
+            raise HTTPBadRequest(
+                "Invalid quantization, expected an integer between "
+                f"{MIN_QUANTIZATION} and {MAX_QUANTIZATION}."
+            )
+
+        return quantization
+
+    def get_page(self, model):
+        """
+        Parses the ``limit`` and ``cursor`` parameters of paginated features. The
+        cursor is the opaque ``next_cursor`` value of the previous page.
+
+        Raises:
+            HTTPBadRequest: If the limit is not an integer between 1 and
+                ``MAX_PAGE_LIMIT`` or the cursor is invalid.
+
+        Returns:
+            dict: The ``limit`` and ``after`` keyword arguments of
+                ``DbServices.get_features``, empty if neither parameter was given.
+        """
+        params = self.request.params
+
+        if "limit" not in params and "cursor" not in params:
+            return {}
+
+        try:
+            limit = int(params.get("limit", DEFAULT_PAGE_LIMIT))
+            if not 1 <= limit <= MAX_PAGE_LIMIT:
+                raise ValueError
+        except ValueError:
+            raise HTTPBadRequest(
+                f"Invalid limit, expected an integer between 1 and {MAX_PAGE_LIMIT}."
+            )
+
+        after = None
+        if "cursor" in params:
+            try:
+                after = decode_cursor(params["cursor"], model)
+            except ValueError as error:
+                raise HTTPBadRequest(f"Invalid cursor: {error}")
+
+        return {"limit": limit, "after": after}
+
+    def get_fields(self, model):
+        """
+        Parses the ``fields=name,...`` parameter selecting the returned property columns.
+
+        Raises:
+            HTTPBadRequest: If a name is not a property column of the model.
+
+        Returns:
+            list: The names of the requested columns, or None if all columns are requested.
+        """
+        value = self.request.params.get("fields")
+
+        if value is None:
+            return None
+
+        fields = [name.strip() for name in value.split(",") if name.strip()]
+        invalid_fields = [
+            name
+            for name in fields
+            if name in HIDDEN_COLUMNS or name not in model.__table__.c
+        ]
+
+        if invalid_fields:
+            raise HTTPBadRequest(f"Invalid fields: {', '.join(invalid_fields)}.")
+
+        return fields
+
+    def get_simplify_tolerance(self):
+        """
+        Returns the geometry simplification tolerance in meters for the requested map
+        scale. ``resolution`` is given in ground meters per pixel, ``zoom`` is a Web
+        Mercator zoom level whose resolution is scaled to ground meters at
+        ``DATA_LATITUDE``; one pixel of the map is used as the tolerance.
+
+        Raises:
+            HTTPBadRequest: If the parameter is not a finite non-negative number.
+
+        Returns:
+            float: The tolerance, or None if neither zoom nor resolution was requested.
+        """
+        resolution = self.request.params.get("resolution")
+        zoom = self.request.params.get("zoom")
+
+        try:
+            if resolution is not None:
+                tolerance = float(resolution)
+            elif zoom is not None:
+                zoom = float(zoom)
+                if not math.isfinite(zoom):
+                    raise ValueError
+                tolerance = (
+                    ZOOM_0_RESOLUTION
+                    * math.cos(math.radians(DATA_LATITUDE))
+                    * 2**-zoom
+                )
+            else:
+                return None
+        except (ValueError, OverflowError):
+            raise HTTPBadRequest("Invalid zoom or resolution")
+
+        if not math.isfinite(tolerance) or tolerance < 0:
+            raise HTTPBadRequest("Invalid zoom or resolution")
+
+        return tolerance
+
+    def get_points(self, default_srid):
+        """
+        Parses the coordinates of a batch request from the JSON body. The body can be an
+        object with a ``points`` array of [x, y] pairs, a GeoJSON MultiPoint or a GeoJSON
+        FeatureCollection of Point features. The coordinates are in ``default_srid``
+        (``DEFAULT_SRID`` or ``SPATIAL_DATA_SRID``) unless the body has an ``srid``
+        member.
+
+        Raises:
+            HTTPBadRequest: If the body is not valid JSON, does not contain valid
+                coordinates or its SRID is not in ``spatial_ref_sys``.
+
+        Returns:
+            tuple: The SRID and a list of (x, y) coordinates.
+        """
+        try:
+            body = self.request.json_body
+        except ValueError:
+            raise HTTPBadRequest("Invalid JSON body")
+
+        if not isinstance(body, dict):
+            raise HTTPBadRequest("Invalid JSON body")
+
+        try:
+            srid = int(body.get("srid", default_srid))
+            if body.get("type") == "MultiPoint":
+                coordinates = body["coordinates"]
+            elif body.get("type") == "FeatureCollection":
+                coordinates = []
+                for feature in body["features"]:
+                    if feature["geometry"]["type"] != "Point":
+                        raise ValueError
+                    coordinates.append(feature["geometry"]["coordinates"])
+            else:
+                coordinates = body["points"]
+
+            points = [(float(x), float(y)) for x, y, *_ in coordinates]
+        except (KeyError, TypeError, ValueError):
+            raise HTTPBadRequest("Invalid or missing coordinates")
+
+        if not all(math.isfinite(x) and math.isfinite(y) for x, y in points):
+            raise HTTPBadRequest("Invalid or missing coordinates")
+
+        self.check_srid(srid)
+
+        return srid, points
@@ -0,0 +1,110 @@
+from typing import Any, Optional
+from geoalchemy2.types import Geometry
+from sqlalchemy import (
+    Date,
+    DateTime,
+    Double,
+    Index,
+    Integer,
+    PrimaryKeyConstraint,
+    String,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+import datetime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from geoapp.models.models import Base
+
+# Tables derived from the NYC tables by geoapp.services.enrichment_service. Each row
+# keeps the hash of the source row it was computed from in ``source_hash``.
+
+
+class NycCensusBlockNeighborhoods(Base):
+    __tablename__ = "nyc_census_block_neighborhoods"
+    __table_args__ = (
+        PrimaryKeyConstraint("gid", name="nyc_census_block_neighborhoods_pkey"),
+        Index("nyc_census_block_neighborhoods_nbhd_idx", "neighborhood_gid"),
+        Index(
+            "nyc_census_block_neighborhoods_geom_idx", "geom", postgresql_using="gist"
+        ),
+    )
+
+    gid: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    blkid: Mapped[Optional[str]] = mapped_column(String(15))
+    popn_total: Mapped[Optional[float]] = mapped_column(Double(53))
+    neighborhood_gid: Mapped[Optional[int]] = mapped_column(Integer)
+    neighborhood_name: Mapped[Optional[str]] = mapped_column(String(64))
+    boroname: Mapped[Optional[str]] = mapped_column(String(43))
+    source_hash: Mapped[str] = mapped_column(String(32))
+    geom: Mapped[Optional[Any]] = mapped_column(
+        Geometry(
+            "MULTIPOLYGON",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
+    )
+
+
+class NycHomicideNeighborhoods(Base):
+    __tablename__ = "nyc_homicide_neighborhoods"
+    __table_args__ = (
+        PrimaryKeyConstraint("gid", name="nyc_homicide_neighborhoods_pkey"),
+        Index("nyc_homicide_neighborhoods_nbhd_idx", "neighborhood_gid"),
+        Index("nyc_homicide_neighborhoods_geom_idx", "geom", postgresql_using="gist"),
+    )
+
+    gid: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    incident_d: Mapped[Optional[datetime.date]] = mapped_column(Date)
+    weapon: Mapped[Optional[str]] = mapped_column(String(16))
+    neighborhood_gid: Mapped[Optional[int]] = mapped_column(Integer)
+    neighborhood_name: Mapped[Optional[str]] = mapped_column(String(64))
+    boroname: Mapped[Optional[str]] = mapped_column(String(43))
+    source_hash: Mapped[str] = mapped_column(String(32))
+    geom: Mapped[Optional[Any]] = mapped_column(
+        Geometry(
+            "POINT",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
+    )
+
+
+class NycStreetNearestStations(Base):
+    __tablename__ = "nyc_street_nearest_stations"
+    __table_args__ = (
+        PrimaryKeyConstraint("gid", name="nyc_street_nearest_stations_pkey"),
+        Index("nyc_street_nearest_stations_station_idx", "station_gid"),
+        Index("nyc_street_nearest_stations_geom_idx", "geom", postgresql_using="gist"),
+    )
+
+    gid: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    name: Mapped[Optional[str]] = mapped_column(String(200))
+    station_gid: Mapped[Optional[int]] = mapped_column(Integer)
+    station_name: Mapped[Optional[str]] = mapped_column(String(31))
+    measure: Mapped[Optional[float]] = mapped_column(Double(53))
+    distance: Mapped[Optional[float]] = mapped_column(Double(53))
+    source_hash: Mapped[str] = mapped_column(String(32))
+    geom: Mapped[Optional[Any]] = mapped_column(
+        Geometry(
+            "MULTILINESTRING",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
+    )
+
+
+class EnrichmentState(Base):
+    __tablename__ = "geoapp_enrichment_state"
+    __table_args__ = (PrimaryKeyConstraint("name", name="geoapp_enrichment_state_pkey"),)
+
+    name: Mapped[str] = mapped_column(String(63), primary_key=True)
+    source_versions: Mapped[Optional[Any]] = mapped_column(JSONB)
+    refreshed_at: Mapped[Optional[datetime.datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
@@ -30,7 +30,7 @@ class NycCensusBlocks(Base):
     __tablename__ = "nyc_census_blocks"
     __table_args__ = (
         PrimaryKeyConstraint("gid", name="nyc_census_blocks_pkey"),
-        Index("nyc_census_blocks_geom_idx", "geom"),
+        Index("nyc_census_blocks_geom_idx", "geom", postgresql_using="gist"),
     )
 
     gid: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -43,7 +43,13 @@ class NycCensusBlocks(Base):
     popn_other: Mapped[Optional[float]] = mapped_column(Double(53))
     boroname: Mapped[Optional[str]] = mapped_column(String(32))
     geom: Mapped[Optional[Any]] = mapped_column(
-        Geometry("MULTIPOLYGON", 26918, from_text="ST_GeomFromEWKT", name="geometry")
+        Geometry(
+            "MULTIPOLYGON",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
     )
 
 
@@ -51,7 +57,7 @@ class NycHomicides(Base):
     __tablename__ = "nyc_homicides"
     __table_args__ = (
         PrimaryKeyConstraint("gid", name="nyc_homicides_pkey"),
-        Index("nyc_homicides_geom_idx", "geom"),
+        Index("nyc_homicides_geom_idx", "geom", postgresql_using="gist"),
     )
 
     gid: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -64,7 +70,13 @@ class NycHomicides(Base):
     light_dark: Mapped[Optional[str]] = mapped_column(String(1))
     year: Mapped[Optional[float]] = mapped_column(Double(53))
     geom: Mapped[Optional[Any]] = mapped_column(
-        Geometry("POINT", 26918, from_text="ST_GeomFromEWKT", name="geometry")
+        Geometry(
+            "POINT",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
     )
 
 
@@ -72,14 +84,20 @@ class NycNeighborhoods(Base):
     __tablename__ = "nyc_neighborhoods"
     __table_args__ = (
         PrimaryKeyConstraint("gid", name="nyc_neighborhoods_pkey"),
-        Index("nyc_neighborhoods_geom_idx", "geom"),
+        Index("nyc_neighborhoods_geom_idx", "geom", postgresql_using="gist"),
     )
 
     gid: Mapped[int] = mapped_column(Integer, primary_key=True)
     boroname: Mapped[Optional[str]] = mapped_column(String(43))
     name: Mapped[Optional[str]] = mapped_column(String(64))
     geom: Mapped[Optional[Any]] = mapped_column(
-        Geometry("MULTIPOLYGON", 26918, from_text="ST_GeomFromEWKT", name="geometry")
+        Geometry(
+            "MULTIPOLYGON",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
     )
     geom_invalid: Mapped[Optional[Any]] = mapped_column(
         Geometry(spatial_index=False, from_text="ST_GeomFromEWKT", name="geometry")
@@ -90,8 +108,13 @@ class NycStreets(Base):
     __tablename__ = "nyc_streets"
     __table_args__ = (
         PrimaryKeyConstraint("gid", name="nyc_streets_pkey"),
-        Index("nyc_streets_geom_idx", "geom"),
-        Index("nyc_streets_gix_nd", "geom"),
+        Index("nyc_streets_geom_idx", "geom", postgresql_using="gist"),
+        Index(
+            "nyc_streets_gix_nd",
+            "geom",
+            postgresql_using="gist",
+            postgresql_ops={"geom": "gist_geometry_ops_nd"},
+        ),
     )
 
     gid: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -100,7 +123,13 @@ class NycStreets(Base):
     oneway: Mapped[Optional[str]] = mapped_column(String(10))
     type: Mapped[Optional[str]] = mapped_column(String(50))
     geom: Mapped[Optional[Any]] = mapped_column(
-        Geometry("MULTILINESTRING", 26918, from_text="ST_GeomFromEWKT", name="geometry")
+        Geometry(
+            "MULTILINESTRING",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
     )
 
 
@@ -108,8 +137,8 @@ class NycStreetsHistory(Base):
     __tablename__ = "nyc_streets_history"
     __table_args__ = (
         PrimaryKeyConstraint("hid", name="nyc_streets_history_pkey"),
-        Index("nyc_streets_history_geom_x", "geom"),
-        Index("nyc_streets_history_tstz_x", "valid_range"),
+        Index("nyc_streets_history_geom_x", "geom", postgresql_using="gist"),
+        Index("nyc_streets_history_tstz_x", "valid_range", postgresql_using="gist"),
     )
 
     hid: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -119,7 +148,13 @@ class NycStreetsHistory(Base):
     oneway: Mapped[Optional[str]] = mapped_column(String(10))
     type: Mapped[Optional[str]] = mapped_column(String(50))
     geom: Mapped[Optional[Any]] = mapped_column(
-        Geometry("MULTILINESTRING", 26918, from_text="ST_GeomFromEWKT", name="geometry")
+        Geometry(
+            "MULTILINESTRING",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
     )
     valid_range: Mapped[Optional[Any]] = mapped_column(TSTZRANGE)
     created_by: Mapped[Optional[str]] = mapped_column(String(32))
@@ -142,7 +177,7 @@ class NycSubwayStations(Base):
     __tablename__ = "nyc_subway_stations"
     __table_args__ = (
         PrimaryKeyConstraint("gid", name="nyc_subway_stations_pkey"),
-        Index("nyc_subway_stations_geom_idx", "geom"),
+        Index("nyc_subway_stations_geom_idx", "geom", postgresql_using="gist"),
     )
 
     gid: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -161,5 +196,11 @@ class NycSubwayStations(Base):
     express: Mapped[Optional[str]] = mapped_column(String(10))
     closed: Mapped[Optional[str]] = mapped_column(String(10))
     geom: Mapped[Optional[Any]] = mapped_column(
-        Geometry("POINT", 26918, from_text="ST_GeomFromEWKT", name="geometry")
+        Geometry(
+            "POINT",
+            26918,
+            from_text="ST_GeomFromEWKT",
+            name="geometry",
+            spatial_index=False,
+        )
     )
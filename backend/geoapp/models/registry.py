@@ -1,3 +1,8 @@
+from geoapp.models.enrichments import (
+    NycCensusBlockNeighborhoods,
+    NycHomicideNeighborhoods,
+    NycStreetNearestStations,
+)
 from geoapp.models.models import (
     NycCensusBlocks,
     NycHomicides,
@@ -10,9 +15,12 @@ from geoapp.models.models import (
 
 MODEL_REGISTRY = {
     "nyc_census_blocks": NycCensusBlocks,
+    "nyc_census_block_neighborhoods": NycCensusBlockNeighborhoods,
     "nyc_homicides": NycHomicides,
+    "nyc_homicide_neighborhoods": NycHomicideNeighborhoods,
     "nyc_neighborhoods": NycNeighborhoods,
     "nyc_streets": NycStreets,
+    "nyc_street_nearest_stations": NycStreetNearestStations,
     "nyc_streets_history": NycStreetsHistory,
     "nyc_subway_station_events": NycSubwayStationEvents,
     "nyc_subway_stations": NycSubwayStations,
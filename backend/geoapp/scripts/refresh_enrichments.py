@@ -0,0 +1,57 @@
+import argparse
+import logging
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+
+from geoapp.config.database import create_engine_from_settings
+from geoapp.services.enrichment_service import ENRICHMENTS, EnrichmentService
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Creates and refreshes the enrichment tables."
+    )
+    parser.add_argument("config_uri", help="Configuration file, e.g., development.ini")
+    parser.add_argument(
+        "names",
+        nargs="*",
+        metavar="name",
+        help=f"Tables to refresh (all by default): {', '.join(ENRICHMENTS)}",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Recompute all rows even if the source tables did not change",
+    )
+    args = parser.parse_args(argv[1:])
+
+    unknown = [name for name in args.names if name not in ENRICHMENTS]
+    if unknown:
+        parser.error(f"unknown enrichment tables: {', '.join(unknown)}")
+
+    return args
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv)
+    setup_logging(args.config_uri)
+    logging.getLogger("geoapp.services.enrichment_service").setLevel(logging.INFO)
+    engine = create_engine_from_settings(get_appsettings(args.config_uri))
+
+    with engine.begin() as connection:
+        service = EnrichmentService(connection)
+        service.create_tables()
+        results = service.refresh(args.names, args.full)
+
+    for name, result in results.items():
+        print(
+            f"{name}: {result['mode']}, {result['deleted']} deleted, "
+            f"{result['inserted']} inserted"
+        )
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
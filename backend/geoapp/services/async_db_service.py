@@ -0,0 +1,156 @@
+import asyncio
+import contextlib
+
+from sqlalchemy import Text, select
+
+from geoapp.services.db_service import KNOWN_SRIDS, DbServices
+
+
+class ExecutionPool:
+    """
+    An async engine with its own connection pool and a limit of concurrently running
+    operations. Operations waiting for the limit are queued instead of failing with a
+    pool timeout.
+    """
+
+    def __init__(self, engine, max_concurrency):
+        self.engine = engine
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        async with self.semaphore:
+            async with self.engine.connect() as connection:
+                yield connection
+
+    async def execute(self, stmt, params=None):
+        """
+        Executes the statement on a connection of the pool and returns its buffered
+        result, so the connection is released before the rows are read.
+        """
+        async with self.connect() as connection:
+            return await connection.execute(stmt, params)
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+
+class AsyncDbServices(DbServices):
+    """
+    A variant of ``DbServices`` executing the same statements on SQLAlchemy asyncio
+    engines, used by the ASGI entry point.
+
+    Point lookups and tiles run in the ``interactive`` execution pool, streamed features
+    and batches in the ``bulk`` execution pool, so a large download cannot take the
+    connections needed by short requests. Independent queries of a request run
+    concurrently on separate connections.
+    """
+
+    def __init__(self, interactive, bulk, target_srid=4326, precision=6):
+        super().__init__(None, target_srid, precision)
+        self.interactive = interactive
+        self.bulk = bulk
+
+    async def get_known_srids(self):
+        """
+        Returns the SRIDs of the ``spatial_ref_sys`` table, see
+        ``DbServices.get_known_srids``.
+        """
+        if DbServices.known_srids is None:
+            result = await self.interactive.execute(KNOWN_SRIDS)
+            DbServices.known_srids = frozenset(result.scalars())
+
+        return DbServices.known_srids
+
+    async def iter_features(
+        self,
+        model,
+        filters,
+        bbox=None,
+        tolerance=None,
+        as_of=None,
+        changed_between=None,
+        diff=False,
+        fields=None,
+        batch_size=1000,
+    ):
+        """
+        Streams features as chunks of an encoded GeoJSON FeatureCollection, see
+        ``DbServices.iter_features``. The filter values must have the Python types of
+        their columns (see ``parse_filters``), asyncpg does not convert strings.
+        """
+        feature_query = self._build_feature_query(
+            model, filters, bbox, tolerance, as_of, changed_between, diff, fields
+        )
+        stmt = select(feature_query.subquery().c[0].cast(Text))
+
+        async with self.bulk.connect() as connection:
+            result = await connection.stream(
+                stmt, execution_options={"max_row_buffer": batch_size}
+            )
+
+            yield b'{"type":"FeatureCollection","features":['
+            separator = b""
+            async for partition in result.partitions(batch_size):
+                yield separator + ",".join(row[0] for row in partition).encode("utf-8")
+                separator = b","
+            yield b"]}"
+
+    async def get_tile(self, model, z, x, y, extent=4096, buffer=64):
+        """
+        Generates a Mapbox Vector Tile, see ``DbServices.get_tile``.
+        """
+        result = await self.interactive.execute(
+            self._build_tile_query(model, z, x, y, extent, buffer)
+        )
+        tile = result.scalar()
+
+        return bytes(tile) if tile else b""
+
+    async def get_spatial_data(self, x, y, source_srid=3857, radius=100):
+        """
+        Retrieves spatial information for a given coordinate, see
+        ``DbServices.get_spatial_data``. The neighborhoods, the number of homicides and
+        the nearest subway station are queried concurrently on separate connections.
+        """
+        point = self._make_transformed_point(x, y, source_srid)
+
+        neighborhoods, homicides, subway = await asyncio.gather(
+            self.interactive.execute(self._build_neighborhoods_query(point)),
+            self.interactive.execute(
+                self._build_homicides_count_query(point, float(radius))
+            ),
+            self.interactive.execute(self._build_nearest_subway_query(point)),
+        )
+        subway = subway.first()
+
+        return self._format_spatial_result(
+            neighborhoods.scalars().all(),
+            homicides.scalar(),
+            subway.gid if subway else None,
+            subway.distance if subway else None,
+        )
+
+    async def get_spatial_data_batch(
+        self, points, source_srid=3857, radius=100, chunk_size=10000
+    ):
+        """
+        Retrieves spatial information for many coordinates with the set-based query of
+        ``DbServices.get_spatial_data_batch``.
+        """
+        stmt = self._build_spatial_data_query()
+        results = []
+
+        async with self.bulk.connect() as connection:
+            for start in range(0, len(points), chunk_size):
+                chunk = points[start : start + chunk_size]
+                params = {
+                    "xs": [point[0] for point in chunk],
+                    "ys": [point[1] for point in chunk],
+                    "srid": source_srid,
+                    "radius": float(radius),
+                }
+                result = await connection.execute(stmt, params)
+                results.extend(self._format_spatial_data(row) for row in result)
+
+        return results
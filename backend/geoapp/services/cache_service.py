@@ -0,0 +1,216 @@
+import datetime
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, text
+
+
+class MemoryCacheBackend:
+    """
+    In-process cache backend storing response bodies in a dictionary. The least recently
+    used entries are evicted once the total size of the stored bodies exceeds ``max_size``.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class FileSystemCacheBackend:
+    """
+    Cache backend storing response bodies as files in a local directory, which several
+    worker processes can share. Files are written atomically, and reading a file updates
+    its modification time. The total size and LRU order are computed from the
+    directory, so once the files together exceed ``max_size``, the least recently used
+    ones are deleted whichever process wrote them.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        file_path = self._file_path(key)
+        try:
+            with open(file_path, "rb") as file:
+                value = file.read()
+            os.utime(file_path)
+        except FileNotFoundError:
+            return None
+
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(value)
+        os.replace(temp_path, self._file_path(key))
+
+        with self._lock:
+            self._evict()
+
+    def _file_path(self, key):
+        return os.path.join(self.path, key + ".bin")
+
+    def _evict(self):
+        """
+        Deletes the least recently used files until their total size fits in
+        ``max_size``.
+        """
+        files = []
+        size = 0
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process
+                continue
+            files.append((stat.st_mtime, entry.path, stat.st_size))
+            size += stat.st_size
+
+        files.sort()
+        for _, file_path, file_size in files:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+
+class TableVersionProbe:
+    """
+    Detects changes of database tables from the insert/update/delete counters in
+    ``pg_stat_user_tables``. Probed versions are reused for ``ttl`` seconds so that
+    revalidation requests within that window do not touch the database.
+    """
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_version(self, session, table_name):
+        """
+        Returns a (version, last_modified) tuple for the given table. ``last_modified``
+        is the time at which this process first observed the current version.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._versions.get(table_name)
+        if cached and now - cached[2] < self.ttl:
+            return cached[0], cached[1]
+
+        stmt = text(
+            "SELECT n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables "
+            "WHERE relname = :table_name"
+        ).bindparams(bindparam("table_name", table_name))
+        counters = session.execute(stmt).first()
+        version = "-".join(str(counter) for counter in counters) if counters else "0"
+
+        if cached and cached[0] == version:
+            last_modified = cached[1]
+        else:
+            last_modified = datetime.datetime.now(datetime.timezone.utc).replace(
+                microsecond=0
+            )
+
+        with self._lock:
+            self._versions[table_name] = (version, last_modified, now)
+
+        return version, last_modified
+
+
+class ResponseCache:
+    """
+    Cache of encoded responses. Entries are stored under their ETag, which is derived
+    from the request key and the current version of the underlying table, so changing
+    the table invalidates all of its entries at once.
+    """
+
+    def __init__(self, backend, version_probe):
+        self.backend = backend
+        self.version_probe = version_probe
+
+    def get_validators(self, session, table_name, key_parts):
+        """
+        Returns the (etag, last_modified) validators of the response identified by
+        ``key_parts`` (model, normalized filters, SRID, precision, format, ...).
+        """
+        version, last_modified = self.version_probe.get_version(session, table_name)
+        key = repr((table_name, version) + tuple(key_parts))
+        etag = hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+        return etag, last_modified
+
+    def get(self, etag):
+        if self.backend is None:
+            return None
+        return self.backend.get(etag)
+
+    def set(self, etag, body):
+        if self.backend is not None:
+            self.backend.set(etag, body)
+
+
+def create_response_cache(settings):
+    """
+    Creates the response cache configured by the ``geoapp.cache.*`` settings.
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+    """
+    backend_name = settings.get("geoapp.cache.backend", "memory")
+    max_size = int(settings.get("geoapp.cache.max_size", 64 * 1024 * 1024))
+
+    if backend_name == "memory":
+        backend = MemoryCacheBackend(max_size)
+    elif backend_name == "filesystem":
+        path = settings.get("geoapp.cache.path", "cache")
+        backend = FileSystemCacheBackend(path, max_size)
+    elif backend_name == "none":
+        backend = None
+    else:
+        raise ValueError(f"Unknown cache backend '{backend_name}'.")
+
+    version_probe = TableVersionProbe(int(settings.get("geoapp.cache.version_ttl", 5)))
+
+    return ResponseCache(backend, version_probe)
@@ -1,6 +1,132 @@
-from sqlalchemy import func, select
-from sqlalchemy.dialects.postgresql import JSONB
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import shapely
+from sqlalchemy import (
+    TIMESTAMP,
+    Date,
+    Double,
+    Integer,
+    Numeric,
+    Text,
+    bindparam,
+    case,
+    func,
+    select,
+    text,
+    true,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSTZRANGE
 from geoapp.models.models import NycNeighborhoods, NycHomicides, NycSubwayStations
+from geoapp.services.filter_service import (
+    build_filter_predicates,
+    get_filter_parameters,
+)
+from geoapp.services.metrics_service import measure
+from geoapp.services.prepared_statements import execute_prepared
+from geoapp.services.topojson import DEFAULT_QUANTIZATION, build_topology
+
+# Columns that are not returned as feature properties
+HIDDEN_COLUMNS = {"geom", "geom_invalid", "source_hash"}
+
+# Aggregation methods of get_aggregates
+AGGREGATION_METHODS = ("grid", "hex", "snap", "kmeans")
+
+# Width of the Web Mercator (EPSG:3857) world, i.e. of the tile at zoom 0
+WEB_MERCATOR_WIDTH = 2 * 20037508.342789244
+
+# Number of segments per edge of the tile envelope transformed to the model SRID
+TILE_ENVELOPE_SEGMENTS = 32
+
+# Label of the distance to the point in the nearest query
+NEAREST_DISTANCE_LABEL = "_distance"
+
+# SRIDs known to PostGIS
+KNOWN_SRIDS = text("SELECT srid FROM spatial_ref_sys")
+
+# Highest number of statements kept by cached_statement; the shapes depend on the
+# filter keys and fields of the requests, so they are evicted in LRU order
+MAX_CACHED_STATEMENTS = 1024
+
+# Statements whose values are all bound parameters by name, see cached_statement
+_statements = OrderedDict()
+_statements_lock = threading.Lock()
+
+
+def cached_statement(prefix, shape, build):
+    """
+    Returns the name and the statement of a query shape (a hashable description of
+    the query without its values), calling ``build`` only the first time the shape is
+    seen. Statements of the same shape are the same object, so ``execute_prepared``
+    compiles them once and prepares them once per connection. At most
+    ``MAX_CACHED_STATEMENTS`` statements are kept; an evicted shape is built again
+    under the same name.
+    """
+    name = prefix + hashlib.sha1(repr(shape).encode()).hexdigest()[:16]
+
+    with _statements_lock:
+        stmt = _statements.get(name)
+        if stmt is not None:
+            _statements.move_to_end(name)
+
+    if stmt is None:
+        stmt = build()
+        with _statements_lock:
+            stmt = _statements.setdefault(name, stmt)
+            while len(_statements) > MAX_CACHED_STATEMENTS:
+                _statements.popitem(last=False)
+
+    return name, stmt
+
+
+def encode_cursor(values):
+    """
+    Encodes the primary key values of the last feature of a page as an opaque cursor.
+    """
+    data = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor, model):
+    """
+    Decodes a cursor of ``encode_cursor`` and checks its values against the primary key
+    columns of the model.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not match the primary key.
+
+    Returns:
+        tuple: The primary key values of the last feature of the previous page.
+    """
+    columns = get_primary_key(model)
+
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Malformed cursor.")
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("The cursor does not match the primary key.")
+
+    for value, column in zip(values, columns):
+        python_type = column.type.python_type
+        if isinstance(value, bool) or not isinstance(value, python_type):
+            raise ValueError("The cursor does not match the primary key.")
+
+    return tuple(values)
+
+
+def get_primary_key(model):
+    """
+    Returns the columns of the primary key of the model, which order the pages of
+    ``DbServices.get_features``.
+    """
+    return list(model.__table__.primary_key.columns)
 
 
 class DbServices:
@@ -12,13 +138,50 @@ class DbServices:
     can handle spatial reference system transformations with precision control.
     """
 
-    def __init__(self, session, target_srid=4326, precision=6, geom_column="geom_json"):
+    # SRIDs of spatial_ref_sys, loaded once per process by get_known_srids
+    known_srids = None
+
+    def __init__(
+        self,
+        session,
+        target_srid=4326,
+        precision=6,
+        geom_column="geom_json",
+        spatial_index=None,
+    ):
         self.session = session
         self.target_srid = target_srid
         self.precision = precision
         self.geom_column = geom_column
+        # Optional LocalSpatialIndex answering spatial data queries in memory
+        self.spatial_index = spatial_index
+
+    def get_known_srids(self):
+        """
+        Returns the SRIDs of the ``spatial_ref_sys`` table, the coordinate systems that
+        PostGIS can transform geometries from and to. The table is read once per
+        process.
+        """
+        if DbServices.known_srids is None:
+            DbServices.known_srids = frozenset(
+                self.session.execute(KNOWN_SRIDS).scalars()
+            )
 
-    def get_features(self, model, filters):
+        return DbServices.known_srids
+
+    def get_features(
+        self,
+        model,
+        filters,
+        bbox=None,
+        tolerance=None,
+        as_of=None,
+        changed_between=None,
+        diff=False,
+        fields=None,
+        limit=None,
+        after=None,
+    ):
         """
         Retrieves features from the database, applies spatial transformations,
         and returns them as GeoJSON objects.
@@ -26,18 +189,244 @@ class DbServices:
         Args:
             model (SQLAlchemy model): The database model from which features are retrieved.
             filters (dict): A dictionary of filters to apply when querying the database.
+            bbox (tuple, optional): A (minx, miny, maxx, maxy, srid) bounding box; only
+                features intersecting it are returned.
+            tolerance (float, optional): Simplification tolerance in units of the stored
+                geometry (meters); geometries are returned unsimplified when omitted.
+            as_of (datetime, optional): Only returns the versions of a history model that
+                were valid at this instant.
+            changed_between (tuple, optional): A (start, end) tuple; only returns the versions
+                of a history model that started or ended between the two instants.
+            diff (bool): With ``changed_between``, returns only the features added or removed
+                between the two instants, with a ``change`` property.
+            fields (list, optional): The names of the property columns returned, all
+                property columns by default.
+            limit (int, optional): Returns a page of at most ``limit`` features ordered by
+                primary key, with the cursor of the next page in ``next_cursor`` (None on
+                the last page).
+            after (tuple, optional): The primary key values of the last feature of the
+                previous page (see ``decode_cursor``); the page starts after it.
 
         Returns:
             list: A list of GeoJSON objects representing the transformed geometries and associated data.
         """
-        subquery_properties = select(model).filter_by(**filters).subquery()
-        columns = subquery_properties.c
-        json_fields = []
+        if limit is not None:
+            return self._get_feature_page(
+                model,
+                filters,
+                bbox,
+                tolerance,
+                as_of,
+                changed_between,
+                diff,
+                fields,
+                limit,
+                after,
+            )
+
+        name, geojson_query = self._get_feature_statement(
+            model, filters, bbox, tolerance, as_of, changed_between, diff, fields
+        )
+        params = {
+            **get_filter_parameters(model, filters),
+            "target_srid": self.target_srid,
+            "precision": self.precision,
+            "tolerance": tolerance,
+            "as_of": as_of,
+        }
+        if bbox is not None:
+            params.update(
+                zip(("bbox_minx", "bbox_miny", "bbox_maxx", "bbox_maxy", "bbox_srid"), bbox)
+            )
+        if changed_between is not None:
+            params["changed_start"], params["changed_end"] = changed_between
+
+        result = execute_prepared(self.session, name, geojson_query, params)
+
+        # psycopg2 decodes the JSONB value while it is fetched
+        with measure("fetch"):
+            data = result.scalar()
+
+        return data
 
-        # Skip geometry columns to include only non-geometry fields in GeoJSON properties
-        for col in columns:
-            if col.name != "geom" and col.name != "geom_invalid":
-                json_fields.extend([col.name, col])
+    def _get_feature_statement(
+        self, model, filters, bbox, tolerance, as_of, changed_between, diff, fields
+    ):
+        """
+        Returns the name and the FeatureCollection statement of ``get_features``. All
+        values of the statement (filters, bbox, tolerance, SRID, precision, instants)
+        are named bound parameters, so one statement serves every request of the same
+        shape: the statement is built once per shape, compiled once by
+        ``execute_prepared`` and prepared once per connection.
+        """
+        model_srid = model.geom.type.srid
+        shape = (
+            model.__tablename__,
+            tuple(sorted(filters)),
+            # The bbox and the geometries are only transformed to other SRIDs
+            None if bbox is None else bbox[4] == model_srid,
+            self.target_srid == model_srid,
+            bool(tolerance),
+            as_of is not None,
+            changed_between is not None,
+            diff,
+            None if fields is None else tuple(sorted(set(fields))),
+        )
+
+        def build():
+            subquery_features = self._build_feature_query(
+                model, filters, bbox, tolerance, as_of, changed_between, diff, fields
+            ).subquery()
+            return select(
+                func.jsonb_build_object(
+                    "type",
+                    "FeatureCollection",
+                    "features",
+                    func.jsonb_agg(subquery_features.c[0]),
+                )
+            )
+
+        return cached_statement("geoapp_features_", shape, build)
+
+    def _get_feature_page(
+        self,
+        model,
+        filters,
+        bbox,
+        tolerance,
+        as_of,
+        changed_between,
+        diff,
+        fields,
+        limit,
+        after,
+    ):
+        """
+        Returns a page of ``get_features``. The page is read in primary key order
+        starting after the ``after`` key, so every page is an index range scan whatever
+        its position, unlike OFFSET. One more feature than the page size is fetched to
+        tell whether there is a next page.
+        """
+        feature_query = self._build_feature_query(
+            model,
+            filters,
+            bbox,
+            tolerance,
+            as_of,
+            changed_between,
+            diff,
+            fields,
+            limit=limit + 1,
+            after=after,
+        )
+        rows = self.session.execute(feature_query).all()
+
+        with measure("fetch"):
+            features = [row[0] for row in rows[:limit]]
+            next_cursor = encode_cursor(rows[limit - 1][1:]) if len(rows) > limit else None
+
+        return {
+            "type": "FeatureCollection",
+            "features": features,
+            "next_cursor": next_cursor,
+        }
+
+    def iter_features(
+        self,
+        model,
+        filters,
+        bbox=None,
+        tolerance=None,
+        as_of=None,
+        changed_between=None,
+        diff=False,
+        fields=None,
+        batch_size=1000,
+    ):
+        """
+        Streams features as chunks of an encoded GeoJSON FeatureCollection.
+
+        Rows are fetched through a server-side cursor in batches of ``batch_size``
+        and every feature is rendered to JSON text by the database, so the text is
+        written out as-is without being decoded into Python objects. The generator
+        uses its own connection because it is consumed after the request
+        transaction has already been closed.
+
+        Args:
+            model (SQLAlchemy model): The database model from which features are retrieved.
+            filters (dict): A dictionary of filters to apply when querying the database.
+            bbox (tuple, optional): A (minx, miny, maxx, maxy, srid) bounding box.
+            tolerance (float, optional): Simplification tolerance in units of the stored geometry.
+            as_of (datetime, optional): The instant at which history versions are valid.
+            changed_between (tuple, optional): The (start, end) instants of changed history versions.
+            diff (bool): Returns only features added or removed between ``changed_between``.
+            fields (list, optional): The names of the property columns returned.
+            batch_size (int): The number of features fetched and written per chunk.
+
+        Yields:
+            bytes: Consecutive parts of the GeoJSON FeatureCollection document.
+        """
+        feature_query = self._build_feature_query(
+            model, filters, bbox, tolerance, as_of, changed_between, diff, fields
+        )
+        stmt = select(feature_query.subquery().c[0].cast(Text))
+
+        yield b'{"type":"FeatureCollection","features":['
+        separator = b""
+        for partition in self._stream(stmt, batch_size):
+            yield separator + ",".join(row[0] for row in partition).encode("utf-8")
+            separator = b","
+        yield b"]}"
+
+    def _build_feature_query(
+        self,
+        model,
+        filters,
+        bbox=None,
+        tolerance=None,
+        as_of=None,
+        changed_between=None,
+        diff=False,
+        fields=None,
+        limit=None,
+        after=None,
+    ):
+        """
+        Builds a query returning one GeoJSON Feature (as JSONB) per row of the model
+        that matches the given filters and intersects the optional bounding box, with
+        the ``fields`` properties only if given. With ``limit``, the query returns the
+        first ``limit`` rows after the ``after`` primary key, in primary key order,
+        followed by their primary key columns.
+        """
+        properties_query = self._build_properties_query(
+            model, filters, bbox, as_of, changed_between, diff
+        )
+        primary_key = get_primary_key(model)
+
+        if limit is not None:
+            if after is not None:
+                properties_query = properties_query.where(
+                    tuple_(*primary_key) > tuple_(*after)
+                )
+            properties_query = properties_query.order_by(*primary_key).limit(limit)
+
+        subquery_properties = properties_query.subquery()
+        geom = subquery_properties.c.geom
+        property_columns = subquery_properties.c
+
+        if fields is not None:
+            # Computed columns such as the change of diff queries are always returned
+            property_columns = [
+                column
+                for column in property_columns
+                if column.name in fields or column.name not in model.__table__.c
+            ]
+
+        if tolerance:
+            # Keep collapsed geometries so that small features do not disappear
+            geom = func.ST_Simplify(
+                geom, bindparam("tolerance", tolerance, type_=Double), True
+            )
 
         subquery_features = select(
             func.jsonb_build_object(
@@ -45,34 +434,800 @@ class DbServices:
                 "Feature",
                 "geometry",
                 func.ST_AsGeoJSON(
-                    func.ST_Transform(subquery_properties.c.geom, self.target_srid),
-                    self.precision,
+                    self._transform(geom, model.geom.type.srid), self._precision()
                 ).cast(JSONB),
                 "properties",
-                func.jsonb_build_object(*json_fields),
+                func.jsonb_build_object(*self._property_fields(property_columns)),
             )
         )
 
+        if limit is not None:
+            key_columns = [subquery_properties.c[column.name] for column in primary_key]
+            subquery_features = subquery_features.add_columns(*key_columns).order_by(
+                *key_columns
+            )
+
+        return subquery_features
+
+    def _build_properties_query(
+        self, model, filters, bbox=None, as_of=None, changed_between=None, diff=False
+    ):
+        """
+        Builds a query selecting the rows of the model that match the given filters,
+        intersect the optional bounding box and match the optional history filters.
+        """
+        properties_query = select(model).where(*build_filter_predicates(model, filters))
+
+        if bbox is not None:
+            properties_query = properties_query.where(
+                func.ST_Intersects(model.geom, self._make_envelope(model, bbox))
+            )
+
+        if as_of is not None:
+            properties_query = properties_query.where(
+                model.valid_range.contains(self._timestamp("as_of", as_of))
+            )
+
+        if changed_between is not None:
+            start = self._timestamp("changed_start", changed_between[0])
+            end = self._timestamp("changed_end", changed_between[1])
+            valid_at_start = model.valid_range.contains(start)
+            valid_at_end = model.valid_range.contains(end)
+
+            # The overlap with the interval is answered by the valid_range GiST index
+            properties_query = properties_query.where(
+                model.valid_range.overlaps(func.tstzrange(start, end, "[]"))
+            )
+            if diff:
+                # Versions valid at exactly one of the two instants were added or removed
+                properties_query = properties_query.where(
+                    valid_at_start != valid_at_end
+                ).add_columns(
+                    case((valid_at_end, "added"), else_="removed").label("change")
+                )
+            else:
+                # Versions valid during the whole interval did not change in it
+                properties_query = properties_query.where(
+                    ~model.valid_range.contains(func.tstzrange(start, end, "[]"))
+                )
+
+        return properties_query
+
+    def _timestamp(self, name, instant):
+        return bindparam(name, instant, type_=TIMESTAMP(timezone=True))
+
+    def _stream(self, stmt, batch_size):
+        """
+        Executes the statement with a server-side cursor on a dedicated connection and
+        yields the result rows in lists of ``batch_size`` rows.
+        """
+        engine = self.session.get_bind()
+
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=batch_size
+            ).execute(stmt)
+            for partition in result.partitions(batch_size):
+                yield partition
+
+    def _transform(self, geom, srid):
+        """
+        Transforms a geometry in the given SRID to the target SRID. The geometry is
+        returned as-is when it is already in the target SRID, sparing the per-row
+        ST_Transform call.
+        """
+        if srid == self.target_srid:
+            return geom
+
+        return func.ST_Transform(
+            geom, bindparam("target_srid", self.target_srid, type_=Integer)
+        )
+
+    def _precision(self):
+        return bindparam("precision", self.precision, type_=Integer)
+
+    def _make_envelope(self, model, bbox):
+        """
+        Creates a rectangle from a (minx, miny, maxx, maxy, srid) bounding box, transformed
+        to the SRID of the model geometry so the spatial index on it can be used.
+        """
+        bounds = [
+            bindparam(name, value, type_=Double)
+            for name, value in zip(("bbox_minx", "bbox_miny", "bbox_maxx", "bbox_maxy"), bbox)
+        ]
+        srid = bbox[4]
+        envelope = func.ST_MakeEnvelope(
+            *bounds, bindparam("bbox_srid", srid, type_=Integer)
+        )
+        model_srid = model.geom.type.srid
+
+        if srid != model_srid:
+            envelope = func.ST_Transform(envelope, model_srid)
+
+        return envelope
+
+    def _property_columns(self, columns):
+        """
+        Returns the given columns without the geometry columns and the bookkeeping
+        columns of enrichment tables, which are not exposed as feature properties.
+        """
+        return [col for col in columns if col.name not in HIDDEN_COLUMNS]
+
+    def _property_fields(self, columns):
+        """
+        Returns alternating names and columns of the feature properties to pass to
+        jsonb_build_object.
+        """
+        json_fields = []
+
+        for col in self._property_columns(columns):
+            # quoted_name would be bound without a type
+            json_fields.extend([str(col.name), col])
+
+        return json_fields
+
+    def get_property_columns(self, model):
+        """
+        Returns the columns of the model exposed as feature properties.
+        """
+        return self._property_columns(model.__table__.c)
+
+    def iter_feature_rows(self, model, filters, bbox=None, batch_size=10000):
+        """
+        Streams the features of the model as rows in batches of ``batch_size``. Each row
+        holds the values of the ``get_property_columns`` columns followed by the geometry
+        as WKB in the target SRID.
+        """
+        subquery_properties = self._build_properties_query(model, filters, bbox).subquery()
+        stmt = select(
+            *self._property_columns(subquery_properties.c),
+            func.ST_AsBinary(
+                self._transform(subquery_properties.c.geom, model.geom.type.srid)
+            ).label("geometry"),
+        )
+
+        yield from self._stream(stmt, batch_size)
+
+    def get_topology(
+        self, model, filters, bbox=None, quantization=DEFAULT_QUANTIZATION, batch_size=10000
+    ):
+        """
+        Returns the features of the model as a TopoJSON topology (see
+        ``build_topology``) in the target SRID. Boundaries shared by neighboring
+        polygons are encoded once, and the quantized coordinates replace the precision
+        of GeoJSON responses. Geometries are not simplified, since simplifying each
+        polygon separately would break the shared boundaries.
+
+        Args:
+            model (SQLAlchemy model): The database model from which features are retrieved.
+            filters (dict): A dictionary of filters to apply when querying the database.
+            bbox (tuple, optional): A (minx, miny, maxx, maxy, srid) bounding box.
+            quantization (int): The number of distinct values per axis of the coordinates.
+            batch_size (int): The number of rows fetched at once.
+
+        Returns:
+            dict: The TopoJSON Topology, with one GeometryCollection named after the table.
+        """
+        names = [column.name for column in self.get_property_columns(model)]
+
+        def iter_features():
+            for partition in self.iter_feature_rows(model, filters, bbox, batch_size):
+                # psycopg2 returns the WKB as memoryviews
+                geometries = shapely.from_wkb(
+                    [bytes(row[-1]) if row[-1] is not None else None for row in partition]
+                )
+                for row, geometry in zip(partition, geometries):
+                    yield dict(zip(names, row[:-1])), geometry
+
+        with measure("fetch"):
+            return build_topology(iter_features(), model.__tablename__, quantization)
+
+    def get_flatgeobuf(self, model, filters, bbox=None, max_features=None):
+        """
+        Encodes the features of the model as a FlatGeobuf file with a spatial index
+        (ST_AsFlatGeobuf). ST_AsFlatGeobuf is an aggregate, so the file is built as a
+        single value on the server and returned in one piece: unlike the other export
+        formats it is not streamed, and ``max_features`` bounds its size.
+
+        Raises:
+            ValueError: If more than ``max_features`` features match the filters.
+
+        Returns:
+            bytes: The FlatGeobuf file.
+        """
+        subquery_properties = self._build_properties_query(model, filters, bbox).subquery()
+        columns = []
+
+        for col in self._property_columns(subquery_properties.c):
+            # FlatGeobuf has no column types for ranges and arbitrary precision numbers
+            if isinstance(col.type, TSTZRANGE):
+                col = col.cast(Text).label(col.name)
+            elif isinstance(col.type, Numeric) and not isinstance(col.type, Double):
+                col = col.cast(Double).label(col.name)
+            columns.append(col)
+
+        query_features = select(
+            *columns,
+            self._transform(subquery_properties.c.geom, model.geom.type.srid).label(
+                "geom"
+            ),
+        )
+        if max_features is not None:
+            # One more feature tells that the limit is exceeded
+            query_features = query_features.limit(max_features + 1)
+        subquery_features = query_features.subquery("features")
+        stmt = select(
+            func.ST_AsFlatGeobuf(subquery_features.table_valued(), True, "geom"),
+            func.count(),
+        ).select_from(subquery_features)
+
+        data, count = self.session.execute(stmt).one()
+
+        if max_features is not None and count > max_features:
+            raise ValueError(
+                "Too many features for a FlatGeobuf export, "
+                f"the maximum is {max_features}."
+            )
+
+        return bytes(data or b"")
+
+    def get_date_column(self, model):
+        """
+        Returns the date column of the model filtered by the date range of
+        ``get_aggregates``, or None if the model has no date column.
+        """
+        for column in model.__table__.c:
+            if isinstance(column.type, Date):
+                return column
+        return None
+
+    def get_aggregates(
+        self,
+        model,
+        filters,
+        method,
+        cell_size=None,
+        clusters=None,
+        bbox=None,
+        group_by=None,
+        date_range=None,
+    ):
+        """
+        Aggregates the points of a point model into buckets and returns them as a GeoJSON
+        FeatureCollection, each feature having the number of points of its bucket in the
+        ``count`` property.
+
+        Methods:
+
+        - ``grid``: square cells of ``cell_size`` meters, returned as polygons;
+        - ``hex``: hexagonal cells of ``cell_size`` meters, returned as polygons;
+        - ``snap``: points snapped to a grid of ``cell_size`` meters, returned as the
+          centroid of the points of each cell;
+        - ``kmeans``: ``clusters`` clusters computed by ST_ClusterKMeans, returned as the
+          centroid of the points of each cluster.
+
+        Args:
+            model (SQLAlchemy model): A model with a point geometry.
+            filters (dict): A dictionary of filters to apply when querying the database.
+            method (str): One of ``AGGREGATION_METHODS``.
+            cell_size (float, optional): The size of the grid cells in meters.
+            clusters (int, optional): The number of k-means clusters.
+            bbox (tuple, optional): A (minx, miny, maxx, maxy, srid) bounding box; only
+                points inside it are aggregated.
+            group_by (str, optional): A column of the model; the points are aggregated
+                separately for each of its values, added to the feature properties.
+            date_range (tuple, optional): A (date_from, date_to) tuple of inclusive bounds,
+                either of which can be None, on the date column of the model (see
+                ``get_date_column``).
+
+        Returns:
+            dict: The GeoJSON FeatureCollection of the buckets.
+        """
+        subquery_features = self._build_aggregate_query(
+            model, filters, method, cell_size, clusters, bbox, group_by, date_range
+        ).subquery()
+
         geojson_query = select(
             func.jsonb_build_object(
                 "type",
                 "FeatureCollection",
                 "features",
-                func.jsonb_agg(subquery_features.c[0]),
+                func.coalesce(
+                    func.jsonb_agg(subquery_features.c[0]), func.jsonb_build_array()
+                ),
+            )
+        )
+        result = self.session.execute(geojson_query)
+
+        with measure("fetch"):
+            data = result.scalar()
+
+        return data
+
+    def _build_aggregate_query(
+        self,
+        model,
+        filters,
+        method,
+        cell_size=None,
+        clusters=None,
+        bbox=None,
+        group_by=None,
+        date_range=None,
+    ):
+        """
+        Builds a query returning one GeoJSON Feature (as JSONB) per bucket of
+        ``get_aggregates``. Buckets are computed in the SRID of the model.
+        """
+        points_query = self._build_properties_query(model, filters, bbox)
+
+        if date_range is not None:
+            date_column = self.get_date_column(model)
+            date_from, date_to = date_range
+            if date_from is not None:
+                points_query = points_query.where(date_column >= date_from)
+            if date_to is not None:
+                points_query = points_query.where(date_column <= date_to)
+
+        group_columns = [getattr(model, group_by).label("group")] if group_by else []
+        points = points_query.with_only_columns(
+            model.geom.label("geom"), *group_columns
+        ).subquery("points")
+        count = func.count().label("count")
+
+        def group(table):
+            return [table.c.group] if group_by else []
+
+        if method in ("grid", "hex"):
+            grid_function = func.ST_SquareGrid if method == "grid" else func.ST_HexagonGrid
+            cell_function = func.ST_Square if method == "grid" else func.ST_Hexagon
+            # The grid covering the bounds of a single point is the cell of the point;
+            # a point on the border of two cells is counted in one of them
+            grid = grid_function(cell_size, points.c.geom).table_valued("geom", "i", "j")
+            cell = select(grid.c.i, grid.c.j).limit(1).lateral("cell")
+            cells = (
+                select(cell.c.i, cell.c.j, count, *group(points))
+                .select_from(points.join(cell, true()))
+                .group_by(cell.c.i, cell.c.j, *group(points))
+                .subquery("cells")
+            )
+            aggregates = select(
+                func.ST_SetSRID(
+                    cell_function(cell_size, cells.c.i, cells.c.j),
+                    model.geom.type.srid,
+                ).label("geom"),
+                cells.c.count,
+                *group(cells),
+            ).subquery("aggregates")
+        elif method == "snap":
+            snapped = select(
+                points, func.ST_SnapToGrid(points.c.geom, cell_size).label("cell")
+            ).subquery("snapped")
+            aggregates = (
+                select(
+                    func.ST_Centroid(func.ST_Collect(snapped.c.geom)).label("geom"),
+                    count,
+                    *group(snapped),
+                )
+                .group_by(snapped.c.cell, *group(snapped))
+                .subquery("aggregates")
+            )
+        elif method == "kmeans":
+            clustered = select(
+                points,
+                func.ST_ClusterKMeans(points.c.geom, clusters)
+                .over(partition_by=group(points) or None)
+                .label("cluster"),
+            ).subquery("clustered")
+            aggregates = (
+                select(
+                    func.ST_Centroid(func.ST_Collect(clustered.c.geom)).label("geom"),
+                    count,
+                    *group(clustered),
+                )
+                .group_by(clustered.c.cluster, *group(clustered))
+                .subquery("aggregates")
+            )
+        else:
+            raise ValueError(f"Unknown aggregation method {method!r}.")
+
+        properties = ["count", aggregates.c.count]
+        if group_by:
+            properties.extend([group_by, aggregates.c.group])
+
+        return select(
+            func.jsonb_build_object(
+                "type",
+                "Feature",
+                "geometry",
+                func.ST_AsGeoJSON(
+                    self._transform(aggregates.c.geom, model.geom.type.srid),
+                    self._precision(),
+                ).cast(JSONB),
+                "properties",
+                func.jsonb_build_object(*properties),
+            )
+        )
+
+    def get_tile(self, model, z, x, y, extent=4096, buffer=64):
+        """
+        Generates a Mapbox Vector Tile with the features of the model in the given tile
+        of the Web Mercator (EPSG:3857) tiling scheme.
+
+        Args:
+            model (SQLAlchemy model): The database model from which features are retrieved.
+            z (int): The zoom level of the tile.
+            x (int): The column of the tile.
+            y (int): The row of the tile.
+            extent (int): The size of the tile in tile coordinate units.
+            buffer (int): The clipping buffer around the tile in tile coordinate units.
+
+        Returns:
+            bytes: The encoded tile, empty if no feature intersects it.
+        """
+        result = self.session.execute(
+            self._build_tile_query(model, z, x, y, extent, buffer)
+        ).scalar()
+
+        return bytes(result) if result else b""
+
+    def _build_tile_query(self, model, z, x, y, extent=4096, buffer=64):
+        """
+        Builds the query of ``get_tile``, returning the encoded tile as a single value.
+        """
+        tile_envelope = func.ST_TileEnvelope(z, x, y)
+        model_srid = model.geom.type.srid
+        columns = model.__table__.c
+
+        # Features in the buffer around the tile are kept by ST_AsMVTGeom, e.g. the
+        # markers of points just outside the tile edge
+        tile_width = WEB_MERCATOR_WIDTH / 2**z
+        buffered_envelope = func.ST_Expand(tile_envelope, tile_width * buffer / extent)
+        # Transforming only the corners would cut off the edges of the tile, which
+        # are curved in the model SRID at low zooms
+        model_envelope = func.ST_Transform(
+            func.ST_Segmentize(buffered_envelope, tile_width / TILE_ENVELOPE_SEGMENTS),
+            model_srid,
+        )
+
+        subquery_tile = (
+            select(
+                func.ST_AsMVTGeom(
+                    func.ST_Transform(model.geom, 3857), tile_envelope, extent, buffer
+                ).label("geom"),
+                *self._property_columns(columns),
             )
+            # Index-backed filter against the tile envelope in the model SRID
+            .where(model.geom.op("&&")(model_envelope))
+            .subquery("tile")
         )
-        result = self.session.execute(geojson_query).scalar()
 
-        return result
+        return select(
+            func.ST_AsMVT(
+                subquery_tile.table_valued(), model.__tablename__, extent, "geom"
+            )
+        )
 
-    def get_spatial_data(self, x, y):
+    def get_nearest(
+        self,
+        model,
+        points,
+        source_srid=4326,
+        k=10,
+        radius=None,
+        filters=None,
+        fields=None,
+        chunk_size=10000,
+    ):
+        """
+        Retrieves the features of the model nearest to each of the given points, as
+        one GeoJSON FeatureCollection per point in the order of the input points. The
+        features are in distance order and have a ``distance`` property, in units of
+        the stored geometry (meters for EPSG:26918).
+
+        Every chunk of points is answered by one query: the candidates of each point
+        are read from the GiST index of the model with the ``<->`` operator, which
+        returns them nearest first, so only ``k`` rows are read per point.
+
+        Args:
+            model (SQLAlchemy model): The model whose features are searched.
+            points (list): A list of (x, y) coordinates.
+            source_srid (int): The SRID of the coordinates.
+            k (int): The maximum number of features returned per point.
+            radius (float, optional): Only returns features within this distance of
+                the point, in units of the stored geometry.
+            filters (dict, optional): The filters of the features (see
+                ``parse_filters``).
+            fields (list, optional): The names of the property columns returned, all
+                property columns by default.
+            chunk_size (int): The maximum number of points sent in a single query.
+
+        Returns:
+            list: One FeatureCollection per point.
+        """
+        filters = filters or {}
+        name, stmt = self._get_nearest_statement(model, filters, radius, fields)
+        base_params = {
+            **get_filter_parameters(model, filters),
+            "srid": source_srid,
+            "k": k,
+            "radius": radius,
+            "target_srid": self.target_srid,
+            "precision": self.precision,
+        }
+        collections = []
+
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start : start + chunk_size]
+            params = {
+                **base_params,
+                "xs": [point[0] for point in chunk],
+                "ys": [point[1] for point in chunk],
+            }
+            chunk_collections = [
+                {"type": "FeatureCollection", "features": []} for _ in chunk
+            ]
+            rows = execute_prepared(self.session, name, stmt, params)
+
+            with measure("fetch"):
+                for position, feature in rows:
+                    # Points without any feature within the radius have a NULL row
+                    if feature is not None:
+                        chunk_collections[position - 1]["features"].append(feature)
+
+            collections.extend(chunk_collections)
+
+        return collections
+
+    def _get_nearest_statement(self, model, filters, radius, fields):
+        """
+        Returns the name and the statement of ``get_nearest``, built once per query
+        shape (see ``cached_statement``).
+        """
+        shape = (
+            model.__tablename__,
+            tuple(sorted(filters)),
+            radius is not None,
+            self.target_srid == model.geom.type.srid,
+            None if fields is None else tuple(sorted(set(fields))),
+        )
+
+        return cached_statement(
+            "geoapp_nearest_",
+            shape,
+            lambda: self._build_nearest_query(model, filters, radius, fields),
+        )
+
+    def _build_nearest_query(self, model, filters, radius=None, fields=None):
+        """
+        Builds a query returning the number (``ord``) of each point of the ``xs``/``ys``
+        array parameters and its ``k`` nearest features as GeoJSON Features (as JSONB),
+        ordered by point and distance. With a radius, the candidates are also bounded
+        by ST_DWithin, which uses the same index.
+        """
+        model_srid = model.geom.type.srid
+        points = self._make_point_set(model_srid)
+        distance = func.ST_Distance(model.geom, points.c.geom)
+
+        # The label cannot clash with a column of the model (e.g. the distance column
+        # of the nearest station enrichment)
+        neighbors_query = self._build_properties_query(model, filters).add_columns(
+            distance.label(NEAREST_DISTANCE_LABEL)
+        )
+
+        if radius is not None:
+            neighbors_query = neighbors_query.where(
+                func.ST_DWithin(
+                    model.geom, points.c.geom, bindparam("radius", type_=Double)
+                )
+            )
+
+        neighbors = (
+            neighbors_query.order_by(model.geom.op("<->")(points.c.geom))
+            .limit(bindparam("k", type_=Integer))
+            .lateral("neighbors")
+        )
+        search_distance = neighbors.c[NEAREST_DISTANCE_LABEL]
+        # The distance to the point replaces a property of the same name
+        property_columns = [
+            column
+            for column in neighbors.c
+            if column.name not in (NEAREST_DISTANCE_LABEL, "distance")
+            and (fields is None or column.name in fields)
+        ]
+
+        feature = func.jsonb_build_object(
+            "type",
+            "Feature",
+            "geometry",
+            func.ST_AsGeoJSON(
+                self._transform(neighbors.c.geom, model_srid), self._precision()
+            ).cast(JSONB),
+            "properties",
+            func.jsonb_build_object(
+                *self._property_fields(property_columns), "distance", search_distance
+            ),
+        )
+
+        return (
+            select(
+                points.c.ord,
+                # The feature of a point without neighbors is NULL, not a Feature
+                case((neighbors.c.geom.is_not(None), feature)).label("feature"),
+            )
+            .select_from(points.outerjoin(neighbors, true()))
+            .order_by(points.c.ord, search_distance)
+        )
+
+    def get_hot_statements(self, models):
+        """
+        Returns the (name, statement) pairs of the prepared statements of the most
+        frequent requests: the spatial data of a point and the unfiltered layer of each
+        of the given models in the output SRID and precision of the service.
+        """
+        statements = [("geoapp_spatial_data", self._build_spatial_data_query())]
+
+        for model in models:
+            statements.append(
+                self._get_feature_statement(
+                    model, {}, None, None, None, None, False, None
+                )
+            )
+
+        return statements
+
+    def get_spatial_data(self, x, y, source_srid=3857, radius=100):
         """
         Retrieves spatial information for a given coordinate (by default in EPSG:3857).
+
+        The neighborhoods, the number of homicides within ``radius`` meters and the
+        nearest subway station are answered by a single prepared statement that
+        transforms the point only once, or by the local spatial index if there is one.
+        """
+        if self.spatial_index is not None:
+            self.spatial_index.refresh_if_changed(self.session)
+            return self.spatial_index.query([(x, y)], source_srid, radius)[0]
+
+        params = {"xs": [x], "ys": [y], "srid": source_srid, "radius": radius}
+        row = execute_prepared(
+            self.session, "geoapp_spatial_data", self._build_spatial_data_query(), params
+        ).first()
+
+        return self._format_spatial_data(row)
+
+    def get_spatial_data_batch(self, points, source_srid=3857, radius=100, chunk_size=10000):
+        """
+        Retrieves the spatial information returned by ``get_spatial_data`` for many
+        coordinates at once. All points of a chunk are answered by one set-based query,
+        so the number of round trips depends on the number of chunks, not on the number
+        of points.
+
+        Args:
+            points (list): A list of (x, y) coordinates.
+            source_srid (int): The SRID of the coordinates.
+            radius (float): The distance in meters within which homicides are counted.
+            chunk_size (int): The maximum number of points sent in a single query.
+
+        Returns:
+            list: One result per point, in the order of the input points.
         """
-        point_geom = self._make_transformed_point(x, y)
-        neighborhoods = self._get_neighborhoods(point_geom)
-        number_of_homicides = self._count_homicides_nearby(point_geom)
-        subway = self._get_nearest_subway_station(point_geom)
+        if self.spatial_index is not None:
+            self.spatial_index.refresh_if_changed(self.session)
+            return self.spatial_index.query(points, source_srid, radius)
+
+        stmt = self._build_spatial_data_query()
+        results = []
+
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start : start + chunk_size]
+            params = {
+                "xs": [point[0] for point in chunk],
+                "ys": [point[1] for point in chunk],
+                "srid": source_srid,
+                "radius": radius,
+            }
+            for row in execute_prepared(
+                self.session, "geoapp_spatial_data", stmt, params
+            ):
+                results.append(self._format_spatial_data(row))
+
+        return results
+
+    def _build_spatial_data_query(self, target_srid=26918):
+        """
+        Builds a query answering the neighborhood, homicide count and nearest subway
+        station questions for every point of the ``xs``/``ys`` array parameters.
+        Each point is transformed once and the rows are returned in input order.
+        """
+        points = self._make_point_set(target_srid)
+
+        neighborhoods = (
+            select(func.array_agg(NycNeighborhoods.gid))
+            .where(func.ST_Intersects(NycNeighborhoods.geom, points.c.geom))
+            .scalar_subquery()
+        )
+        number_of_homicides = (
+            select(func.count())
+            .select_from(NycHomicides)
+            .where(
+                func.ST_DWithin(
+                    NycHomicides.geom, points.c.geom, bindparam("radius", type_=Double)
+                )
+            )
+            .scalar_subquery()
+        )
+        subway = (
+            select(
+                NycSubwayStations.gid,
+                func.ST_Distance(NycSubwayStations.geom, points.c.geom).label("distance"),
+            )
+            .order_by(NycSubwayStations.geom.op("<->")(points.c.geom))
+            # Only fetch the closest station
+            .limit(1)
+            .lateral("subway")
+        )
+
+        return (
+            select(
+                neighborhoods.label("neighborhoods"),
+                number_of_homicides.label("number_of_homicides"),
+                subway.c.gid.label("subway_gid"),
+                subway.c.distance.label("subway_distance"),
+            )
+            .select_from(points.outerjoin(subway, true()))
+            .order_by(points.c.ord)
+        )
+
+    def _make_point_set(self, target_srid=26918):
+        """
+        Creates a CTE of the points given by the ``xs`` and ``ys`` array parameters in the
+        ``srid`` parameter SRID, transformed to ``target_srid`` and numbered by their
+        position (``ord``).
+        """
+        coordinates = (
+            func.unnest(
+                bindparam("xs", type_=ARRAY(Double)),
+                bindparam("ys", type_=ARRAY(Double)),
+            )
+            .table_valued("x", "y", with_ordinality="ord")
+            .render_derived(name="coordinates")
+        )
+
+        return select(
+            coordinates.c.ord,
+            func.ST_Transform(
+                func.ST_SetSRID(
+                    func.ST_MakePoint(coordinates.c.x, coordinates.c.y),
+                    bindparam("srid", type_=Integer),
+                ),
+                target_srid,
+            ).label("geom"),
+        ).cte("points")
+
+    def _format_spatial_data(self, row):
+        """
+        Converts a row of the spatial data query to the response format of ``get_spatial_data``.
+        """
+        return self._format_spatial_result(
+            row.neighborhoods, row.number_of_homicides, row.subway_gid, row.subway_distance
+        )
+
+    def _format_spatial_result(
+        self, neighborhood_gids, number_of_homicides, subway_gid, subway_distance
+    ):
+        """
+        Builds the response of ``get_spatial_data`` from the GIDs of the neighborhoods,
+        the number of homicides and the GID and distance of the nearest subway station.
+        """
+        if neighborhood_gids:
+            neighborhoods = [{"neighborhood_gid": gid} for gid in neighborhood_gids]
+        else:
+            neighborhoods = None
+
+        if subway_gid is not None:
+            subway = {"subway_gid": subway_gid, "subway_distance": subway_distance}
+        else:
+            subway = None
 
         return {
             "neighborhoods": neighborhoods,
@@ -86,42 +1241,31 @@ class DbServices:
         """
         return func.ST_Transform(func.ST_SetSRID(func.ST_MakePoint(x, y), source_srid), target_srid)
 
-    def _get_neighborhoods(self, point_geom):
+    def _build_neighborhoods_query(self, point_geom):
         """
-        Returns GIDs of neighborhoods that contain the given point geometry, or None if not found.
+        Builds a query of the GIDs of neighborhoods that contain the given point geometry.
         """
-        stmt = select(NycNeighborhoods.gid).where(
+        return select(NycNeighborhoods.gid).where(
             func.ST_Intersects(NycNeighborhoods.geom, point_geom)
         )
-        result = self.session.execute(stmt).all()
-
-        if result:
-            neighborhoods = []
-            for row in result:
-                neighborhoods.append({"neighborhood_gid": row.gid})
-        else:
-            neighborhoods = None
-
-        return neighborhoods
 
-    def _count_homicides_nearby(self, point_geom, radius=100):
+    def _build_homicides_count_query(self, point_geom, radius=100):
         """
-        Counts the number of homicides within a specified distance from the given point geometry.
-        The default value of radius is 100 meters.
+        Builds a query counting the homicides within a specified distance from the given
+        point geometry. The default value of radius is 100 meters.
         """
-        stmt = (
+        return (
             select(func.count())
             .select_from(NycHomicides)
             .where(func.ST_DWithin(NycHomicides.geom, point_geom, radius))
         )
 
-        return self.session.execute(stmt).scalar()
-
-    def _get_nearest_subway_station(self, point_geom):
+    def _build_nearest_subway_query(self, point_geom):
         """
-        Returns the GID and distance in meters of the nearest subway station to the given point geometry.
+        Builds a query of the GID and distance in meters of the nearest subway station
+        to the given point geometry.
         """
-        stmt = (
+        return (
             select(
                 NycSubwayStations.gid,
                 func.ST_Distance(NycSubwayStations.geom, point_geom).label("distance"),
@@ -129,11 +1273,3 @@ class DbServices:
             # Only fetch the closest station
             .limit(1)
         )
-        result = self.session.execute(stmt).first()
-
-        if result:
-            response = {"subway_gid": result.gid, "subway_distance": result.distance}
-        else:
-            response = None
-
-        return response
@@ -0,0 +1,329 @@
+import datetime
+import logging
+
+from pyramid.settings import asbool
+from sqlalchemy import (
+    Text,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    literal_column,
+    select,
+    true,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from geoapp.models.enrichments import (
+    EnrichmentState,
+    NycCensusBlockNeighborhoods,
+    NycHomicideNeighborhoods,
+    NycStreetNearestStations,
+)
+from geoapp.models.models import (
+    NycCensusBlocks,
+    NycHomicides,
+    NycNeighborhoods,
+    NycStreets,
+    NycSubwayStations,
+)
+
+log = logging.getLogger(__name__)
+
+
+def _table_checksum(model):
+    """
+    Returns a query of the checksum of the whole content of a table, used for the
+    small lookup tables.
+    """
+    table = model.__table__
+    row_hash = func.md5(literal_column(table.name).cast(Text))
+    return select(
+        func.md5(
+            func.coalesce(
+                func.string_agg(row_hash, aggregate_order_by(literal(""), table.c.gid)),
+                "",
+            )
+        )
+    ).select_from(table)
+
+
+class Enrichment:
+    """
+    A table derived from a source table by a spatial join with lookup tables. Each row
+    of the table is computed from one row of the source table with the same ``gid``.
+
+    Args:
+        model (SQLAlchemy model): The model of the derived table.
+        source (SQLAlchemy model): The model of the source table.
+        lookups (tuple): The models of the tables joined to each source row.
+        build_select (callable): A function returning the select of the derived columns
+            (in the order of ``columns``) from the source table.
+        columns (tuple): The names of the derived columns, without ``source_hash``.
+    """
+
+    def __init__(self, model, source, lookups, build_select, columns):
+        self.model = model
+        self.source = source
+        self.lookups = lookups
+        self.build_select = build_select
+        self.columns = columns
+
+    @property
+    def name(self):
+        return self.model.__tablename__
+
+    def source_hash(self):
+        """
+        Returns the hash of the whole source row, which changes with any of its columns.
+        """
+        return func.md5(literal_column(self.source.__tablename__).cast(Text))
+
+    def select_rows(self):
+        return self.build_select().add_columns(self.source_hash().label("source_hash"))
+
+    def insert_rows(self, rows_query):
+        return insert(self.model).from_select(
+            [*self.columns, "source_hash"], rows_query
+        )
+
+
+def _neighborhood_of(geom):
+    """
+    Returns a lateral subquery of the neighborhood containing the given geometry, or of
+    the neighborhood containing its point on surface for polygons.
+    """
+    return (
+        select(NycNeighborhoods.gid, NycNeighborhoods.name, NycNeighborhoods.boroname)
+        .where(func.ST_Intersects(NycNeighborhoods.geom, geom))
+        .order_by(NycNeighborhoods.gid)
+        .limit(1)
+        .lateral("neighborhood")
+    )
+
+
+def _select_census_block_neighborhoods():
+    neighborhood = _neighborhood_of(func.ST_PointOnSurface(NycCensusBlocks.geom))
+    return select(
+        NycCensusBlocks.gid,
+        NycCensusBlocks.blkid,
+        NycCensusBlocks.popn_total,
+        neighborhood.c.gid,
+        neighborhood.c.name,
+        neighborhood.c.boroname,
+        NycCensusBlocks.geom,
+    ).select_from(NycCensusBlocks.__table__.outerjoin(neighborhood, true()))
+
+
+def _select_homicide_neighborhoods():
+    neighborhood = _neighborhood_of(NycHomicides.geom)
+    return select(
+        NycHomicides.gid,
+        NycHomicides.incident_d,
+        NycHomicides.weapon,
+        neighborhood.c.gid,
+        neighborhood.c.name,
+        neighborhood.c.boroname,
+        NycHomicides.geom,
+    ).select_from(NycHomicides.__table__.outerjoin(neighborhood, true()))
+
+
+def _select_street_nearest_stations():
+    station = (
+        select(
+            NycSubwayStations.gid,
+            NycSubwayStations.name,
+            NycSubwayStations.geom,
+            func.ST_Distance(NycSubwayStations.geom, NycStreets.geom).label("distance"),
+        )
+        .order_by(NycSubwayStations.geom.op("<->")(NycStreets.geom))
+        .limit(1)
+        .lateral("station")
+    )
+    return select(
+        NycStreets.gid,
+        NycStreets.name,
+        station.c.gid,
+        station.c.name,
+        # Position of the station along the street, as in nyc_subway_station_events;
+        # the first part is used for streets whose parts cannot be merged
+        func.ST_LineLocatePoint(
+            func.ST_GeometryN(func.ST_LineMerge(NycStreets.geom), 1), station.c.geom
+        ),
+        station.c.distance,
+        NycStreets.geom,
+    ).select_from(NycStreets.__table__.outerjoin(station, true()))
+
+
+ENRICHMENTS = {
+    enrichment.name: enrichment
+    for enrichment in (
+        Enrichment(
+            NycCensusBlockNeighborhoods,
+            NycCensusBlocks,
+            (NycNeighborhoods,),
+            _select_census_block_neighborhoods,
+            (
+                "gid",
+                "blkid",
+                "popn_total",
+                "neighborhood_gid",
+                "neighborhood_name",
+                "boroname",
+                "geom",
+            ),
+        ),
+        Enrichment(
+            NycHomicideNeighborhoods,
+            NycHomicides,
+            (NycNeighborhoods,),
+            _select_homicide_neighborhoods,
+            (
+                "gid",
+                "incident_d",
+                "weapon",
+                "neighborhood_gid",
+                "neighborhood_name",
+                "boroname",
+                "geom",
+            ),
+        ),
+        Enrichment(
+            NycStreetNearestStations,
+            NycStreets,
+            (NycSubwayStations,),
+            _select_street_nearest_stations,
+            ("gid", "name", "station_gid", "station_name", "measure", "distance", "geom"),
+        ),
+    )
+}
+
+
+class EnrichmentService:
+    """
+    Creates and refreshes the tables of ``ENRICHMENTS``.
+
+    Changes are detected from the data rather than from the table statistics, which
+    are updated asynchronously: the rows whose source row was deleted or changed
+    (detected by the hash of the source row) are deleted and the missing rows are
+    computed, and all rows are recomputed when the checksum of a lookup table changed
+    since the previous refresh. The refresh is reported as skipped when no row changed.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_tables(self):
+        """
+        Creates the enrichment tables and the refresh state table if they do not exist.
+        """
+        tables = [enrichment.model.__table__ for enrichment in ENRICHMENTS.values()]
+        tables.append(EnrichmentState.__table__)
+        EnrichmentState.metadata.create_all(self.connection, tables=tables)
+
+    def refresh(self, names=None, full=False):
+        """
+        Refreshes the given enrichment tables (all by default), in the transaction of
+        the connection.
+
+        Args:
+            names (list, optional): The names of the tables to refresh.
+            full (bool): Recomputes all rows even if the source tables did not change.
+
+        Raises:
+            KeyError: If a name is not the name of an enrichment table.
+
+        Returns:
+            dict: For each table, a dict with the refresh ``mode`` (skipped, incremental
+                or full) and the numbers of ``deleted`` and ``inserted`` rows.
+        """
+        results = {}
+
+        for name in names or ENRICHMENTS:
+            enrichment = ENRICHMENTS[name]
+            results[name] = self._refresh(enrichment, full)
+            log.info("Refreshed %s: %s", name, results[name])
+
+        return results
+
+    def _refresh(self, enrichment, full):
+        checksums = {
+            model.__tablename__: self.connection.execute(_table_checksum(model)).scalar()
+            for model in enrichment.lookups
+        }
+        previous = self.connection.execute(
+            select(EnrichmentState.source_versions).where(
+                EnrichmentState.name == enrichment.name
+            )
+        ).scalar()
+        previous = previous or {}
+
+        lookups_changed = any(
+            previous.get(table_name) != checksum
+            for table_name, checksum in checksums.items()
+        )
+
+        if full or lookups_changed:
+            mode = "full"
+            deleted = self.connection.execute(delete(enrichment.model)).rowcount
+            inserted = self.connection.execute(
+                enrichment.insert_rows(enrichment.select_rows())
+            ).rowcount
+        else:
+            # Compares the source rows with their hashes, so a change is never missed
+            deleted, inserted = self._refresh_changed_rows(enrichment)
+            if not (deleted or inserted):
+                return {"mode": "skipped", "deleted": 0, "inserted": 0}
+            mode = "incremental"
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.connection.execute(
+            pg_insert(EnrichmentState)
+            .values(name=enrichment.name, source_versions=checksums, refreshed_at=now)
+            .on_conflict_do_update(
+                index_elements=["name"],
+                set_={"source_versions": checksums, "refreshed_at": now},
+            )
+        )
+
+        return {"mode": mode, "deleted": deleted, "inserted": inserted}
+
+    def _refresh_changed_rows(self, enrichment):
+        """
+        Deletes the rows whose source row no longer exists or has changed, then computes
+        the rows of the source rows that have no row in the enrichment table.
+        """
+        model = enrichment.model
+        source = enrichment.source
+
+        deleted = self.connection.execute(
+            delete(model).where(
+                ~exists().where(
+                    source.gid == model.gid,
+                    enrichment.source_hash() == model.source_hash,
+                )
+            )
+        ).rowcount
+
+        missing_rows = enrichment.select_rows().where(
+            ~exists().where(model.gid == source.gid)
+        )
+        inserted = self.connection.execute(enrichment.insert_rows(missing_rows)).rowcount
+
+        return deleted, inserted
+
+
+def refresh_enrichments_on_startup(settings, engine):
+    """
+    Creates and refreshes the enrichment tables when the application starts if
+    ``geoapp.enrichments.refresh_on_startup`` is set.
+    """
+    if not asbool(settings.get("geoapp.enrichments.refresh_on_startup", False)):
+        return
+
+    with engine.begin() as connection:
+        service = EnrichmentService(connection)
+        service.create_tables()
+        service.refresh()
@@ -0,0 +1,270 @@
+import json
+
+from sqlalchemy import Date, Double, Float, Integer, Numeric, String
+from sqlalchemy.dialects.postgresql import TSTZRANGE
+
+# Imported by the first Arrow or Parquet export, see _import_pyarrow
+pyarrow = None
+
+# Content type and file extension of each export format
+EXPORT_FORMATS = {
+    "fgb": ("application/flatgeobuf", "fgb"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class _ChunkSink:
+    """
+    A write-only file object collecting the bytes written by pyarrow writers, so that
+    they can be yielded to the client after each batch.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ExportService:
+    """
+    A service class encoding the features of a model to columnar binary formats.
+
+    FlatGeobuf files are encoded by PostGIS; Arrow IPC streams and GeoParquet files are
+    encoded with pyarrow from batches of rows, using a schema typed after the model
+    columns and WKB geometries.
+    """
+
+    def __init__(self, db_service):
+        self.db_service = db_service
+
+    def iter_export(
+        self,
+        model,
+        filters,
+        export_format,
+        bbox=None,
+        batch_size=10000,
+        max_fgb_features=None,
+        chunk_size=1024 * 1024,
+    ):
+        """
+        Streams the features of the model encoded in the given format. FlatGeobuf files
+        are not streamed: PostGIS encodes them in one piece, which is then sent in
+        chunks (see ``DbServices.get_flatgeobuf``).
+
+        Args:
+            model (SQLAlchemy model): The database model from which features are retrieved.
+            filters (dict): A dictionary of filters to apply when querying the database.
+            export_format (str): One of the keys of ``EXPORT_FORMATS``.
+            bbox (tuple, optional): A (minx, miny, maxx, maxy, srid) bounding box.
+            batch_size (int): The number of rows encoded per batch (or row group).
+            max_fgb_features (int, optional): The highest number of features of a
+                FlatGeobuf file.
+            chunk_size (int): The size of the chunks of a FlatGeobuf file.
+
+        Raises:
+            RuntimeError: If the format requires pyarrow and it is not installed.
+            ValueError: If a FlatGeobuf file would have more than ``max_fgb_features``
+                features.
+
+        Returns:
+            iterator: The chunks of the encoded file.
+        """
+        if export_format == "fgb":
+            data = self.db_service.get_flatgeobuf(model, filters, bbox, max_fgb_features)
+            return _iter_chunks(data, chunk_size)
+        try:
+            _import_pyarrow()
+        except ImportError:
+            # Arrow and Parquet exports require the optional "export" extra
+            raise RuntimeError(f"The '{export_format}' export format requires pyarrow.")
+
+        schema = self._build_schema(model, export_format)
+        batches = self._iter_record_batches(schema, model, filters, bbox, batch_size)
+
+        if export_format == "arrow":
+            return self._iter_arrow(schema, batches)
+
+        return self._iter_parquet(schema, batches)
+
+    def _iter_arrow(self, schema, batches):
+        sink = _ChunkSink()
+
+        with pyarrow.ipc.new_stream(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+    def _iter_parquet(self, schema, batches):
+        sink = _ChunkSink()
+
+        with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+    def _iter_record_batches(self, schema, model, filters, bbox, batch_size):
+        converters = [
+            self._converter(column.type)
+            for column in self.db_service.get_property_columns(model)
+        ]
+        # WKB geometries are returned as memoryviews
+        converters.append(_to_bytes)
+
+        for rows in self.db_service.iter_feature_rows(model, filters, bbox, batch_size):
+            arrays = []
+            for i, field in enumerate(schema):
+                values = [row[i] for row in rows]
+                if converters[i] is not None:
+                    values = [converters[i](value) for value in values]
+                arrays.append(pyarrow.array(values, type=field.type))
+            yield pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def _build_schema(self, model, export_format):
+        """
+        Builds the Arrow schema of the export from the model column types. The geometry
+        is a WKB column described by GeoArrow field metadata, plus GeoParquet file
+        metadata for Parquet exports.
+        """
+        fields = [
+            pyarrow.field(column.name, self._arrow_type(column.type))
+            for column in self.db_service.get_property_columns(model)
+        ]
+
+        crs = _projjson(self.db_service.target_srid)
+        geometry_field = pyarrow.field(
+            "geometry",
+            pyarrow.binary(),
+            metadata={
+                "ARROW:extension:name": "geoarrow.wkb",
+                "ARROW:extension:metadata": json.dumps({"crs": crs}),
+            },
+        )
+        schema = pyarrow.schema(fields + [geometry_field])
+
+        if export_format == "parquet":
+            geometry_type = model.geom.type.geometry_type
+            geo_metadata = {
+                "version": "1.0.0",
+                "primary_column": "geometry",
+                "columns": {
+                    "geometry": {
+                        "encoding": "WKB",
+                        "geometry_types": _geoparquet_geometry_types(geometry_type),
+                        "crs": crs,
+                    }
+                },
+            }
+            schema = schema.with_metadata({"geo": json.dumps(geo_metadata)})
+
+        return schema
+
+    def _converter(self, column_type):
+        """
+        Returns the function converting the values of a column to the Python values
+        expected by pyarrow for its Arrow type, or None if they are used as-is.
+        """
+        if isinstance(column_type, TSTZRANGE):
+            return _range_to_dict
+        # Arbitrary precision numbers are fetched as Decimals, which pyarrow does not
+        # convert to doubles
+        if isinstance(column_type, Numeric) and not isinstance(column_type, Float):
+            return _to_float
+        return None
+
+    def _arrow_type(self, column_type):
+        if isinstance(column_type, Integer):
+            return pyarrow.int32()
+        # Double is a subclass of Numeric; arbitrary precision numbers are exported as
+        # doubles as in the JSON responses
+        if isinstance(column_type, (Double, Numeric)):
+            return pyarrow.float64()
+        if isinstance(column_type, Date):
+            return pyarrow.date32()
+        if isinstance(column_type, TSTZRANGE):
+            timestamp = pyarrow.timestamp("us", tz="UTC")
+            return pyarrow.struct(
+                [("lower", timestamp), ("upper", timestamp), ("bounds", pyarrow.string())]
+            )
+        if isinstance(column_type, String):
+            return pyarrow.string()
+        raise TypeError(f"Unsupported column type {column_type!r}.")
+
+
+def _iter_chunks(data, chunk_size):
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start : start + chunk_size])
+
+
+def _import_pyarrow():
+    """
+    Imports pyarrow, which is only needed by the Arrow and Parquet exports and would
+    otherwise add to the import time of every worker.
+    """
+    global pyarrow
+
+    if pyarrow is None:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+
+
+def _range_to_dict(value):
+    if value is None:
+        return None
+    bounds = ("[" if value.lower_inc else "(") + ("]" if value.upper_inc else ")")
+    return {"lower": value.lower, "upper": value.upper, "bounds": bounds}
+
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+
+def _to_bytes(value):
+    return bytes(value) if value is not None else None
+
+
+def _projjson(srid):
+    from pyproj import CRS
+
+    return CRS.from_epsg(srid).to_json_dict()
+
+
+def _geoparquet_geometry_types(geometry_type):
+    """
+    Converts a PostGIS geometry type (e.g. MULTIPOLYGON) to the GeoParquet geometry types.
+    """
+    names = {
+        "POINT": "Point",
+        "LINESTRING": "LineString",
+        "POLYGON": "Polygon",
+        "MULTIPOINT": "MultiPoint",
+        "MULTILINESTRING": "MultiLineString",
+        "MULTIPOLYGON": "MultiPolygon",
+        "GEOMETRYCOLLECTION": "GeometryCollection",
+    }
+    name = names.get(geometry_type)
+
+    return [name] if name else []
@@ -0,0 +1,370 @@
+import datetime
+import decimal
+import functools
+import math
+
+from geoalchemy2.types import Geometry
+from sqlalchemy import (
+    Double,
+    Float,
+    Integer,
+    Numeric,
+    String,
+    Text,
+    any_,
+    bindparam,
+    func,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+
+# Columns that cannot be filtered
+UNFILTERABLE_COLUMNS = {"geom_invalid", "source_hash"}
+
+# Separator of the column name and the operator in filter parameter names
+OPERATOR_SEPARATOR = "__"
+
+# Default SRID of the coordinates of the spatial operators
+DEFAULT_FILTER_SRID = 4326
+
+# Operators of each kind of column. Every operator compiles to a predicate that can
+# be answered by a B-tree index on the column (GiST for the spatial operators); like
+# patterns can use an index created with text_pattern_ops when they have a prefix.
+SCALAR_OPERATORS = ("eq", "ne", "in")
+ORDERED_OPERATORS = SCALAR_OPERATORS + ("gt", "gte", "lt", "lte", "between")
+TEXT_OPERATORS = ORDERED_OPERATORS + ("like",)
+SPATIAL_OPERATORS = ("within", "dwithin")
+
+
+class FilterError(ValueError):
+    """
+    Raised when a filter parameter names an unknown column or operator, or its value
+    cannot be converted to the type of the column.
+    """
+
+
+class FieldFilter:
+    """
+    The filterable column of a model: its operators and the conversion of the
+    parameter values to the Python type of the column.
+    """
+
+    def __init__(self, column, operators, parse_value):
+        self.column = column
+        self.operators = operators
+        self.parse_value = parse_value
+
+
+def _parse_bool(value):
+    lowered = value.lower()
+    if lowered in ("true", "t", "1", "yes", "on"):
+        return True
+    if lowered in ("false", "f", "0", "no", "off"):
+        return False
+    raise ValueError
+
+
+def _parse_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError
+    return number
+
+
+def _parse_decimal(value):
+    number = decimal.Decimal(value)
+    if not number.is_finite():
+        raise ValueError
+    return number
+
+
+VALUE_PARSERS = {
+    int: int,
+    float: _parse_float,
+    decimal.Decimal: _parse_decimal,
+    str: str,
+    bool: _parse_bool,
+    datetime.date: datetime.date.fromisoformat,
+    datetime.datetime: datetime.datetime.fromisoformat,
+}
+
+
+def _parse_coordinates(value, count, known_srids):
+    """
+    Parses ``count`` numbers followed by an optional integer SRID, which must be one
+    of ``known_srids()``.
+    """
+    parts = value.split(",")
+    if len(parts) not in (count, count + 1):
+        raise ValueError
+
+    numbers = [_parse_float(part) for part in parts[:count]]
+    if len(parts) == count:
+        return numbers, DEFAULT_FILTER_SRID
+
+    srid = int(parts[count])
+    if srid not in known_srids():
+        raise ValueError
+    return numbers, srid
+
+
+@functools.lru_cache(maxsize=None)
+def get_filter_schema(model):
+    """
+    Returns the filterable columns of the model by name, derived once from the column
+    types of the model.
+
+    Returns:
+        dict: A ``FieldFilter`` for each filterable column.
+    """
+    schema = {}
+
+    for column in model.__table__.c:
+        if column.name in UNFILTERABLE_COLUMNS:
+            continue
+
+        if isinstance(column.type, Geometry):
+            schema[column.name] = FieldFilter(column, SPATIAL_OPERATORS, None)
+            continue
+
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            # Ranges and other types without a Python equivalent
+            continue
+
+        parse_value = VALUE_PARSERS.get(python_type)
+        if parse_value is None:
+            continue
+
+        if python_type is str:
+            operators = TEXT_OPERATORS
+        elif python_type is bool:
+            operators = SCALAR_OPERATORS
+        else:
+            operators = ORDERED_OPERATORS
+        schema[column.name] = FieldFilter(column, operators, parse_value)
+
+    return schema
+
+
+@functools.lru_cache(maxsize=1024)
+def get_filter_plan(model, keys):
+    """
+    Returns the plan of the filter parameters ``keys`` (the shape of a query string,
+    without its values), cached so that requests of the same shape are not parsed
+    again.
+
+    Raises:
+        FilterError: If a parameter names an unknown column or operator.
+
+    Returns:
+        tuple: A (key, field filter, operator) tuple for each key.
+    """
+    schema = get_filter_schema(model)
+    plan = []
+    invalid_keys = []
+
+    for key in keys:
+        name, _, operator = key.partition(OPERATOR_SEPARATOR)
+        field = schema.get(name)
+        operator = operator or "eq"
+
+        if field is None or operator not in field.operators:
+            invalid_keys.append(key)
+        else:
+            plan.append((key, field, operator))
+
+    if invalid_keys:
+        raise FilterError(f"Invalid filter parameters: {', '.join(invalid_keys)}.")
+
+    return tuple(plan)
+
+
+def _parse_operand(field, operator, value, known_srids):
+    """
+    Converts the parameter value of an operator to the Python values of its operand.
+    """
+    if operator == "within":
+        # minx,miny,maxx,maxy[,srid]
+        numbers, srid = _parse_coordinates(value, 4, known_srids)
+        if numbers[0] >= numbers[2] or numbers[1] >= numbers[3]:
+            raise ValueError
+        return (*numbers, srid)
+    if operator == "dwithin":
+        # x,y,distance[,srid], the distance is in units of the stored geometry
+        numbers, srid = _parse_coordinates(value, 3, known_srids)
+        if numbers[2] < 0:
+            raise ValueError
+        return (*numbers, srid)
+    if operator == "in":
+        return tuple(field.parse_value(part) for part in value.split(","))
+    if operator == "between":
+        low, high = (field.parse_value(part) for part in value.split(","))
+        if low > high:
+            raise ValueError
+        return low, high
+    return field.parse_value(value)
+
+
+def parse_filters(model, params, known_srids):
+    """
+    Validates the filter parameters and converts their values to the types of their
+    columns. Parameters are ``column=value`` (equality) or ``column__operator=value``:
+
+    - ``eq``, ``ne``, ``gt``, ``gte``, ``lt``, ``lte``: comparisons;
+    - ``between=low,high``: inclusive range;
+    - ``in=a,b,c``: one of the values;
+    - ``like=pattern``: SQL LIKE pattern of text columns;
+    - ``geom__within=minx,miny,maxx,maxy[,srid]``: geometries inside the box;
+    - ``geom__dwithin=x,y,distance[,srid]``: geometries within the distance (in
+      units of the stored geometry, meters for EPSG:26918) of the point.
+
+    The coordinates of the spatial operators are in EPSG:4326 unless an SRID is given.
+
+    Args:
+        model (SQLAlchemy model): The model whose columns are filtered.
+        params (dict): The filter parameters and their string values.
+        known_srids (callable): Returns the SRIDs accepted by the spatial operators,
+            those of ``spatial_ref_sys``. It is only called when an SRID is given.
+
+    Raises:
+        FilterError: If a parameter or a value is invalid.
+
+    Returns:
+        dict: The parameters and their converted values, the ``filters`` argument of
+            the ``DbServices`` methods.
+    """
+    plan = get_filter_plan(model, tuple(sorted(params)))
+    filters = {}
+    invalid_values = []
+
+    for key, field, operator in plan:
+        try:
+            filters[key] = _parse_operand(field, operator, params[key], known_srids)
+        except (ArithmeticError, TypeError, ValueError):
+            # decimal.InvalidOperation is an ArithmeticError
+            invalid_values.append(key)
+
+    if invalid_values:
+        raise FilterError(f"Invalid values of the filters: {', '.join(invalid_values)}.")
+
+    return filters
+
+
+# Names of the values of the operands of the spatial operators
+SPATIAL_OPERANDS = {
+    "within": ("minx", "miny", "maxx", "maxy", "srid"),
+    "dwithin": ("x", "y", "distance", "srid"),
+}
+
+
+def _bind_type(column):
+    """
+    Returns the type of the parameters compared with the column. The length of
+    strings and the scale of numerics are left out, so that parameters are not
+    truncated or rounded when the statement is prepared with typed parameters.
+    """
+    column_type = column.type
+    if isinstance(column_type, String):
+        return Text()
+    if isinstance(column_type, Numeric) and not isinstance(column_type, Float):
+        return Numeric()
+    return column_type
+
+
+def _operand_parameters(column, operator, operand, name):
+    """
+    Returns the bound parameters of the operand of a filter, named after ``name``.
+    """
+    if operator in SPATIAL_OPERANDS:
+        return [
+            bindparam(
+                f"{name}_{part}", value, type_=Integer if part == "srid" else Double
+            )
+            for part, value in zip(SPATIAL_OPERANDS[operator], operand)
+        ]
+    if operator == "between":
+        return [
+            bindparam(f"{name}_{part}", value, type_=_bind_type(column))
+            for part, value in zip(("low", "high"), operand)
+        ]
+    if operator == "in":
+        return [bindparam(name, list(operand), type_=ARRAY(_bind_type(column)))]
+    return [bindparam(name, operand, type_=_bind_type(column))]
+
+
+def _predicate(column, operator, operands):
+    if operator == "eq":
+        return column == operands[0]
+    if operator == "ne":
+        return column != operands[0]
+    if operator == "gt":
+        return column > operands[0]
+    if operator == "gte":
+        return column >= operands[0]
+    if operator == "lt":
+        return column < operands[0]
+    if operator == "lte":
+        return column <= operands[0]
+    if operator == "between":
+        return column.between(*operands)
+    if operator == "in":
+        # A single array parameter, whatever the number of values
+        return column == any_(operands[0])
+    if operator == "like":
+        return column.like(operands[0])
+
+    # The query geometry is transformed to the SRID of the column (ST_Transform
+    # returns it as-is if it already is in that SRID), so the GiST index on the
+    # column can be used
+    model_srid = column.type.srid
+    if operator == "within":
+        *bounds, srid = operands
+        envelope = func.ST_MakeEnvelope(*bounds, srid)
+        return func.ST_Within(column, func.ST_Transform(envelope, model_srid))
+    if operator == "dwithin":
+        x, y, distance, srid = operands
+        point = func.ST_SetSRID(func.ST_MakePoint(x, y), srid)
+        return func.ST_DWithin(column, func.ST_Transform(point, model_srid), distance)
+
+    raise FilterError(f"Unknown filter operator {operator!r}.")
+
+
+def _bound_filters(model, filters):
+    """
+    Yields the column, operator and bound parameters of each filter. Parameters are
+    named after the position of the filter in the plan, so filters of the same shape
+    always have the same parameter names.
+    """
+    plan = get_filter_plan(model, tuple(sorted(filters)))
+    for i, (key, field, operator) in enumerate(plan):
+        operands = _operand_parameters(
+            field.column, operator, filters[key], f"filter_{i}"
+        )
+        yield field.column, operator, operands
+
+
+def build_filter_predicates(model, filters):
+    """
+    Returns the SQL predicates of filters returned by ``parse_filters``. The values are
+    named bound parameters, so the statement is the same for every request of the
+    same shape and can be cached (see ``get_filter_parameters``).
+
+    Raises:
+        FilterError: If a filter names an unknown column or operator.
+    """
+    return [
+        _predicate(column, operator, operands)
+        for column, operator, operands in _bound_filters(model, filters)
+    ]
+
+
+def get_filter_parameters(model, filters):
+    """
+    Returns the values of the bound parameters of ``build_filter_predicates`` by name.
+    """
+    return {
+        operand.key: operand.value
+        for _, _, operands in _bound_filters(model, filters)
+        for operand in operands
+    }
@@ -0,0 +1,173 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+# Timings (a RequestTimings) of the request handled by the current thread, if any
+current_timings = contextvars.ContextVar("geoapp_request_timings", default=None)
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Metric:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.label_names, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing value.
+    """
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Gauge(_Metric):
+    """
+    A value read from a callback each time the metrics are exported.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self):
+        yield f"{self.name} {self.callback()}"
+
+
+class Histogram(_Metric):
+    """
+    Counts observed values in cumulative buckets, with their count and sum.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = self._format_labels(key, ("le", bound))
+                yield f"{self.name}_bucket{labels} {count}"
+            labels = self._format_labels(key, ("le", "+Inf"))
+            yield f"{self.name}_bucket{labels} {counts[-2]}"
+            yield f"{self.name}_count{self._format_labels(key)} {counts[-2]}"
+            yield f"{self.name}_sum{self._format_labels(key)} {counts[-1]}"
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics exported in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Registers the metric, replacing a previously registered metric with the same
+        name, and returns it.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._get_or_register(Counter, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_register(
+            Histogram, name, documentation, label_names, buckets=buckets
+        )
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+    def _get_or_register(self, metric_class, name, documentation, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, label_names, **kwargs)
+                self._metrics[name] = metric
+        return metric
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Registry of the process, exported by the /metrics route
+METRICS = MetricsRegistry()
+
+
+@contextlib.contextmanager
+def measure(phase):
+    """
+    Adds the duration of the block to the given phase of the current request, if any.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
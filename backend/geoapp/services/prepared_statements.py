@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.types import NullType
+
+# Compiles statements with $1, $2, ... placeholders as expected by PREPARE
+_dialect = psycopg2.dialect(paramstyle="numeric_dollar")
+
+# Highest number of compiled statements kept in memory, and of statements prepared
+# on each connection; the least recently used ones are evicted, and deallocated from
+# the connection
+MAX_COMPILED_STATEMENTS = 1024
+MAX_PREPARED_STATEMENTS = 256
+
+_compiled_statements = OrderedDict()
+_lock = threading.Lock()
+
+
+def execute_prepared(session, name, stmt, params):
+    """
+    Executes a statement as a server-side prepared statement, so that Postgres plans it
+    only once per connection. The statement is compiled once per name; later calls with
+    the same name reuse the compiled SQL and only bind the new parameter values.
+
+    Prepared statements can be disabled for an engine with the
+    ``geoapp_prepared_statements=False`` execution option, e.g. behind a transaction
+    pooler that does not keep session state between transactions.
+
+    Args:
+        session (Session): The session whose connection executes the statement.
+        name (str): A unique name of the statement.
+        stmt (Executable): The SQLAlchemy statement; it must be the same for every call
+            with the same name.
+        params (dict): The values of the named bind parameters of the statement.
+
+    Returns:
+        CursorResult: The result of the execution.
+    """
+    connection = session.connection()
+
+    if not connection.get_execution_options().get("geoapp_prepared_statements", True):
+        return connection.execute(stmt, params)
+
+    param_names, default_values = prepare(connection, name, stmt)
+    values = tuple(params.get(key, default_values[key]) for key in param_names)
+    placeholders = ", ".join(["%s"] * len(values))
+
+    return connection.exec_driver_sql(f"EXECUTE {name}({placeholders})", values)
+
+
+def prepare(connection, name, stmt):
+    """
+    Prepares a statement on the connection unless it already is, e.g. to prepare the
+    most frequent statements before the first request (see ``geoapp.config.warmup``).
+
+    Returns:
+        tuple: The ordered parameter names of the statement and the values of its
+            anonymous parameters.
+    """
+    sql, param_names, default_values = _compile(name, stmt)
+    _prepare_sql(connection, name, sql)
+
+    return param_names, default_values
+
+
+def prepare_compiled(connection, name):
+    """
+    Prepares on the connection a statement already compiled by ``execute_prepared``
+    or ``prepare`` under the given name, e.g. to explain an ``EXECUTE`` statement run
+    on another connection.
+
+    Raises:
+        KeyError: If no statement was compiled under the name, or it was evicted.
+    """
+    with _lock:
+        sql = _compiled_statements[name][0]
+
+    _prepare_sql(connection, name, sql)
+
+
+def _prepare_sql(connection, name, sql):
+    # Connection.info lives as long as the underlying DBAPI connection
+    prepared = connection.info.setdefault("geoapp_prepared_statements", OrderedDict())
+
+    if name in prepared:
+        prepared.move_to_end(name)
+        return
+
+    connection.exec_driver_sql(sql)
+    prepared[name] = None
+
+    while len(prepared) > MAX_PREPARED_STATEMENTS:
+        evicted, _ = prepared.popitem(last=False)
+        connection.exec_driver_sql(f"DEALLOCATE {evicted}")
+
+
+def _compile(name, stmt):
+    """
+    Returns the PREPARE statement, the ordered parameter names and the values of the
+    anonymous parameters of the statement registered under the given name.
+    """
+    with _lock:
+        compiled_statement = _compiled_statements.get(name)
+        if compiled_statement is not None:
+            _compiled_statements.move_to_end(name)
+
+    if compiled_statement is None:
+        compiled = stmt.compile(dialect=_dialect)
+        param_types = []
+
+        for key in compiled.positiontup:
+            bind_type = compiled.binds[key].type
+            if isinstance(bind_type, NullType):
+                raise ValueError(f"Parameter '{key}' of statement '{name}' has no type.")
+            param_types.append(_dialect.type_compiler_instance.process(bind_type))
+
+        sql = f"PREPARE {name} ({', '.join(param_types)}) AS {compiled.string}"
+        compiled_statement = (sql, list(compiled.positiontup), compiled.params)
+
+        with _lock:
+            _compiled_statements[name] = compiled_statement
+            while len(_compiled_statements) > MAX_COMPILED_STATEMENTS:
+                _compiled_statements.popitem(last=False)
+
+    return compiled_statement
@@ -0,0 +1,180 @@
+import functools
+import threading
+
+import numpy
+import shapely
+from pyramid.settings import asbool
+from sqlalchemy import func, select
+
+from geoapp.models.models import NycHomicides, NycNeighborhoods, NycSubwayStations
+
+# Layers held in memory, they are small and rarely change
+INDEXED_MODELS = (NycNeighborhoods, NycHomicides, NycSubwayStations)
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(source_srid, target_srid):
+    """
+    Returns a cached transformer between two SRIDs, with x/y (lon/lat) axis order.
+    """
+    # pyproj is only imported by the workers that enable the spatial index
+    from pyproj import Transformer
+
+    return Transformer.from_crs(source_srid, target_srid, always_xy=True)
+
+
+class _LayerIndex:
+    """
+    The gids, prepared geometries and STRtree of a single layer.
+    """
+
+    def __init__(self, gids, geoms):
+        self.gids = numpy.asarray(gids)
+        self.geoms = geoms
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+
+
+class LocalSpatialIndex:
+    """
+    In-memory spatial index of the neighborhoods, homicides and subway stations layers.
+
+    It answers the questions of ``DbServices.get_spatial_data`` with Shapely STRtrees
+    instead of database queries. The layers are reloaded when the version of one of
+    their tables changes.
+    """
+
+    def __init__(self, version_probe, target_srid=26918):
+        self.version_probe = version_probe
+        self.target_srid = target_srid
+        self._layers = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def load(self, connection):
+        """
+        Loads all indexed layers from the database. ``connection`` can be a Session or
+        a Connection.
+        """
+        with self._lock:
+            self._load(connection)
+
+    def _load(self, connection):
+        layers = {}
+        versions = {}
+
+        for model in INDEXED_MODELS:
+            table_name = model.__tablename__
+            versions[table_name] = self.version_probe.get_version(
+                connection, table_name
+            )[0]
+            rows = connection.execute(
+                select(model.gid, func.ST_AsBinary(model.geom)).where(
+                    model.geom.is_not(None)
+                )
+            ).all()
+            layers[table_name] = _LayerIndex(
+                [row[0] for row in rows],
+                shapely.from_wkb([bytes(row[1]) for row in rows]),
+            )
+
+        self._layers = layers
+        self._versions = versions
+
+    def _has_changed(self, session):
+        return any(
+            self.version_probe.get_version(session, table_name)[0] != loaded_version
+            for table_name, loaded_version in self._versions.items()
+        )
+
+    def refresh_if_changed(self, session):
+        """
+        Reloads the layers if the version of any of their tables has changed.
+        """
+        if not self._has_changed(session):
+            return
+
+        with self._lock:
+            # Concurrent requests wait for the first one to reload the layers, the
+            # versions are checked again so that they do not reload them again
+            if self._has_changed(session):
+                self._load(session)
+
+    def query(self, points, source_srid=3857, radius=100):
+        """
+        Returns the spatial data of ``DbServices.get_spatial_data`` for every point.
+
+        Args:
+            points (list): A list of (x, y) coordinates.
+            source_srid (int): The SRID of the coordinates.
+            radius (float): The distance in meters within which homicides are counted.
+
+        Returns:
+            list: One result per point, in the order of the input points.
+        """
+        if not points:
+            return []
+
+        layers = self._layers
+        xs, ys = numpy.asarray(points, dtype=float).T
+        xs, ys = get_transformer(source_srid, self.target_srid).transform(xs, ys)
+        geoms = shapely.points(xs, ys)
+
+        neighborhoods = layers[NycNeighborhoods.__tablename__]
+        point_index, tree_index = neighborhoods.tree.query(geoms, predicate="intersects")
+        neighborhood_gids = [[] for _ in range(len(geoms))]
+        for point, tree in zip(point_index, tree_index):
+            neighborhood_gids[point].append(int(neighborhoods.gids[tree]))
+
+        homicides = layers[NycHomicides.__tablename__]
+        point_index, _ = homicides.tree.query(
+            geoms, predicate="dwithin", distance=radius
+        )
+        homicide_counts = numpy.bincount(point_index, minlength=len(geoms))
+
+        stations = layers[NycSubwayStations.__tablename__]
+        if len(stations.geoms):
+            nearest = stations.tree.nearest(geoms)
+            distances = shapely.distance(geoms, stations.geoms[nearest])
+
+        results = []
+        for i in range(len(geoms)):
+            if neighborhood_gids[i]:
+                neighborhoods_data = [
+                    {"neighborhood_gid": gid} for gid in sorted(neighborhood_gids[i])
+                ]
+            else:
+                neighborhoods_data = None
+
+            if len(stations.geoms):
+                subway = {
+                    "subway_gid": int(stations.gids[nearest[i]]),
+                    "subway_distance": float(distances[i]),
+                }
+            else:
+                subway = None
+
+            results.append(
+                {
+                    "neighborhoods": neighborhoods_data,
+                    "number_of_homicides": int(homicide_counts[i]),
+                    "subway": subway,
+                }
+            )
+
+        return results
+
+
+def create_spatial_index(settings, engine, version_probe):
+    """
+    Creates and loads the local spatial index if ``geoapp.spatial_index.enabled`` is set,
+    otherwise returns None.
+    """
+    if not asbool(settings.get("geoapp.spatial_index.enabled", False)):
+        return None
+
+    spatial_index = LocalSpatialIndex(version_probe)
+    with engine.connect() as connection:
+        spatial_index.load(connection)
+
+    return spatial_index
@@ -0,0 +1,224 @@
+import numpy
+import shapely
+
+# Default number of distinct values per axis of quantized coordinates
+DEFAULT_QUANTIZATION = 100000
+
+
+def build_topology(features, object_name, quantization=DEFAULT_QUANTIZATION):
+    """
+    Encodes features as a TopoJSON topology. Coordinates are quantized to integers and
+    lines and polygon rings are split into arcs at their junctions, so a boundary
+    shared by several polygons (e.g. neighboring census blocks) is stored once. Arcs
+    are delta-encoded.
+
+    Args:
+        features (iterable): (properties, geometry) pairs, where geometry is a Shapely
+            geometry or None.
+        object_name (str): The name of the GeometryCollection of the topology.
+        quantization (int): The number of distinct values per axis, at least 2.
+
+    Returns:
+        dict: The TopoJSON Topology.
+    """
+    features = list(features)
+    geometries = [geometry for _, geometry in features if geometry is not None]
+
+    if geometries:
+        minx, miny, maxx, maxy = shapely.total_bounds(geometries).tolist()
+    else:
+        minx = miny = maxx = maxy = 0.0
+    scale = (
+        (maxx - minx) / (quantization - 1) if maxx > minx else 1.0,
+        (maxy - miny) / (quantization - 1) if maxy > miny else 1.0,
+    )
+    translate = (minx, miny)
+    builder = _TopologyBuilder(translate, scale)
+
+    objects = [
+        builder.add_geometry(geometry, properties)
+        for properties, geometry in features
+    ]
+    arcs = builder.build_arcs()
+
+    return {
+        "type": "Topology",
+        "bbox": [minx, miny, maxx, maxy],
+        "transform": {"scale": list(scale), "translate": list(translate)},
+        "objects": {
+            object_name: {"type": "GeometryCollection", "geometries": objects}
+        },
+        "arcs": arcs,
+    }
+
+
+class _TopologyBuilder:
+    """
+    Collects the quantized lines and rings of the geometries, then cuts them into
+    shared arcs. Geometry objects reference their lines by index until the arcs are
+    built, when the references are replaced by arc indexes.
+    """
+
+    def __init__(self, translate, scale):
+        self.translate = numpy.asarray(translate)
+        self.scale = numpy.asarray(scale)
+        # Quantized point sequences and whether each one is a closed ring
+        self.lines = []
+        self.rings = []
+        # Geometry objects whose "arcs" member holds line indexes
+        self.pending = []
+
+    def quantize(self, geometry):
+        coords = shapely.get_coordinates(geometry)
+        quantized = numpy.rint((coords - self.translate) / self.scale).astype(numpy.int64)
+        points = [tuple(point) for point in quantized.tolist()]
+
+        # Remove the points merged by the quantization
+        return [
+            point for i, point in enumerate(points) if i == 0 or point != points[i - 1]
+        ]
+
+    def add_line(self, geometry, ring):
+        points = self.quantize(geometry)
+        if ring:
+            # Open the ring, the closing point is added back to its last arc
+            points = points[:-1] if len(points) > 1 and points[0] == points[-1] else points
+            if len(points) < 3:
+                return None
+        elif len(points) < 2:
+            return None
+
+        self.lines.append(points)
+        self.rings.append(ring)
+        return len(self.lines) - 1
+
+    def add_polygon(self, polygon):
+        rings = [self.add_line(polygon.exterior, True)]
+        if rings[0] is None:
+            return None
+        rings.extend(self.add_line(interior, True) for interior in polygon.interiors)
+        return [index for index in rings if index is not None]
+
+    def add_geometry(self, geometry, properties):
+        obj = {"type": None, "properties": properties}
+
+        if geometry is None or geometry.is_empty:
+            return obj
+
+        geometry_type = geometry.geom_type
+
+        if geometry_type == "Point":
+            obj["type"] = "Point"
+            obj["coordinates"] = list(self.quantize(geometry)[0])
+        elif geometry_type == "MultiPoint":
+            obj["type"] = "MultiPoint"
+            obj["coordinates"] = [list(point) for point in self.quantize(geometry)]
+        elif geometry_type == "LineString":
+            line = self.add_line(geometry, False)
+            if line is not None:
+                obj.update(type="LineString", arcs=line)
+        elif geometry_type == "MultiLineString":
+            lines = [self.add_line(part, False) for part in geometry.geoms]
+            lines = [line for line in lines if line is not None]
+            if lines:
+                obj.update(type="MultiLineString", arcs=lines)
+        elif geometry_type == "Polygon":
+            rings = self.add_polygon(geometry)
+            if rings:
+                obj.update(type="Polygon", arcs=rings)
+        elif geometry_type == "MultiPolygon":
+            polygons = [self.add_polygon(part) for part in geometry.geoms]
+            polygons = [rings for rings in polygons if rings]
+            if polygons:
+                obj.update(type="MultiPolygon", arcs=polygons)
+        else:
+            raise ValueError(f"Unsupported geometry type {geometry_type}.")
+
+        if "arcs" in obj:
+            self.pending.append(obj)
+
+        return obj
+
+    def find_junctions(self):
+        """
+        Returns the points where lines meet or diverge: the end points of lines, and the
+        points whose neighbors differ between two of the lines passing through them.
+        """
+        neighbors = {}
+        junctions = set()
+
+        for points, ring in zip(self.lines, self.rings):
+            count = len(points)
+            if not ring:
+                junctions.add(points[0])
+                junctions.add(points[-1])
+            for i in range(count):
+                if ring:
+                    previous, following = points[i - 1], points[(i + 1) % count]
+                elif 0 < i < count - 1:
+                    previous, following = points[i - 1], points[i + 1]
+                else:
+                    continue
+                # Neighboring polygons traverse their shared boundary in opposite
+                # directions, so the order of the neighbors does not matter
+                pair = frozenset((previous, following))
+                if neighbors.setdefault(points[i], pair) != pair:
+                    junctions.add(points[i])
+
+        return junctions
+
+    def build_arcs(self):
+        """
+        Cuts the lines into arcs at the junctions, deduplicates the arcs (an arc can be
+        referenced reversed as ~index) and replaces the line indexes of the geometry
+        objects by lists of arc indexes. Returns the delta-encoded arcs.
+        """
+        junctions = self.find_junctions()
+        arc_indexes = {}
+        arcs = []
+        line_arcs = []
+
+        for points, ring in zip(self.lines, self.rings):
+            cuts = [i for i, point in enumerate(points) if point in junctions]
+            if ring:
+                if cuts:
+                    points = points[cuts[0] :] + points[: cuts[0]]
+                    cuts = [i - cuts[0] for i in cuts]
+                else:
+                    # Rings without junctions start at their smallest point, so that
+                    # identical rings produce identical arcs
+                    start = points.index(min(points))
+                    points = points[start:] + points[:start]
+                    cuts = [0]
+                points = points + [points[0]]
+                cuts.append(len(points) - 1)
+
+            indexes = []
+            for start, end in zip(cuts, cuts[1:]):
+                arc = tuple(points[start : end + 1])
+                index = arc_indexes.get(arc)
+                if index is None:
+                    index = len(arcs)
+                    arcs.append(arc)
+                    arc_indexes[arc] = index
+                    arc_indexes.setdefault(arc[::-1], ~index)
+                indexes.append(index)
+            line_arcs.append(indexes)
+
+        for obj in self.pending:
+            obj["arcs"] = _replace_lines(obj["arcs"], line_arcs)
+
+        return [_delta_encode(arc) for arc in arcs]
+
+
+def _replace_lines(value, line_arcs):
+    if isinstance(value, int):
+        return line_arcs[value]
+    return [_replace_lines(item, line_arcs) for item in value]
+
+
+def _delta_encode(arc):
+    encoded = [list(arc[0])]
+    for (x0, y0), (x1, y1) in zip(arc, arc[1:]):
+        encoded.append([x1 - x0, y1 - y0])
+    return encoded
@@ -27,6 +27,387 @@ class DatabaseFunctionalTests(unittest.TestCase):
         assert len(data["features"]) == 1
         assert data["features"][0]["properties"]["gid"] == 1
 
+    def test_db_with_range_filters(self):
+        res = self.testapp.get(
+            "/api/nyc_homicides/geojson"
+            "?incident_d__between=2010-01-01,2010-12-31&weapon__in=gun,knife",
+            status=200,
+        )
+        features = json.loads(res.body)["features"]
+        assert len(features) > 0
+        for feature in features:
+            assert "2010-01-01" <= feature["properties"]["incident_d"] <= "2010-12-31"
+            assert feature["properties"]["weapon"] in ("gun", "knife")
+
+    def test_db_with_spatial_filter(self):
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/geojson?geom__dwithin=-73.985,40.758,1000",
+            status=200,
+        )
+        assert 0 < len(json.loads(res.body)["features"]) < 100
+
+    def test_db_prepared_statement_reuse(self):
+        # Same query shape, different values: the statement is reused
+        for weapon in ("gun", "knife"):
+            res = self.testapp.get(
+                f"/api/nyc_homicides/geojson?weapon={weapon}&year__gte=2010",
+                status=200,
+            )
+            features = json.loads(res.body)["features"]
+            assert len(features) > 0
+            for feature in features:
+                assert feature["properties"]["weapon"] == weapon
+                assert feature["properties"]["year"] >= 2010
+
+    def test_db_with_invalid_filters(self):
+        res = self.testapp.get("/api/nyc_homicides/geojson?foo=1", status=400)
+        self.assertIn(b"Invalid filter parameters: foo", res.body)
+        self.testapp.get("/api/nyc_homicides/geojson?gid__like=1", status=400)
+        self.testapp.get("/api/nyc_homicides/geojson?gid=abc", status=400)
+        self.testapp.get(
+            "/api/nyc_homicides/geojson?incident_d__gt=yesterday", status=400
+        )
+
+    def test_db_stream(self):
+        res = self.testapp.get("/api/nyc_subway_stations/geojson?stream=1", status=200)
+        self.assertEqual(res.content_type, "application/geo+json")
+        data = json.loads(res.body)
+        assert data["type"] == "FeatureCollection"
+        assert len(data["features"]) > 0
+
+    def test_db_with_bbox_param(self):
+        res = self.testapp.get(
+            "/api/nyc_streets/geojson?bbox=-73.99,40.74,-73.98,40.75&zoom=16",
+            status=200,
+        )
+        data = json.loads(res.body)
+        assert 0 < len(data["features"]) < 1000
+
+    def test_db_with_invalid_bbox(self):
+        res = self.testapp.get("/api/nyc_streets/geojson?bbox=1,2,3", status=400)
+        self.assertIn(b"Invalid bbox", res.body)
+
+    def test_db_pagination(self):
+        count = 0
+        cursor = None
+        while True:
+            query = "limit=100&fields=name"
+            if cursor is not None:
+                query += f"&cursor={cursor}"
+            res = self.testapp.get(f"/api/nyc_subway_stations/geojson?{query}", status=200)
+            data = json.loads(res.body)
+            assert len(data["features"]) <= 100
+            for feature in data["features"]:
+                assert list(feature["properties"]) == ["name"]
+            count += len(data["features"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        res = self.testapp.get("/api/nyc_subway_stations/geojson", status=200)
+        assert count == len(json.loads(res.body)["features"])
+
+    def test_db_pagination_invalid_params(self):
+        self.testapp.get("/api/nyc_subway_stations/geojson?limit=0", status=400)
+        self.testapp.get("/api/nyc_subway_stations/geojson?cursor=foo", status=400)
+        self.testapp.get("/api/nyc_subway_stations/geojson?fields=geom", status=400)
+        self.testapp.get(
+            "/api/nyc_subway_stations/geojson?limit=10&stream=1", status=400
+        )
+
+    def test_db_with_srid_and_precision(self):
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/geojson?gid=1&srid=26918&precision=1", status=200
+        )
+        x, y = json.loads(res.body)["features"][0]["geometry"]["coordinates"]
+        assert x > 500000 and y > 4000000
+        assert round(x, 1) == x
+
+    def test_db_with_invalid_srid_or_precision(self):
+        self.testapp.get("/api/nyc_subway_stations/geojson?srid=foo", status=400)
+        # A vertical EPSG code, which is not in spatial_ref_sys
+        self.testapp.get("/api/nyc_subway_stations/geojson?srid=5703", status=400)
+        self.testapp.get("/api/nyc_subway_stations/geojson?precision=16", status=400)
+
+    def test_db_with_parameters_of_other_endpoints(self):
+        # Only the parameters of the endpoint are not filters
+        for param in ("method=grid", "quantization=1000", "format=fgb", "radius=10"):
+            self.testapp.get(f"/api/nyc_subway_stations/geojson?{param}", status=400)
+        self.testapp.get("/api/nyc_subway_stations/export?format=fgb&zoom=12", status=400)
+        self.testapp.post_json(
+            "/api/nyc_streets/nearest/batch?point=1,2",
+            {"points": [[-8239434.2, 4955524.4]]},
+            status=400,
+        )
+
+    def test_topojson_view(self):
+        res = self.testapp.get(
+            "/api/nyc_census_blocks/topojson?boroname=Manhattan&quantization=10000",
+            status=200,
+        )
+        data = json.loads(res.body)
+        assert data["type"] == "Topology"
+        geometries = data["objects"]["nyc_census_blocks"]["geometries"]
+        assert len(geometries) > 0
+        # Neighboring blocks share arcs, referenced reversed by one of them
+        arcs = [
+            index
+            for geometry in geometries
+            for polygon in geometry["arcs"]
+            for ring in polygon
+            for index in ring
+        ]
+        assert any(index < 0 for index in arcs)
+
+    def test_topojson_view_invalid_quantization(self):
+        self.testapp.get("/api/nyc_census_blocks/topojson?quantization=1", status=400)
+
+    def test_topojson_view_precision(self):
+        self.testapp.get("/api/nyc_census_blocks/topojson?precision=2", status=400)
+
+    def test_db_history_as_of(self):
+        res = self.testapp.get(
+            "/api/nyc_streets_history/geojson?as_of=2010-01-01T00:00:00Z&stream=1",
+            status=200,
+        )
+        data = json.loads(res.body)
+        assert data["type"] == "FeatureCollection"
+
+    def test_db_history_diff(self):
+        res = self.testapp.get(
+            "/api/nyc_streets_history/geojson"
+            "?changed_between=2000-01-01T00:00:00Z,2020-01-01T00:00:00Z&diff=true",
+            status=200,
+        )
+        data = json.loads(res.body)
+        for feature in data["features"] or []:
+            assert feature["properties"]["change"] in ("added", "removed")
+
+    def test_db_history_on_model_without_history(self):
+        self.testapp.get(
+            "/api/nyc_streets/geojson?as_of=2010-01-01T00:00:00Z", status=400
+        )
+
+    def test_db_not_modified(self):
+        res = self.testapp.get("/api/nyc_subway_stations/geojson", status=200)
+        assert res.etag
+        self.testapp.get(
+            "/api/nyc_subway_stations/geojson",
+            headers={"If-None-Match": f'"{res.etag}"'},
+            status=304,
+        )
+
+    def test_db_gzip_encoding(self):
+        import gzip
+        from webob import Request
+
+        for query in ("", "?stream=1"):
+            request = Request.blank(
+                "/api/nyc_subway_stations/geojson" + query,
+                headers={"Accept-Encoding": "gzip"},
+            )
+            res = request.get_response(self.testapp.app)
+            self.assertEqual(res.content_encoding, "gzip")
+            self.assertIn("Accept-Encoding", res.vary)
+            data = json.loads(gzip.decompress(res.body))
+            assert len(data["features"]) > 0
+
+    def test_db_gzip_not_modified(self):
+        from webob import Request
+
+        headers = {"Accept-Encoding": "gzip"}
+        for query in ("", "?stream=1"):
+            url = "/api/nyc_subway_stations/geojson" + query
+            res = Request.blank(url, headers=headers).get_response(self.testapp.app)
+            # Compressed bodies do not share the ETag of the identity body
+            assert res.etag.endswith("-gzip")
+            not_modified = self.testapp.get(
+                url,
+                headers={**headers, "If-None-Match": f'"{res.etag}"'},
+                status=304,
+            )
+            self.assertIn("Accept-Encoding", not_modified.headers["Vary"])
+
+    def test_export_view_flatgeobuf(self):
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/export?format=fgb", status=200
+        )
+        self.assertEqual(res.content_type, "application/flatgeobuf")
+        # FlatGeobuf magic bytes
+        assert res.body[:3] == b"fgb"
+
+    def test_flatgeobuf_max_features(self):
+        from .models.models import DBSession, NycSubwayStations
+        from .services.db_service import DbServices
+
+        db_service = DbServices(DBSession)
+        data = db_service.get_flatgeobuf(NycSubwayStations, {"gid": 1}, None, 1)
+        assert data[:3] == b"fgb"
+        with self.assertRaises(ValueError):
+            db_service.get_flatgeobuf(NycSubwayStations, {}, None, 1)
+
+    def test_export_view_arrow(self):
+        import pyarrow
+
+        # nyc_subway_stations has Numeric columns, fetched as Decimals
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/export?format=arrow", status=200
+        )
+        self.assertEqual(res.content_type, "application/vnd.apache.arrow.stream")
+        table = pyarrow.ipc.open_stream(res.body).read_all()
+        assert table.num_rows > 0
+        assert table.schema.field("id").type == pyarrow.float64()
+
+    def test_export_view_parquet(self):
+        import io
+        import pyarrow.parquet
+
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/export?format=parquet", status=200
+        )
+        table = pyarrow.parquet.read_table(io.BytesIO(res.body))
+        assert table.num_rows > 0
+        assert b"geo" in table.schema.metadata
+
+    def test_export_view_invalid_format(self):
+        self.testapp.get("/api/nyc_subway_stations/export?format=shp", status=400)
+
+    def test_aggregate_view_grid(self):
+        res = self.testapp.get("/api/nyc_homicides/aggregate?zoom=12", status=200)
+        data = json.loads(res.body)
+        total = len(
+            json.loads(self.testapp.get("/api/nyc_homicides/geojson").body)["features"]
+        )
+        assert data["features"][0]["geometry"]["type"] == "Polygon"
+        assert sum(f["properties"]["count"] for f in data["features"]) == total
+
+    def test_aggregate_view_kmeans_grouped(self):
+        res = self.testapp.get(
+            "/api/nyc_homicides/aggregate?method=kmeans&k=5&group_by=weapon"
+            "&date_from=2005-01-01&date_to=2010-12-31",
+            status=200,
+        )
+        data = json.loads(res.body)
+        assert data["features"][0]["geometry"]["type"] == "Point"
+        assert "weapon" in data["features"][0]["properties"]
+
+    def test_aggregate_view_invalid_params(self):
+        self.testapp.get("/api/nyc_streets/aggregate?zoom=12", status=404)
+        self.testapp.get("/api/nyc_homicides/aggregate?method=foo", status=400)
+        self.testapp.get("/api/nyc_homicides/aggregate?zoom=12&group_by=geom", status=400)
+        for scale in ("zoom=nan", "zoom=-inf", "resolution=inf", "resolution=nan"):
+            self.testapp.get(f"/api/nyc_homicides/aggregate?{scale}", status=400)
+
+    def test_enrichment_tables(self):
+        from .models.models import DBSession
+        from .services.enrichment_service import EnrichmentService
+
+        with DBSession.get_bind().begin() as connection:
+            service = EnrichmentService(connection)
+            service.create_tables()
+            service.refresh(full=True)
+            results = service.refresh()
+        assert results["nyc_homicide_neighborhoods"]["mode"] == "skipped"
+
+        res = self.testapp.get(
+            "/api/nyc_homicide_neighborhoods/geojson?neighborhood_gid=72", status=200
+        )
+        data = json.loads(res.body)
+        for feature in data["features"] or []:
+            assert feature["properties"]["neighborhood_gid"] == 72
+            assert "source_hash" not in feature["properties"]
+
+    def test_enrichment_incremental_refresh(self):
+        from sqlalchemy import select, update
+        from .models.enrichments import NycHomicideNeighborhoods
+        from .models.models import DBSession, NycHomicides
+        from .services.enrichment_service import EnrichmentService
+
+        name = "nyc_homicide_neighborhoods"
+        with DBSession.get_bind().connect() as connection:
+            # The changes of the source table are rolled back
+            with connection.begin() as transaction:
+                service = EnrichmentService(connection)
+                service.create_tables()
+                service.refresh([name])
+
+                gid = connection.execute(select(NycHomicides.gid).limit(1)).scalar()
+                connection.execute(
+                    update(NycHomicides)
+                    .where(NycHomicides.gid == gid)
+                    .values(weapon="test")
+                )
+                result = service.refresh([name])[name]
+                self.assertEqual(result["mode"], "incremental")
+                self.assertEqual((result["deleted"], result["inserted"]), (1, 1))
+
+                weapon = connection.execute(
+                    select(NycHomicideNeighborhoods.weapon).where(
+                        NycHomicideNeighborhoods.gid == gid
+                    )
+                ).scalar()
+                self.assertEqual(weapon, "test")
+                self.assertEqual(service.refresh([name])[name]["mode"], "skipped")
+                transaction.rollback()
+
+    def test_tile_view(self):
+        res = self.testapp.get("/api/nyc_neighborhoods/tiles/12/1205/1539.pbf", status=200)
+        self.assertEqual(res.content_type, "application/vnd.mapbox-vector-tile")
+        assert len(res.body) > 0
+
+    def test_tile_view_low_zoom(self):
+        # The tile envelopes are far from rectangular in the SRID of the layers
+        for path in ("1/0/0", "2/1/1", "4/4/6"):
+            res = self.testapp.get(f"/api/nyc_neighborhoods/tiles/{path}.pbf", status=200)
+            assert len(res.body) > 0
+
+    def test_tile_view_buffer(self):
+        import math
+
+        res = self.testapp.get("/api/nyc_subway_stations/geojson", status=200)
+        features = json.loads(res.body)["features"]
+        points = [feature["geometry"]["coordinates"] for feature in features]
+
+        def tile_coordinates(lon, lat, z):
+            n = 2**z
+            y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+            return (lon + 180) / 360 * n, y
+
+        # A station just left of a tile with no station, within half of the 64/4096
+        # buffer of its edge
+        for z, (lon, lat) in ((z, point) for z in range(14, 19) for point in points):
+            x, y = tile_coordinates(lon, lat, z)
+            tile = (math.ceil(x), math.floor(y))
+            if not 0 < tile[0] - x < 32 / 4096:
+                continue
+            if any(
+                tuple(map(math.floor, tile_coordinates(*point, z))) == tile
+                for point in points
+            ):
+                continue
+            res = self.testapp.get(
+                f"/api/nyc_subway_stations/tiles/{z}/{tile[0]}/{tile[1]}.pbf", status=200
+            )
+            assert len(res.body) > 0
+            break
+        else:
+            self.fail("No station near a tile edge")
+
+    def test_tile_view_invalid_coords(self):
+        self.testapp.get("/api/nyc_neighborhoods/tiles/1/5/0.pbf", status=404)
+
+    def test_server_timing_header(self):
+        res = self.testapp.get("/api/nyc_subway_stations/geojson?gid=1", status=200)
+        self.assertIn("db;dur=", res.headers["Server-Timing"])
+        self.assertIn("total;dur=", res.headers["Server-Timing"])
+
+    def test_metrics_view(self):
+        self.testapp.get("/api/nyc_subway_stations/geojson?gid=1", status=200)
+        res = self.testapp.get("/metrics", status=200)
+        self.assertIn(b"geoapp_db_pool_checkout_wait_seconds_count", res.body)
+        self.assertIn(b"geoapp_db_pool_checked_out", res.body)
+        self.assertIn(b"geoapp_request_duration_seconds_bucket", res.body)
+
     def test_spatial_data_view(self):
         res = self.testapp.get(
             "/api/spatial_data?x=-8239434.211335423&y=4955524.41983333", status=200
@@ -50,3 +431,492 @@ class DatabaseFunctionalTests(unittest.TestCase):
         assert data["number_of_homicides"] == 0
         assert data["subway"]["subway_gid"] == 478
         assert abs(data["subway"]["subway_distance"] - 741470.2135) < 0.5
+
+    def test_spatial_data_batch_view(self):
+        res = self.testapp.post_json(
+            "/api/spatial_data/batch",
+            {
+                "type": "MultiPoint",
+                "coordinates": [
+                    [-9239434.211335423, 4955524.41983333],
+                    [-8239434.211335423, 4955524.41983333],
+                ],
+            },
+            status=200,
+        )
+        data = json.loads(res.body)
+        assert len(data) == 2
+        assert data[0]["neighborhoods"] == None
+        assert data[0]["subway"]["subway_gid"] == 478
+        assert data[1]["neighborhoods"][0]["neighborhood_gid"] == 72
+        assert data[1]["subway"]["subway_gid"] == 98
+
+    def test_spatial_data_batch_view_invalid_body(self):
+        res = self.testapp.post_json(
+            "/api/spatial_data/batch", {"points": [[1]]}, status=400
+        )
+        self.assertIn(b"Invalid or missing coordinates", res.body)
+
+    def test_batch_views_unknown_srid(self):
+        body = {"points": [[-73.985, 40.758]], "srid": 999999}
+        res = self.testapp.post_json("/api/spatial_data/batch", body, status=400)
+        self.assertIn(b"Unknown srid 999999", res.body)
+        self.testapp.post_json("/api/nyc_streets/nearest/batch", body, status=400)
+
+    def test_nearest_view(self):
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/nearest?point=-73.985,40.758&k=3&fields=name",
+            status=200,
+        )
+        features = json.loads(res.body)["features"]
+        assert len(features) == 3
+        distances = [feature["properties"]["distance"] for feature in features]
+        assert distances == sorted(distances)
+        assert set(features[0]["properties"]) == {"name", "distance"}
+
+    def test_nearest_view_radius(self):
+        res = self.testapp.get(
+            "/api/nyc_homicides/nearest?point=-73.985,40.758&radius=500&weapon=gun",
+            status=200,
+        )
+        for feature in json.loads(res.body)["features"]:
+            assert feature["properties"]["distance"] <= 500
+            assert feature["properties"]["weapon"] == "gun"
+
+    def test_nearest_view_enrichment(self):
+        from .models.models import DBSession
+        from .services.enrichment_service import EnrichmentService
+
+        with DBSession.get_bind().begin() as connection:
+            service = EnrichmentService(connection)
+            service.create_tables()
+            service.refresh()
+
+        # The model has its own distance column (to the nearest station)
+        res = self.testapp.get(
+            "/api/nyc_street_nearest_stations/nearest?point=-73.985,40.758&k=5",
+            status=200,
+        )
+        features = json.loads(res.body)["features"]
+        assert len(features) == 5
+        distances = [feature["properties"]["distance"] for feature in features]
+        assert distances == sorted(distances)
+        assert "_distance" not in features[0]["properties"]
+
+        res = self.testapp.post_json(
+            "/api/nyc_street_nearest_stations/nearest/batch?k=1",
+            {"points": [[-73.985, 40.758]], "srid": 4326},
+            status=200,
+        )
+        assert len(json.loads(res.body)[0]["features"]) == 1
+
+    def test_nearest_view_invalid_params(self):
+        self.testapp.get("/api/nyc_streets/nearest", status=400)
+        self.testapp.get("/api/nyc_streets/nearest?point=1,2&k=0", status=400)
+        self.testapp.get("/api/nyc_streets/nearest?point=1,2&radius=-1", status=400)
+        self.testapp.get("/api/unknown/nearest?point=1,2", status=404)
+        self.testapp.get("/api/nyc_streets/nearest?point=1,2,999999", status=400)
+
+    def test_nearest_views_default_srid(self):
+        # The point parameter and the batch body share the same default SRID
+        res = self.testapp.get(
+            "/api/nyc_subway_stations/nearest?point=-73.985,40.758&k=1", status=200
+        )
+        batch = self.testapp.post_json(
+            "/api/nyc_subway_stations/nearest/batch?k=1",
+            {"points": [[-73.985, 40.758]]},
+            status=200,
+        )
+        assert json.loads(batch.body)[0] == json.loads(res.body)
+
+    def test_nearest_batch_view(self):
+        res = self.testapp.post_json(
+            "/api/nyc_streets/nearest/batch?k=2",
+            {
+                "type": "MultiPoint",
+                "coordinates": [
+                    [-9239434.211335423, 4955524.41983333],
+                    [-8239434.211335423, 4955524.41983333],
+                ],
+                "srid": 3857,
+            },
+            status=200,
+        )
+        data = json.loads(res.body)
+        assert len(data) == 2
+        assert all(len(collection["features"]) == 2 for collection in data)
+        assert (
+            data[0]["features"][0]["properties"]["distance"]
+            > data[1]["features"][0]["properties"]["distance"]
+        )
+
+    def test_warm_up(self):
+        from unittest import mock
+
+        from geoalchemy2 import Geometry
+        from sqlalchemy import Column, Integer
+        from sqlalchemy.orm import declarative_base
+
+        from .config.warmup import warm_up
+        from .models.models import DBSession, NycStreets
+        from .models.registry import MODEL_REGISTRY
+        from .services.db_service import DbServices
+
+        # A layer whose table does not exist, like an enrichment before its first
+        # refresh
+        class MissingLayer(declarative_base()):
+            __tablename__ = "geoapp_test_missing_layer"
+            gid = Column(Integer, primary_key=True)
+            geom = Column(Geometry("POINT", srid=26918))
+
+        engine = DBSession.get_bind()
+        settings = {
+            "geoapp.warmup.enabled": "true",
+            "geoapp.warmup.connections": "2",
+            "geoapp.warmup.prewarm": "true",
+        }
+        with mock.patch.dict(MODEL_REGISTRY, {"missing_layer": MissingLayer}):
+            with self.assertLogs("geoapp.config.warmup", "INFO") as logs:
+                warm_up(settings, engine)
+        self.assertIn("geoapp_test_missing_layer", "\n".join(logs.output))
+        self.assertNotIn("Warm-up failed", "\n".join(logs.output))
+        self.assertEqual(engine.pool.checkedout(), 0)
+        self.assertGreaterEqual(engine.pool.checkedin(), 2)
+
+        streets_statement = DbServices(None).get_hot_statements([NycStreets])[1][0]
+        with engine.connect() as connection:
+            prepared = connection.info.get("geoapp_prepared_statements", set())
+            self.assertIn("geoapp_spatial_data", prepared)
+            # The other layers are prepared despite the missing table
+            self.assertIn(streets_statement, prepared)
+        # The requests use the prepared statements
+        self.testapp.get("/api/spatial_data?x=-8239434.2&y=4955524.4", status=200)
+
+
+class AsgiFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        from .asgi import create_app
+
+        self.app = create_app("development.ini")
+
+    def request(self, method, path, query_string=b"", body=b""):
+        import asyncio
+
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def call():
+            scope = {
+                "type": "http",
+                "method": method,
+                "path": path,
+                "query_string": query_string,
+                "headers": [(b"content-type", b"application/json")],
+            }
+            await self.app(scope, receive, send)
+            await self.app.interactive.dispose()
+            await self.app.bulk.dispose()
+
+        asyncio.run(call())
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+
+        return messages[0]["status"], body
+
+    def test_spatial_data_view(self):
+        status, body = self.request(
+            "GET", "/api/spatial_data", b"x=-8239434.211335423&y=4955524.41983333"
+        )
+        assert status == 200
+        data = json.loads(body)
+        assert data["neighborhoods"][0]["neighborhood_gid"] == 72
+        assert data["number_of_homicides"] == 0
+        assert data["subway"]["subway_gid"] == 98
+
+    def test_db_view(self):
+        status, body = self.request("GET", "/api/nyc_subway_stations/geojson", b"gid=1")
+        assert status == 200
+        data = json.loads(body)
+        assert len(data["features"]) == 1
+
+    def test_db_view_invalid_filter(self):
+        status, body = self.request("GET", "/api/nyc_subway_stations/geojson", b"gid=abc")
+        assert status == 400
+
+    def test_spatial_data_batch_view_unknown_srid(self):
+        status, body = self.request(
+            "POST",
+            "/api/spatial_data/batch",
+            body=json.dumps({"points": [[0, 0]], "srid": 999999}).encode(),
+        )
+        assert status == 400
+
+
+class CacheServiceTests(unittest.TestCase):
+    def test_memory_backend_evicts_least_recently_used(self):
+        from .services.cache_service import MemoryCacheBackend
+
+        backend = MemoryCacheBackend(10)
+        backend.set("a", b"aaaa")
+        backend.set("b", b"bbbb")
+        assert backend.get("a") == b"aaaa"
+        backend.set("c", b"cccc")
+        assert backend.get("b") is None
+        assert backend.get("a") == b"aaaa"
+        assert backend.get("c") == b"cccc"
+        # Bodies larger than the cache are not stored
+        backend.set("d", b"d" * 11)
+        assert backend.get("d") is None
+
+    def test_filesystem_backend_shared_directory(self):
+        import os
+        import tempfile
+
+        from .services.cache_service import FileSystemCacheBackend
+
+        with tempfile.TemporaryDirectory() as path:
+            # Two processes sharing the directory
+            first = FileSystemCacheBackend(path, 10)
+            second = FileSystemCacheBackend(path, 10)
+
+            first.set("a", b"aaaa")
+            os.utime(os.path.join(path, "a.bin"), (1, 1))
+            second.set("b", b"bbbb")
+            os.utime(os.path.join(path, "b.bin"), (2, 2))
+            assert second.get("a") == b"aaaa"
+
+            # The size and LRU order include the files written by the other process
+            first.set("c", b"cccc")
+            assert first.get("b") is None
+            assert first.get("a") == b"aaaa"
+            assert second.get("c") == b"cccc"
+            total = sum(entry.stat().st_size for entry in os.scandir(path))
+            assert total <= 10
+
+    def test_table_version_probe(self):
+        from .services.cache_service import TableVersionProbe
+
+        class Result:
+            def __init__(self, row):
+                self.row = row
+
+            def first(self):
+                return self.row
+
+        class Session:
+            counters = (1, 2, 3)
+            calls = 0
+
+            def execute(self, stmt):
+                self.calls += 1
+                return Result(self.counters)
+
+        session = Session()
+        probe = TableVersionProbe(ttl=0)
+        version, last_modified = probe.get_version(session, "nyc_streets")
+        assert version == "1-2-3"
+        assert probe.get_version(session, "nyc_streets") == (version, last_modified)
+
+        session.counters = (1, 3, 3)
+        assert probe.get_version(session, "nyc_streets")[0] == "1-3-3"
+        session.counters = None
+        assert probe.get_version(session, "nyc_streets")[0] == "0"
+
+        # Versions are reused within the TTL
+        probe = TableVersionProbe(ttl=60)
+        calls = session.calls
+        probe.get_version(session, "nyc_streets")
+        probe.get_version(session, "nyc_streets")
+        assert session.calls == calls + 1
+
+
+class RequestParamsTests(unittest.TestCase):
+    def get_params(self, query_string):
+        from webob import Request
+
+        from .controllers.request_params import RequestParams
+
+        request = Request.blank("/?" + query_string)
+
+        return RequestParams(request, lambda: {4326, 3857, 26918})
+
+    def test_simplify_tolerance(self):
+        import math
+
+        # One pixel in ground meters at the latitude of New York City
+        tolerance = self.get_params("zoom=12").get_simplify_tolerance()
+        expected = 156543.03392804097 / 2**12 * math.cos(math.radians(40.7))
+        assert math.isclose(tolerance, expected)
+        assert self.get_params("resolution=2.5").get_simplify_tolerance() == 2.5
+        assert self.get_params("").get_simplify_tolerance() is None
+
+    def test_bbox(self):
+        bbox = self.get_params("bbox=-74,40.7,-73.9,40.8").get_bbox()
+        assert bbox == (-74, 40.7, -73.9, 40.8, 4326)
+        bbox = self.get_params("bbox=580000,4500000,590000,4510000,26918").get_bbox()
+        assert bbox[4] == 26918
+
+    def test_bbox_invalid(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        for query_string in (
+            "bbox=1,2,3",
+            "bbox=1,1,0,0",
+            "bbox=nan,nan,nan,nan",
+            "bbox=-inf,-inf,inf,inf",
+            "bbox=0,0,1,1,999999",
+            "bbox=0,0,1,1,4326.5",
+        ):
+            with self.assertRaises(HTTPBadRequest):
+                self.get_params(query_string).get_bbox()
+
+    def test_spatial_filters(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        from .controllers.request_params import GEOJSON_PARAMS
+        from .models.models import NycSubwayStations
+
+        params = self.get_params(
+            "geom__within=580000,4500000,590000,4510000,26918"
+            "&geom__dwithin=-74,40.7,10"
+        )
+        filters = params.get_filters(NycSubwayStations, GEOJSON_PARAMS)
+        assert filters["geom__within"] == (580000, 4500000, 590000, 4510000, 26918)
+        assert filters["geom__dwithin"] == (-74, 40.7, 10, 4326)
+
+        for query_string in (
+            "geom__within=0,0,1,1,999999",
+            "geom__within=0,0,1,1,4326.7",
+            "geom__dwithin=0,0,1,nan",
+            "geom__dwithin=0,0,1,2,3",
+        ):
+            with self.assertRaises(HTTPBadRequest):
+                self.get_params(query_string).get_filters(
+                    NycSubwayStations, GEOJSON_PARAMS
+                )
+
+    def test_output_options(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        params = self.get_params("srid=26918&precision=2")
+        assert params.get_output_options(4326, 6) == (26918, 2)
+        assert self.get_params("").get_output_options(4326, 6) == (4326, 6)
+
+        for query_string in ("srid=foo", "srid=5703", "precision=16"):
+            with self.assertRaises(HTTPBadRequest):
+                self.get_params(query_string).get_output_options(4326, 6)
+
+    def test_simplify_tolerance_invalid(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+
+        for query_string in (
+            "zoom=abc",
+            "zoom=nan",
+            "zoom=inf",
+            "zoom=-2000",
+            "resolution=-1",
+            "resolution=nan",
+            "resolution=inf",
+        ):
+            with self.assertRaises(HTTPBadRequest):
+                self.get_params(query_string).get_simplify_tolerance()
+
+
+class PreparedStatementsTests(unittest.TestCase):
+    def test_prepared_statements_are_evicted(self):
+        from unittest import mock
+
+        from sqlalchemy import Integer, bindparam, literal_column, select
+
+        from .services import prepared_statements
+
+        class Connection:
+            def __init__(self):
+                self.info = {}
+                self.statements = []
+
+            def exec_driver_sql(self, sql):
+                self.statements.append(sql)
+
+        connection = Connection()
+        stmt = select(literal_column("1")).where(
+            bindparam("value", type_=Integer) > 0
+        )
+
+        with mock.patch.object(prepared_statements, "MAX_PREPARED_STATEMENTS", 2):
+            for name in ("geoapp_test_a", "geoapp_test_b", "geoapp_test_a"):
+                prepared_statements.prepare(connection, name, stmt)
+            prepared_statements.prepare(connection, "geoapp_test_c", stmt)
+
+        assert [sql.split(" (")[0] for sql in connection.statements] == [
+            "PREPARE geoapp_test_a",
+            "PREPARE geoapp_test_b",
+            "PREPARE geoapp_test_c",
+            "DEALLOCATE geoapp_test_b",
+        ]
+        assert list(connection.info["geoapp_prepared_statements"]) == [
+            "geoapp_test_a",
+            "geoapp_test_c",
+        ]
+
+    def test_cached_statements_are_evicted(self):
+        from unittest import mock
+
+        from .services import db_service
+
+        with mock.patch.object(db_service, "MAX_CACHED_STATEMENTS", 2):
+            names = [
+                db_service.cached_statement("geoapp_test_", shape, object)[0]
+                for shape in range(3)
+            ]
+            assert names[0] not in db_service._statements
+            assert names[2] in db_service._statements
+
+
+class SpatialIndexTests(unittest.TestCase):
+    def test_concurrent_refresh_reloads_once(self):
+        import threading
+        import time
+        from unittest import mock
+
+        from .services.spatial_index import LocalSpatialIndex
+
+        class Probe:
+            version = "2"
+
+            def get_version(self, session, table_name):
+                return self.version, None
+
+        index = LocalSpatialIndex(Probe())
+        index._versions = {"nyc_neighborhoods": "1"}
+        has_changed = index._has_changed
+        checks = []
+
+        def check(session):
+            checks.append(session)
+            return has_changed(session)
+
+        def load(session):
+            index._versions = {"nyc_neighborhoods": "2"}
+
+        patch_check = mock.patch.object(index, "_has_changed", side_effect=check)
+        patch_load = mock.patch.object(index, "_load", side_effect=load)
+        with patch_check, patch_load as mock_load:
+            threads = [
+                threading.Thread(target=index.refresh_if_changed, args=(None,))
+                for _ in range(2)
+            ]
+            # Both requests see the changed version before the first one reloads
+            with index._lock:
+                for thread in threads:
+                    thread.start()
+                while len(checks) < 2:
+                    time.sleep(0.01)
+            for thread in threads:
+                thread.join()
+
+        assert mock_load.call_count == 1
@@ -12,7 +12,7 @@ requires = [
     'geoalchemy2',
     'waitress',
     'zope.sqlalchemy',
-    'shapely',
+    'shapely>=2.1',
     'pyproj',
 ]
 
@@ -25,15 +25,42 @@ dev_requires = [
     'webtest',
 ]
 
+# Optional dependencies of the Arrow IPC and GeoParquet export formats,
+# installed via `pip install -e ".[export]"`.
+export_requires = [
+    'pyarrow',
+]
+
+# Optional dependencies of the ASGI entry point (geoapp.asgi),
+# installed via `pip install -e ".[async]"`.
+async_requires = [
+    'sqlalchemy[asyncio]',
+    'asyncpg',
+    'uvicorn',
+]
+
+# Optional dependencies of the brotli and zstd response encodings (gzip is always
+# available), installed via `pip install -e ".[compression]"`.
+compression_requires = [
+    'brotli',
+    'zstandard',
+]
+
 setup(
     name='geoapp',
     install_requires=requires,
     extras_require={
         'dev': dev_requires,
+        'export': export_requires,
+        'async': async_requires,
+        'compression': compression_requires,
     },
     entry_points={
         'paste.app_factory': [
             'main = geoapp:main'
         ],
+        'console_scripts': [
+            'geoapp_refresh_enrichments = geoapp.scripts.refresh_enrichments:main',
+        ],
     },
 )
\ No newline at end of file